@@ -2,6 +2,7 @@ from modules.tui import list_view
 from modules.tui import style
 from modules import storage
 
+from collections.abc import Iterator
 from typing import TYPE_CHECKING
 from http import HTTPStatus
 import requests
@@ -13,6 +14,7 @@ if TYPE_CHECKING:
 
 # API_ADRESSS = "http://localhost:8000/api/"
 API_ADRESSS = "http://space7.smallhost.pl:2020/api/"
+UPLOAD_CHUNK_SIZE = 64 * 1024
 
 
 def _validate_server_response(response: requests.Response) -> bool:
@@ -360,20 +362,21 @@ class FileSystemAPI:
         except Exception as exc:
             return _request_error(exc)
         
-    def pull_object(self, path: str) -> dict | bool:
+    def pull_object(self, path: str) -> requests.Response | bool:
+        """ Returns streamed response, content should be consumed with iter_content. """
         try:
             endpoint = self.endpoint_base + "pull"
             data = self.__cwd_auth_data()
             data.update({"path": path})
             
-            response = requests.post(endpoint, json=data)
+            response = requests.post(endpoint, json=data, stream=True)
             status = response.status_code
             
             if not _validate_server_response(response):
                 return False
 
             if status == HTTPStatus.OK:
-                return response.json()
+                return response
             
         except Exception as exc:
             return _request_error(exc)
@@ -396,15 +399,58 @@ class FileSystemAPI:
         except Exception as exc:
             return _request_error(exc)
         
-    def upload_file(self, path: str, content: str) -> None:
+    def append_file(self, path: str, content: str) -> None:
         try:
-            endpoint = self.endpoint_base + "upload"
+            endpoint = self.endpoint_base + "append"
             data = self.__cwd_auth_data()
             data.update({"path": path, "content": content})
             
             response = requests.post(endpoint, json=data)
             status = response.status_code
             
+            if not _validate_server_response(response):
+                return
+
+            if status == HTTPStatus.OK:
+                print(style.success_msg("Appended content."))
+            
+        except Exception as exc:
+            return _request_error(exc)
+        
+    def patch_file(self, path: str, offset: int, content: str) -> None:
+        try:
+            endpoint = self.endpoint_base + "patch"
+            data = self.__cwd_auth_data()
+            data.update({"path": path, "offset": offset, "content": content})
+            
+            response = requests.post(endpoint, json=data)
+            status = response.status_code
+            
+            if not _validate_server_response(response):
+                return
+
+            if status == HTTPStatus.OK:
+                print(style.success_msg("Patched content."))
+            
+        except Exception as exc:
+            return _request_error(exc)
+        
+    def upload_file(self, path: str, local_path: str) -> None:
+        """ Upload local file's content as a stream, so it's never loaded whole into memory. """
+        def read_chunks() -> Iterator[bytes]:
+            with open(local_path, "rb") as file:
+                while chunk := file.read(UPLOAD_CHUNK_SIZE):
+                    yield chunk
+
+        try:
+            endpoint = self.endpoint_base + "upload/stream"
+            auth = _auth()
+            headers = {"X-Drive-Uid": str(auth["uid"]), "X-Drive-Token": auth["token"]}
+            params = {"cwd": self.__get_cwd(), "path": path}
+            
+            response = requests.post(endpoint, params=params, headers=headers, data=read_chunks())
+            status = response.status_code
+            
             if not _validate_server_response(response):
                 return
 
@@ -446,6 +492,21 @@ class DebugAPI:
                 
                 buckets_list.finish()
 
+                chunks_cache = data.get("chunks_cache")
+                if chunks_cache is not None:
+                    lookups = chunks_cache["hits"] + chunks_cache["misses"]
+                    hit_ratio = round(chunks_cache["hits"] / lookups * 100, 2) if lookups else 0.0
+                    print(f"Chunks cache: {style.tcolor(chunks_cache['size'], style.PRIMARY)}/{chunks_cache['budget']}b ({chunks_cache['entries']} messages, {hit_ratio}% hits)")
+
+                placeholder_pool = data.get("placeholder_pool")
+                if placeholder_pool is not None:
+                    print(f"Placeholder pool: {style.tcolor(placeholder_pool['size'], style.PRIMARY)} messages ({placeholder_pool['runs']} runs in {placeholder_pool['channels']} channels)")
+
+                requests_scheduler = data.get("scheduler")
+                if requests_scheduler is not None:
+                    queued = ", ".join(f"{lane}: {n}" for lane, n in requests_scheduler["queued"].items())
+                    print(f"Requests: {style.tcolor(requests_scheduler['active'], style.PRIMARY)}/{requests_scheduler['limit']} running, queued ({queued}), {requests_scheduler['rate_limited']} rate limited")
+
         except Exception as exc:
             return _request_error(exc)
     
@@ -1,11 +1,11 @@
 from modules.tui import style
 
 from datetime import datetime
-import zipfile
-import base64
+import requests
 import os
 
 ROOT_DOWNLOADS_DIR = "./downloads/"
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
 
 
 def ensure_downloads_directory(drive_name: str) -> None:
@@ -19,15 +19,10 @@ def ensure_downloads_directory(drive_name: str) -> None:
         print(style.success_msg(f"Created {drive_name}'s downloads directory."))
     
 
-def handle_pulled_data(drive_name: str, data: dict, override: bool) -> None:
+def handle_pulled_data(drive_name: str, response: requests.Response, override: bool) -> None:
     ensure_downloads_directory(drive_name)
     
-    filename = data.get("name")
-    content = data.get("content")
-    is_zip = data.get("is_zip")
-    
-    if is_zip:
-        content = base64.b64decode(content)
+    filename = response.headers["Content-Disposition"].split("filename=")[1].strip('"')
     
     pull_target = ROOT_DOWNLOADS_DIR + drive_name + "/" + filename
     if os.path.exists(pull_target):
@@ -47,9 +42,9 @@ def handle_pulled_data(drive_name: str, data: dict, override: bool) -> None:
 
             print(f"File already saved, override disabled. Saving as: {style.tcolor(filename, style.PRIMARY)}")
     
-    open_mode = "a+b" if is_zip else "a+"
-    with open(pull_target, open_mode) as file:
-        file.write(content)
+    with open(pull_target, "wb") as file:
+        for content in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+            file.write(content)
 
     print(style.success_msg(f"Downloaded: {style.tcolor(filename, style.PRIMARY)}"))
         
\ No newline at end of file
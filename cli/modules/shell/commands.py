@@ -275,6 +275,26 @@ Command(
     callback=interaction.edit_file
 )
 
+Command(
+    name="append",
+    group=CommandsGroups.FILE_SYSTEM,
+    aliases=["app"],
+    params=[Parameter("Path", _BaseType.TEXT), Parameter("Content", _BaseType.TEXT)],
+    req_perms=perms.PermissionType.WRITE,
+    docs="Append text to the end of file's content. Only the last chunks of the file are rewritten.",
+    callback=interaction.append_file
+)
+
+Command(
+    name="patch",
+    group=CommandsGroups.FILE_SYSTEM,
+    aliases=[],
+    params=[Parameter("Path", _BaseType.TEXT), Parameter("Offset", _BaseType.NUMBER), Parameter("Content", _BaseType.TEXT)],
+    req_perms=perms.PermissionType.WRITE,
+    docs="Overwrite file's content starting at given byte offset with text. Content is extended if text goes past it's end.",
+    callback=interaction.patch_file
+)
+
 Command(
     name="push",
     group=CommandsGroups.FILE_SYSTEM,
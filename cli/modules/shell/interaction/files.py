@@ -4,7 +4,6 @@ from modules import fs
 
 from typing import Any, TYPE_CHECKING
 from click import edit
-import base64
 import os
 
 if TYPE_CHECKING:
@@ -80,11 +79,11 @@ def pull_object(shell: "ShellSession", params: dict[str, Any]) -> None:
     path = params.get("Path")
     override = params.get("Override")
 
-    data = shell.instance.fs_api.pull_object(path)
-    if not data:
+    response = shell.instance.fs_api.pull_object(path)
+    if not response:
         return print(style.error_msg("Failed to pull object."))
     
-    downloads.handle_pulled_data(shell.instance.name, data, override)
+    downloads.handle_pulled_data(shell.instance.name, response, override)
     
 
 def edit_file(shell: "ShellSession", params: dict[str, Any]) -> None:
@@ -101,6 +100,14 @@ def edit_file(shell: "ShellSession", params: dict[str, Any]) -> None:
     shell.instance.fs_api.write_file(path, edited_content)
 
 
+def append_file(shell: "ShellSession", params: dict[str, Any]) -> None:
+    shell.instance.fs_api.append_file(params.get("Path"), params.get("Content"))
+
+
+def patch_file(shell: "ShellSession", params: dict[str, Any]) -> None:
+    shell.instance.fs_api.patch_file(params.get("Path"), params.get("Offset"), params.get("Content"))
+
+
 def upload_file(shell: "ShellSession", params: dict[str, Any]) -> None:
     local_path = params.get("LocalPath")
     filename = os.path.basename(local_path)
@@ -109,8 +116,5 @@ def upload_file(shell: "ShellSession", params: dict[str, Any]) -> None:
     if not os.path.exists(local_path):
         return print(style.error_msg(f"Local file not found: {local_path}"))
 
-    with open(local_path, "rb") as file:
-        content = base64.b64encode(file.read()).decode()
-    
-    shell.instance.fs_api.upload_file(path, content)
+    shell.instance.fs_api.upload_file(path, local_path)
     
\ No newline at end of file
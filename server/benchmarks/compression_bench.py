@@ -0,0 +1,73 @@
+"""
+Compare amount of Discord messages needed to store a text corpus
+with every compression codec.
+
+Usage (from the server directory):
+    python -m benchmarks.compression_bench [path ...]
+
+Paths can be files or directories (searched recursively). Defaults to
+the repository's own source files.
+"""
+from modules.filesystem import compression, encoding
+from modules import limits
+
+import math
+import sys
+import os
+
+
+TEXT_EXTENSIONS = (".py", ".md", ".txt", ".json", ".log", ".csv", ".html", ".js", ".css")
+
+
+def iter_corpus(paths: list[str]) -> list[bytes]:
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            files.append(path)
+            continue
+
+        for root, _, names in os.walk(path):
+            files.extend(os.path.join(root, name) for name in names if name.endswith(TEXT_EXTENSIONS))
+
+    contents = []
+    for path in sorted(files):
+        with open(path, "rb") as file:
+            contents.append(file.read())
+
+    return contents
+
+
+ENCODINGS = (encoding.B64, encoding.B85, encoding.B32K)
+
+
+def count_messages(data: bytes, encoding_name: str = encoding.DEFAULT) -> int:
+    """ Index page is not included. """
+    chunk_chars = encoding.get(encoding_name).chunk_chars(limits.MSG_SIZE)
+    return math.ceil(len(encoding.encode(encoding_name, data)) / chunk_chars)
+
+
+def main() -> None:
+    paths = sys.argv[1:] or [os.path.join(os.path.dirname(__file__), "..", "..")]
+    corpus = iter_corpus(paths)
+
+    # codec: [stored bytes, {encoding: messages}]
+    totals = {codec: [0, dict.fromkeys(ENCODINGS, 0)] for codec in ("raw", "zlib", "bz2", "lzma", "auto")}
+
+    for content in corpus:
+        for codec in ("raw", "zlib", "bz2", "lzma", None):
+            _, stored = compression.compress(content, codec)
+            total = totals[codec or "auto"]
+            total[0] += len(stored)
+            for encoding_name in ENCODINGS:
+                total[1][encoding_name] += count_messages(stored, encoding_name)
+
+    raw_messages = totals["raw"][1][encoding.DEFAULT]
+    print(f"Corpus: {len(corpus)} files, {totals['raw'][0]} bytes")
+    print(f"{'codec':<6} {'stored bytes':>14} " + " ".join(f"{name + ' msgs':>10}" for name in ENCODINGS) + f" {'vs raw':>8}")
+    for codec, (size, messages) in totals.items():
+        ratio = messages[encoding.DEFAULT] / raw_messages if raw_messages else 1
+        print(f"{codec:<6} {size:>14} " + " ".join(f"{messages[name]:>10}" for name in ENCODINGS) + f" {ratio:>7.1%}")
+
+
+if __name__ == "__main__":
+    main()
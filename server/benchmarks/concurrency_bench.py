@@ -0,0 +1,74 @@
+"""
+Run concurrent writes on a fake backend (see `fake_discord.py`) with small
+data channels and check that no channel is overcommitted, every file
+reads back intact and locked files can't be renamed, removed or written
+by another operation.
+
+Usage (from the server directory):
+    python -m benchmarks.concurrency_bench [files]
+"""
+from benchmarks import fake_discord
+from modules.discord.data import _split_mem_content
+from modules import limits
+from modules import errors
+
+import asyncio
+import random
+import sys
+
+
+UID = 1
+CHANNEL_SIZE = 20_000
+FILE_SIZE = 24_000  # Hex text, doesn't compress below a single channel's size.
+
+
+async def bench(files: int) -> bool:
+    limits.TOTAL_CHANNEL_CONTENT_SIZE = CHANNEL_SIZE
+    drive = await fake_discord.make_drive(data_channels=2)
+    memory_manager = drive.memory_manager
+
+    random.seed(0)
+    texts = {f"f{i}": random.randbytes(FILE_SIZE // 2).hex() for i in range(files)}
+    for name in texts:
+        assert await drive.create_file(UID, name) is True
+
+    writes = asyncio.gather(*(drive.write_file(UID, name, text) for name, text in texts.items()))
+    while "~/f0" not in drive.locked_files:
+        await asyncio.sleep(0)
+    locked = [await drive.rename(UID, "f0", "renamed"), await drive.delete_fs_obj(UID, "f0")]
+    results = await writes
+
+    ok = all(result is True for result in results)
+    print(f"{files} parallel writes of {FILE_SIZE}B into {CHANNEL_SIZE}B channels: {results.count(True)} succeeded")
+    print(f"rename/remove of a file being written: {locked}")
+    ok &= locked == [errors.FILE_LOCKED, errors.FILE_LOCKED]
+
+    for bucket in memory_manager.buckets.values():
+        for channel in bucket.data_channels.values():
+            used = sum(len(_split_mem_content(msg.content)[0]) for msg in channel.messages.values())
+            over = used > CHANNEL_SIZE
+            ok &= not over and used == bucket.cache[channel.id]
+            print(f"channel {channel.name}: cached {bucket.cache[channel.id]}B, stored {used}B {'OVER LIMIT' if over else ''}")
+
+    appends = await asyncio.gather(drive.append_file(UID, "f1", b"first"), drive.append_file(UID, "f1", b"second"))
+    print(f"parallel appends to one file: {appends}")
+    ok &= appends == [True, errors.FILE_LOCKED]
+    texts["f1"] += "first"
+
+    for name, text in texts.items():
+        ok &= await drive.get_file_content(UID, name) == text.encode()
+
+    print(f"reserved after writes: {memory_manager.allocator.reserved_size()}B")
+    ok &= memory_manager.allocator.reserved_size() == 0
+    print("OK" if ok else "FAILED")
+    return ok
+
+
+def main() -> None:
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    if not asyncio.run(bench(files)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+In-memory fake of the Discord objects used by `modules.discord.data`.
+
+Counts every simulated API call in `CALLS` (by kind: send, edit, fetch,
+history, ...) and can add fixed latency to each of them, so amount of
+Discord requests made by drive operations can be measured offline.
+
+Must be imported before any `modules` import: it switches into a
+temporary working directory (so local data files of the server are
+never touched) and replaces discord.py classes checked by the drive.
+"""
+import collections
+import itertools
+import tempfile
+import datetime
+import asyncio
+import types
+import sys
+import os
+
+
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, SERVER_DIR)
+
+_workdir = tempfile.mkdtemp(prefix="drivecord-bench-")
+os.makedirs(os.path.join(_workdir, "logs"))
+os.makedirs(os.path.join(_workdir, "data"))
+for name in ("access_tokens", "guilds", "users"):
+    with open(os.path.join(_workdir, "data", name + ".json"), "w") as file:
+        file.write("{}")
+os.chdir(_workdir)
+
+import discord  # noqa: E402
+
+
+BOT_ID = 999
+CALLS = collections.Counter()
+LATENCY = [0.0]  # Seconds added to every simulated API call.
+
+_ids = itertools.count(1000)
+
+
+class FakeNotFound(discord.NotFound):
+    def __init__(self) -> None:
+        Exception.__init__(self, "Unknown Message")
+
+
+async def _request(kind: str) -> None:
+    CALLS[kind] += 1
+    if LATENCY[0]:
+        await asyncio.sleep(LATENCY[0])
+
+
+class FakeAttachment:
+    def __init__(self, filename: str, data: bytes) -> None:
+        self.filename = filename
+        self.size = len(data)
+        self.url = f"https://cdn.fake/{filename}"
+        self._data = data
+
+    async def read(self) -> bytes:
+        await _request("cdn")
+        return self._data
+
+
+class FakeMessage:
+    def __init__(self, channel: "FakeChannel", content: str, author_id: int = BOT_ID, attachments: list[FakeAttachment] = ()) -> None:
+        self.id = next(_ids)
+        self.channel = channel
+        self.guild = channel.guild
+        self.content = content
+        self.author = types.SimpleNamespace(id=author_id)
+        self.attachments = list(attachments)
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.edited_at = None
+
+    @property
+    def jump_url(self) -> str:
+        return f"https://discord.fake/{self.channel.id}/{self.id}"
+
+    def _copy(self) -> "FakeMessage":
+        """ Messages returned by the API are snapshots, not live objects. """
+        copy = FakeMessage.__new__(FakeMessage)
+        copy.__dict__.update(self.__dict__)
+        copy.attachments = list(self.attachments)
+        return copy
+
+    async def edit(self, content: str | None = None, attachments: list | None = None, **_) -> "FakeMessage":
+        await _request("edit")
+        stored = self.channel.messages.get(self.id)
+        if stored is None:
+            raise FakeNotFound()
+
+        if content is not None:
+            stored.content = content
+        if attachments is not None:
+            stored.attachments = [a if isinstance(a, FakeAttachment) else FakeAttachment(a.filename, a.fp.read()) for a in attachments]
+        stored.edited_at = datetime.datetime.now(datetime.timezone.utc)
+        return stored._copy()
+
+    async def delete(self) -> None:
+        await _request("delete")
+        if self.channel.messages.pop(self.id, None) is None:
+            raise FakeNotFound()
+
+    async def fetch(self) -> "FakeMessage":
+        await _request("fetch")
+        stored = self.channel.messages.get(self.id)
+        if stored is None:
+            raise FakeNotFound()
+        return stored._copy()
+
+
+class FakePartialMessage:
+    def __init__(self, channel: "FakeChannel", id: int) -> None:
+        self.channel = channel
+        self.guild = channel.guild
+        self.id = id
+
+    @property
+    def jump_url(self) -> str:
+        return f"https://discord.fake/{self.channel.id}/{self.id}"
+
+    def _stored(self) -> FakeMessage:
+        stored = self.channel.messages.get(self.id)
+        if stored is None:
+            raise FakeNotFound()
+        return stored
+
+    async def fetch(self) -> FakeMessage:
+        await _request("fetch")
+        return self._stored()._copy()
+
+    async def edit(self, **kwargs) -> FakeMessage:
+        if self.id not in self.channel.messages:
+            await _request("edit")
+        return await self._stored().edit(**kwargs)
+
+    async def delete(self) -> None:
+        if self.id not in self.channel.messages:
+            await _request("delete")
+        await self._stored().delete()
+
+
+class FakeCachedMessage(FakePartialMessage):
+    """ Replacement of `data._CachedMessage` (message restored from the disk chunks cache). """
+    def __init__(self, channel: "FakeChannel", message_id: int, content: str, edited_at: datetime.datetime) -> None:
+        super().__init__(channel, message_id)
+        self.content = content
+        self.attachments = []
+        self.edited_at = edited_at
+        self.created_at = edited_at
+
+
+class FakeChannel:
+    def __init__(self, guild: "FakeGuild", name: str, category: "FakeCategory | None" = None) -> None:
+        self.id = next(_ids)
+        self.guild = guild
+        self.name = name
+        self.category = category
+        self.category_id = category.id if category is not None else None
+        self.messages: dict[int, FakeMessage] = {}
+        guild.channels[self.id] = self
+
+    async def send(self, content: str | None = None, files: list | None = None, file=None, **_) -> FakeMessage:
+        await _request("send")
+        files = files or ([file] if file is not None else [])
+        message = FakeMessage(self, content or "", attachments=[FakeAttachment(f.filename, f.fp.read()) for f in files])
+        self.messages[message.id] = message
+        return message._copy()
+
+    def get_partial_message(self, id: int) -> FakePartialMessage:
+        return FakePartialMessage(self, id)
+
+    async def fetch_message(self, id: int) -> FakeMessage:
+        return await FakePartialMessage(self, id).fetch()
+
+    async def delete_messages(self, messages: list) -> None:
+        await _request("bulk_delete")
+        for message in messages:
+            self.messages.pop(message.id, None)
+
+    async def set_permissions(self, *_, **__) -> None:
+        await _request("permissions")
+
+    def history(self, limit: int | None = 100, after=None, before=None, oldest_first: bool | None = None):
+        """ Pages of up to 100 messages, each page is a single request. """
+        ids = sorted(self.messages)
+        if after is not None:
+            ids = [id for id in ids if id > after.id]
+        if before is not None:
+            ids = [id for id in ids if id < before.id]
+        if not (oldest_first if oldest_first is not None else after is not None):
+            ids.reverse()
+        if limit is not None:
+            ids = ids[:limit]
+
+        async def pages():
+            for start in range(0, max(len(ids), 1), 100):
+                await _request("history")
+                for id in ids[start:start + 100]:
+                    if id in self.messages:
+                        yield self.messages[id]._copy()
+
+        return pages()
+
+
+class FakeCategory:
+    def __init__(self, guild: "FakeGuild", name: str) -> None:
+        self.id = next(_ids)
+        self.guild = guild
+        self.name = name
+        self.text_channels = []
+        guild.categories.append(self)
+        guild.channels[self.id] = self
+
+    async def create_text_channel(self, name: str, **_) -> FakeChannel:
+        await _request("create_channel")
+        channel = FakeChannel(self.guild, name, self)
+        self.text_channels.append(channel)
+        return channel
+
+
+class FakeGuild:
+    def __init__(self, name: str = "bench") -> None:
+        self.id = next(_ids)
+        self.name = name
+        self.owner_id = 1
+        self.default_role = object()
+        self.categories = []
+        self.channels = {}
+
+    def get_channel(self, id: int) -> FakeChannel | FakeCategory | None:
+        return self.channels.get(id)
+
+    def get_role(self, id: int):
+        return types.SimpleNamespace(id=id)
+
+    def get_member(self, _: int) -> None:
+        return None
+
+    async def create_category(self, name: str, **_) -> FakeCategory:
+        await _request("create_category")
+        return FakeCategory(self, name)
+
+
+discord.Message = FakeMessage
+discord.PartialMessage = FakePartialMessage
+discord.TextChannel = FakeChannel
+discord.CategoryChannel = FakeCategory
+discord.NotFound = FakeNotFound
+
+from modules.filesystem import fs  # noqa: E402
+from modules.discord import data  # noqa: E402
+from modules import limits  # noqa: E402
+
+data._CachedMessage = FakeCachedMessage
+data.client = types.SimpleNamespace(user=types.SimpleNamespace(id=BOT_ID))
+limits.ROUTES_RATE_LIMITS = {}
+
+
+async def make_drive(data_channels: int = 1) -> "data.DriveGuild":
+    """ Fake guild with a fresh drive (empty structure and single bucket). """
+    guild = FakeGuild()
+    meta = FakeCategory(guild, "drive")
+    logs_ch = await meta.create_text_channel("_logs")
+    struct_ch = await meta.create_text_channel("_struct")
+    journal_ch = await meta.create_text_channel("_journal")
+    console_ch = await meta.create_text_channel("console")
+
+    bucket = FakeCategory(guild, "data_0")
+    await bucket.create_text_channel("_cache")
+    for index in range(data_channels):
+        await bucket.create_text_channel(str(index))
+
+    await struct_ch.send(_empty_struct_header())
+
+    memory_manager = await data.MemoryManager.init(guild)
+    drive = data.DriveGuild(guild, logs_ch, struct_ch, console_ch, None, None, memory_manager, journal_ch)
+    data.DriveGuild._register[guild.id] = drive
+    CALLS.clear()
+    return drive
+
+
+def _empty_struct_header() -> str:
+    from modules.filesystem import compression, encoding
+
+    codec, payload = compression.compress(fs.FS_Dir("~", None).export().encode(), data.STRUCT_CODEC)
+    payload = encoding.encode(encoding.DEFAULT, payload)
+    fields = [f"v{data.STRUCT_VERSION}", codec, encoding.DEFAULT, str(len(payload)), "0", ""]
+    return data.STRUCT_HEADER_SEP.join(fields + [payload])
+
+
+async def make_chain_file(drive: "data.DriveGuild", name: str, content: bytes) -> None:
+    """ Store content in a legacy chain file (every chunk points to the next one) at drive's root. """
+    from modules.filesystem import encoding, journal
+
+    chunks = drive.memory_manager.split_content(encoding.encode(encoding.B64, content))
+    channels = [channel for bucket in drive.memory_manager.buckets.values() for channel in bucket.data_channels.values()]
+    next_addr = "END"
+    for i, chunk in reversed(list(enumerate(chunks))):
+        message = await channels[i % len(channels)].send(f"{chunk}@{next_addr}")
+        await drive.memory_manager.update_cache_size(message, len(chunk))
+        next_addr = fs.MemoryAddress.from_message(message).prepare_mem_addr()
+
+    async with drive._struct_lock:
+        struct = await drive.get_struct()
+        file = fs.FS_File(name, struct, fs.MemoryAddress.from_str(next_addr), len(content))
+        assert await drive.journal_struct(journal.put_file(file))
+
+    CALLS.clear()
@@ -0,0 +1,82 @@
+"""
+Count Discord requests made by appends and patches on a fake backend
+(see `fake_discord.py`) and check that patched files read back intact.
+
+Usage (from the server directory):
+    python -m benchmarks.patch_bench
+
+Legacy chain file is converted by it's first patch (it's rewritten once
+without compression), following patches only touch covered messages.
+"""
+from benchmarks import fake_discord
+from benchmarks.fake_discord import CALLS
+
+import asyncio
+import random
+import sys
+
+
+UID = 1
+
+
+def _format(calls: dict[str, int]) -> str:
+    return ", ".join(f"{kind}={count}" for kind, count in sorted(calls.items())) or "-"
+
+
+async def bench() -> bool:
+    drive = await fake_discord.make_drive(data_channels=2)
+    random.seed(0)
+
+    files = {
+        "legacy": b"legacy chain file content\n" * 220,
+        "blank": b"",
+    }
+    await fake_discord.make_chain_file(drive, "legacy", files["legacy"])
+    assert await drive.create_file(UID, "blank") is True
+
+    operations = [
+        ("legacy", None, b"appended\n"),
+        ("legacy", 10, b"PATCHED"),
+        ("legacy", None, b"appended again\n"),
+        ("blank", None, b"first line\n"),
+        ("blank", 0, b"FIRST"),
+    ]
+
+    ok = True
+    print(f"{'operation':>28} {'requests':>9}  by kind")
+    for name, offset, data in operations:
+        CALLS.clear()
+        if offset is None:
+            result = await drive.append_file(UID, name, data)
+            offset = len(files[name])
+        else:
+            result = await drive.patch_file(UID, name, offset, data)
+
+        files[name] = files[name][:offset] + data + files[name][offset + len(data):]
+        calls = dict(CALLS)
+        label = f"{name} +{len(data)}B at {offset}"
+        print(f"{label:>28} {sum(calls.values()):>9}  {_format(calls)}")
+        ok &= result is True
+
+    invalid = await drive.patch_file(UID, "legacy", len(files["legacy"]) + 1, b"x")
+    print(f"patch past the end: {invalid}")
+    ok &= invalid is not True
+
+    drive.memory_manager.chunks_cache.clear()
+    for name, content in files.items():
+        stored = await drive.get_file_content(UID, name)
+        size = (await drive.get_struct()).move_to(name).size
+        ok &= stored == content and size == len(content)
+        print(f"{name}: {len(stored)}B stored, {size}B in structure, expected {len(content)}B")
+
+    print("OK" if ok else "FAILED")
+    return ok
+
+
+def main() -> None:
+    if not asyncio.run(bench()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Count Discord requests made by file writes and reads on a fake backend
+(see `fake_discord.py`), split by request kind.
+
+Usage (from the server directory):
+    python -m benchmarks.write_bench
+
+Each write of a sequence rewrites the same file, so the counts include
+reading and releasing the previous content. Reads are measured twice:
+served by the disk chunks cache and cold (without any chunks cache).
+Small edits of a compressible text file show the cost of a modal or
+CLI `edit` (only chunks around the edit should be stored again).
+"""
+from benchmarks import fake_discord
+from benchmarks.fake_discord import CALLS
+
+import asyncio
+import random
+
+
+UID = 1
+SIZES = [150_000, 150_010, 7, 20_000, 0, 150_000]
+EDITED_SIZE = 300_000
+EDITS = [
+    ("replace 1 char", lambda text: text[:len(text) // 2] + "X" + text[len(text) // 2 + 1:]),
+    ("insert 1 char", lambda text: text[:len(text) // 3] + "Y" + text[len(text) // 3:]),
+    ("remove 1 line", lambda text: text[:len(text) // 4] + text[len(text) // 4:].split("\n", 1)[-1]),
+    ("append 1 line", lambda text: text + "appended line\n"),
+]
+
+
+def _text(size: int) -> str:
+    return "".join(random.choice("abcdef \n") for _ in range(size))
+
+
+def _format(calls: dict[str, int]) -> str:
+    return ", ".join(f"{kind}={count}" for kind, count in sorted(calls.items())) or "-"
+
+
+async def bench() -> None:
+    drive = await fake_discord.make_drive(data_channels=2)
+    assert await drive.create_file(UID, "bench.txt") is True
+
+    random.seed(0)
+    previous = None
+    print(f"{'write':>20} {'requests':>9}  by kind")
+    for size in SIZES:
+        text = _text(size)
+        CALLS.clear()
+        assert await drive.write_file(UID, "bench.txt", text) is True
+        calls = dict(CALLS)
+
+        label = f"{previous}B -> {size}B" if previous is not None else f"new {size}B"
+        print(f"{label:>20} {sum(calls.values()):>9}  {_format(calls)}")
+        for read_label, read_calls in [("read (disk cache)", await _read(drive, text, True)), ("read (cold)", await _read(drive, text, False))]:
+            print(f"{read_label:>20} {sum(read_calls.values()):>9}  {_format(read_calls)}")
+        previous = size
+
+    text = _text(EDITED_SIZE)
+    assert await drive.write_file(UID, "bench.txt", text) is True
+    print(f"\n{f'edit of {EDITED_SIZE}B':>20} {'requests':>9}  by kind")
+    for label, edit in EDITS:
+        text = edit(text)
+        CALLS.clear()
+        assert await drive.write_file(UID, "bench.txt", text) is True
+        calls = dict(CALLS)
+        print(f"{label:>20} {sum(calls.values()):>9}  {_format(calls)}")
+
+    assert await drive.get_file_content(UID, "bench.txt") == text.encode()
+
+
+async def _read(drive, text: str, with_disk: bool) -> dict[str, int]:
+    cache = drive.memory_manager.chunks_cache
+    cache.clear()
+    disk, cache.disk = cache.disk, cache.disk if with_disk else None
+
+    CALLS.clear()
+    try:
+        assert await drive.get_file_content(UID, "bench.txt") == text.encode()
+    finally:
+        cache.disk = disk
+        cache.clear()
+    return dict(CALLS)
+
+
+def main() -> None:
+    asyncio.run(bench())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from modules.discord.data import DriveGuild, fs
+from modules.discord.data import DriveGuild, MemoryStreamError, UploadInterruptedError, fs
 from modules.discord.client import client
 from modules.paths import sizeof_fmt
 from modules.logs import Log
@@ -7,11 +7,12 @@ from modules import schemas
 from modules import errors
 from modules import perms
 
-from fastapi.responses import JSONResponse, Response, PlainTextResponse
+from fastapi.responses import JSONResponse, Response, PlainTextResponse, StreamingResponse
 from typing import Union, Tuple, TypeVar, Any, Coroutine
 from fastapi.middleware.cors import CORSMiddleware
-from collections.abc import Callable
-from fastapi import FastAPI, Request
+from collections.abc import Callable, AsyncIterator, Iterator
+from starlette.requests import ClientDisconnect
+from fastapi import FastAPI, Request, Depends, Header
 from discord import Guild, Message
 from http import HTTPStatus
 import asyncio
@@ -23,6 +24,92 @@ R = TypeVar("R")
 def run_async(async_fn: Callable[[Any], Coroutine[Any, Any, R]]) -> R:
     return asyncio.run_coroutine_threadsafe(async_fn, client.loop).result()
 
+async def await_async(async_fn: Coroutine[Any, Any, R]) -> R:
+    """ Await coroutine in Discord client's loop without blocking API's loop. """
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(async_fn, client.loop))
+
+async def _next_item(async_iter: AsyncIterator[R]) -> tuple[bool, R | None]:
+    try:
+        return True, await anext(async_iter)
+    except StopAsyncIteration:
+        return False, None
+
+def iterate_async(async_iter: AsyncIterator[R]) -> Iterator[R]:
+    """ Iterate over async iterator running in Discord client's loop. Used by streaming responses (run in threadpool). """
+    try:
+        while True:
+            has_item, item = run_async(_next_item(async_iter))
+            if not has_item:
+                return
+            yield item
+
+    except MemoryStreamError as error:
+        # Response is already started, so it can only be aborted.
+        Log.error(f"Streaming response aborted: {error.args[0]}")
+        raise
+
+    finally:
+        run_async(async_iter.aclose())
+
+async def bridge_async(async_iter: AsyncIterator[R], loop: asyncio.AbstractEventLoop) -> AsyncIterator[R]:
+    """ Iterate (in Discord client's loop) over async iterator running in other loop. Items are pulled one by one. """
+    while True:
+        has_item, item = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(_next_item(async_iter), loop))
+        if not has_item:
+            return
+        yield item
+
+async def request_body(request: Request) -> AsyncIterator[bytes]:
+    try:
+        async for data in request.stream():
+            if data:
+                yield data
+    except ClientDisconnect:
+        raise UploadInterruptedError()
+
+def parse_range(request: Request, size: int) -> Tuple[bool, Tuple[int, int] | None]:
+    """
+    Parse single `bytes` range of Range header. Returns (is satisfiable, (first, last) byte or None for whole content).
+    Other (or multiple) ranges are ignored, so the whole content is sent.
+    """
+    unit, _, ranges = request.headers.get("Range", "").partition("=")
+    if unit.strip() != "bytes" or "," in ranges:
+        return True, None
+
+    first, _, last = ranges.strip().partition("-")
+    if not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+        return True, None
+
+    if not first:
+        # Suffix range (last N bytes).
+        if int(last) == 0:
+            return False, None
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        first, last = int(first), min(int(last), size - 1) if last else size - 1
+
+    if first > last:
+        return False, None
+    return True, (first, last)
+
+def range_not_satisfiable_response(size: int) -> Response:
+    return Response(status_code=HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, headers={"Content-Range": f"bytes */{size}"})
+
+def content_stream_response(
+        stream: AsyncIterator[bytes], media_type: str, size: int | None = None, byte_range: Tuple[int, int] | None = None, headers: dict | None = None
+    ) -> StreamingResponse:
+    headers = headers or {}
+    if size is not None:
+        headers["Accept-Ranges"] = "bytes"
+
+    if byte_range is None:
+        return StreamingResponse(iterate_async(stream), HTTPStatus.OK, headers, media_type)
+
+    first, last = byte_range
+    headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+    headers["Content-Length"] = str(last - first + 1)
+    return StreamingResponse(iterate_async(stream), HTTPStatus.PARTIAL_CONTENT, headers, media_type)
+
 def rich_error_response(err_msg: str) -> PlainTextResponse:
     return PlainTextResponse(err_msg, HTTPStatus.CONFLICT)
 
@@ -75,6 +162,13 @@ api.add_middleware(
 )
 
 
+@api.on_event("shutdown")
+def flush_caches() -> None:
+    """ Save changed buckets caches and remove unused placeholders before Discord client's thread is killed. """
+    if client.is_ready():
+        run_async(DriveGuild.flush_all())
+
+
 @api.get("/api/")
 async def check_status() -> Response:
     return Response(status_code=HTTPStatus.OK)
@@ -295,7 +389,7 @@ async def rename_obj(instance_id: int, data: schemas.Rename, request: Request) -
     return Response(status_code=HTTPStatus.OK)
     
 @api.post(FS_API + "{instance_id}/pull")
-async def pull_obj(instance_id: int, data: schemas.Path, request: Request) -> JSONResponse:
+async def pull_obj(instance_id: int, data: schemas.Path, request: Request) -> StreamingResponse:
     status, response = await prepare_restricted_endpoint_data(instance_id, data, request)
     if not status:
         return response
@@ -303,14 +397,31 @@ async def pull_obj(instance_id: int, data: schemas.Path, request: Request) -> JS
     user, _, drive_manager = response
     end_path = data.cwd + data.path 
     
-    file_data = run_async(drive_manager.pull_object(user.discord_id, end_path))
-    if isinstance(file_data, errors.T_Error):
-        return rich_error_response(file_data)
-    
-    return JSONResponse(file_data.as_json_response(), status_code=HTTPStatus.OK)
+    # Range is supported for files only.
+    struct_base: fs.FS_Dir = run_async(drive_manager.get_struct())
+    target = struct_base.move_to(end_path)
+    size, byte_range = None, None
+    
+    if isinstance(target, fs.FS_File):
+        size = target.size
+        satisfiable, byte_range = parse_range(request, size)
+        if not satisfiable:
+            return range_not_satisfiable_response(size)
+    
+    offset, length = (byte_range[0], byte_range[1] - byte_range[0] + 1) if byte_range else (0, None)
+    streamed_object = run_async(drive_manager.stream_object(user.discord_id, end_path, offset, length))
+    if isinstance(streamed_object, errors.T_Error):
+        return rich_error_response(streamed_object)
+    
+    headers = {
+        "Content-Disposition": f'attachment; filename="{streamed_object.name}"',
+        "X-Is-Zip": str(int(streamed_object.is_zip))
+    }
+    media_type = "application/zip" if streamed_object.is_zip else "application/octet-stream"
+    return content_stream_response(streamed_object.content, media_type, size, byte_range, headers)
     
 @api.post(FS_API + "{instance_id}/read")
-async def read_file(instance_id: int, data: schemas.Path, request: Request) -> PlainTextResponse:
+async def read_file(instance_id: int, data: schemas.Path, request: Request) -> StreamingResponse:
     status, response = await prepare_restricted_endpoint_data(instance_id, data, request)
     if not status:
         return response
@@ -327,11 +438,16 @@ async def read_file(instance_id: int, data: schemas.Path, request: Request) -> P
     if isinstance(target, fs.FS_Dir):
         return rich_error_response(errors.PATH_TO_DIR)
     
-    status = run_async(drive_manager._read_file(target))
-    if isinstance(status, errors.T_Error):
-        return rich_error_response(status)
+    satisfiable, byte_range = parse_range(request, target.size)
+    if not satisfiable:
+        return range_not_satisfiable_response(target.size)
+    
+    offset, length = (byte_range[0], byte_range[1] - byte_range[0] + 1) if byte_range else (0, None)
+    stream = run_async(drive_manager.stream_file(target, offset, length))
+    if isinstance(stream, errors.T_Error):
+        return rich_error_response(stream)
     
-    return PlainTextResponse(content=status.decode(), status_code=HTTPStatus.OK)
+    return content_stream_response(stream, "text/plain; charset=utf-8", target.size, byte_range)
     
 @api.post(FS_API + "{instance_id}/write")
 async def write_file(instance_id: int, data: schemas.Write, request: Request) -> Response:
@@ -357,6 +473,54 @@ async def write_file(instance_id: int, data: schemas.Write, request: Request) ->
     
     return Response(status_code=HTTPStatus.OK)
     
+@api.post(FS_API + "{instance_id}/append")
+async def append_file(instance_id: int, data: schemas.Write, request: Request) -> Response:
+    status, response = await prepare_restricted_endpoint_data(instance_id, data, request)
+    if not status:
+        return response
+    
+    _, _, drive_manager = response
+    end_path = data.cwd + data.path 
+    
+    struct_base: fs.FS_Dir = run_async(drive_manager.get_struct())
+    target = struct_base.move_to(end_path)
+    
+    if target is None:
+        return rich_error_response(errors.INVALID_PATH)
+    
+    if isinstance(target, fs.FS_Dir):
+        return rich_error_response(errors.PATH_TO_DIR)
+    
+    append_status = run_async(drive_manager.append_file(data.uid, target.path_to(), data.content.encode()))
+    if isinstance(append_status, errors.T_Error):
+        return rich_error_response(append_status)
+    
+    return Response(status_code=HTTPStatus.OK)
+    
+@api.post(FS_API + "{instance_id}/patch")
+async def patch_file(instance_id: int, data: schemas.Patch, request: Request) -> Response:
+    status, response = await prepare_restricted_endpoint_data(instance_id, data, request)
+    if not status:
+        return response
+    
+    _, _, drive_manager = response
+    end_path = data.cwd + data.path 
+    
+    struct_base: fs.FS_Dir = run_async(drive_manager.get_struct())
+    target = struct_base.move_to(end_path)
+    
+    if target is None:
+        return rich_error_response(errors.INVALID_PATH)
+    
+    if isinstance(target, fs.FS_Dir):
+        return rich_error_response(errors.PATH_TO_DIR)
+    
+    patch_status = run_async(drive_manager.patch_file(data.uid, target.path_to(), data.offset, data.content.encode()))
+    if isinstance(patch_status, errors.T_Error):
+        return rich_error_response(patch_status)
+    
+    return Response(status_code=HTTPStatus.OK)
+    
 @api.post(FS_API + "{instance_id}/upload")
 async def upload_file(instance_id: int, data: schemas.Write, request: Request) -> Response:
     status, response = await prepare_restricted_endpoint_data(instance_id, data, request)
@@ -382,6 +546,41 @@ async def upload_file(instance_id: int, data: schemas.Write, request: Request) -
     
     return Response(status_code=HTTPStatus.OK)
 
+def stream_upload_data(cwd: str, path: str, uid: int = Header(alias="X-Drive-Uid"), token: str = Header(alias="X-Drive-Token")) -> schemas.Path:
+    """ Body of streamed upload is the content, so auth is passed in headers (query parameters end up in access logs). """
+    return schemas.Path(uid=uid, token=token, cwd=cwd, path=path)
+
+@api.post(FS_API + "{instance_id}/upload/stream")
+async def upload_file_stream(instance_id: int, request: Request, data: schemas.Path = Depends(stream_upload_data)) -> Response:
+    """ Upload raw request's body (path is passed as query parameters). Content is stored while it's received. """
+    status, response = await prepare_restricted_endpoint_data(instance_id, data, request)
+    if not status:
+        return response
+    
+    _, _, drive_manager = response
+    end_path = data.path 
+    
+    struct_base: fs.FS_Dir = run_async(drive_manager.get_struct())
+    target_parent = struct_base.move_to(data.cwd)
+    if target_parent is None:
+        return rich_error_response(errors.INVALID_PATH)
+
+    if target_parent.has_object(data.path):
+        return rich_error_response(errors.NAME_IN_USE)
+    
+    create_status = run_async(drive_manager.create_file(data.uid, end_path))
+    if isinstance(create_status, errors.T_Error):
+        return rich_error_response(create_status)
+    
+    content = bridge_async(request_body(request), asyncio.get_running_loop())
+    write_status = await await_async(drive_manager.write_file_stream(data.uid, end_path, content))
+    if isinstance(write_status, errors.T_Error):
+        # File was created by this upload, it's not left empty.
+        await await_async(drive_manager.delete_fs_obj(data.uid, end_path))
+        return rich_error_response(write_status)
+    
+    return Response(status_code=HTTPStatus.OK)
+
 
 DEBUG_API = "/api/dbg/"
 
@@ -393,7 +592,7 @@ async def memory_usage(instance_id: int, data: schemas.Auth, request: Request) -
     
     _, _, drive_manager = response
     
-    usage = drive_manager.memory_manager.get_memory_usage()
+    usage = run_async(drive_manager.memory_manager.get_memory_usage())
     total_used = sum(usage.values())
     usage_per_bucket = {}
 
@@ -403,7 +602,16 @@ async def memory_usage(instance_id: int, data: schemas.Auth, request: Request) -
             percentage = round(((mem / total_used) * 100), 2)
         usage_per_bucket[f"data_{i}"] = f"{sizeof_fmt(mem)} ({percentage}%)"
     
-    content = {"total": sizeof_fmt(total_used), "per_bucket": usage_per_bucket}
+    content = {
+        "total": sizeof_fmt(total_used),
+        "per_bucket": usage_per_bucket,
+        "chunks_cache": drive_manager.memory_manager.chunks_cache.stats(),
+        "placeholder_pool": drive_manager.memory_manager.pool.stats(),
+        "scheduler": drive_manager.memory_manager.scheduler.stats(),
+        "garbage_collector": drive_manager.memory_manager.gc_stats,
+        "defragmenter": drive_manager.defrag_progress,
+        "structure": drive_manager.struct_stats()
+    }
     
     return JSONResponse(content, status_code=HTTPStatus.OK)
 
@@ -420,6 +628,7 @@ async def dump_cache(instance_id: int, data: schemas.DebugIndex, request: Reques
     if bucket is None:
         return rich_error_response(f"Bucket of index {index} not found.")
 
+    run_async(drive_manager.memory_manager.load_bucket(bucket))
     cache_msg = json.dumps(bucket.cache, indent=2)
     
     return PlainTextResponse(cache_msg, status_code=HTTPStatus.OK)
@@ -430,21 +639,49 @@ async def recache(instance_id: int, data: schemas.DebugIndex, request: Request)
     if not status:
         return response
     
-    _, guild, drive_manager = response
+    _, _, drive_manager = response
     index = data.index
     
     bucket = drive_manager.memory_manager.buckets.get(index)
     if bucket is None:
         return rich_error_response(f"Bucket of index {index} not found.")
 
-    new_cache = run_async(bucket._build_cache(guild, index, bucket.data_channels))
-    bucket.cache = new_cache
-    run_async(bucket._save_cache())
+    run_async(drive_manager.memory_manager.recache_bucket(bucket))
 
     cache_msg = json.dumps(bucket.cache, indent=2)
     
     return PlainTextResponse(cache_msg, status_code=HTTPStatus.OK)
 
+@api.post(DEBUG_API + "{instance_id}/gc")
+async def collect_garbage(instance_id: int, data: schemas.Auth, request: Request) -> JSONResponse:
+    status, response = await prepare_restricted_endpoint_data(instance_id, data, request)
+    if not status:
+        return response
+    
+    _, _, drive_manager = response
+    
+    report = await await_async(drive_manager.collect_garbage())
+    if report is None:
+        return rich_error_response("Garbage collection abandoned (broken memory or ongoing writes).")
+
+    content = {
+        "report": report,
+        "total": drive_manager.memory_manager.gc_stats
+    }
+    
+    return JSONResponse(content, status_code=HTTPStatus.OK)
+
+@api.post(DEBUG_API + "{instance_id}/defrag")
+async def defragment(instance_id: int, data: schemas.DebugDefrag, request: Request) -> JSONResponse:
+    status, response = await prepare_restricted_endpoint_data(instance_id, data, request)
+    if not status:
+        return response
+    
+    _, _, drive_manager = response
+    
+    progress = run_async(drive_manager.start_defrag(data.files))
+    return JSONResponse(progress, status_code=HTTPStatus.OK)
+
 @api.post(DEBUG_API + "{instance_id}/trace")
 async def trace_file(instance_id: int, data: schemas.DebugPath, request: Request) -> JSONResponse:
     status, response = await prepare_restricted_endpoint_data(instance_id, data, request)
@@ -456,7 +693,7 @@ async def trace_file(instance_id: int, data: schemas.DebugPath, request: Request
     struct: fs.FS_Dir = run_async(drive_manager.get_struct())
     file = struct.move_to(data.path)
     
-    raw_trace: list[Message] = run_async(drive_manager.memory_manager.get_content_trace(file.mem_addr))
+    raw_trace: list[Message] = run_async(drive_manager.memory_manager.get_file_trace(file))
     trace = [(msg.id, msg.jump_url) for msg in raw_trace]
 
     return JSONResponse(trace, status_code=HTTPStatus.OK)
@@ -0,0 +1,122 @@
+"""
+Module: allocator.py
+
+Description:
+    Free space allocator of data channels.
+
+    Keeps data channels sorted by their free capacity (content size limit
+    minus used and reserved space), so the best fitting channel is found
+    with a binary search. Space is reserved synchronously (without awaiting
+    anything between the check and the reservation), so concurrent writes
+    never choose the same free space twice. Reservation is released when
+    the message's real size is accounted in bucket's cache or when the
+    allocation fails.
+"""
+from modules import limits
+
+from bisect import bisect_left, insort
+
+
+class ChannelsAllocator:
+    def __init__(self) -> None:
+        self._free: list[tuple[int, int]] = []  # Sorted (free_size, channel_id).
+        self._used: dict[int, int] = {}
+        self._reserved: dict[int, int] = {}
+
+    def free_size(self, channel_id: int) -> int:
+        return limits.TOTAL_CHANNEL_CONTENT_SIZE - self._used[channel_id] - self._reserved[channel_id]
+
+    def channels_count(self) -> int:
+        return len(self._used)
+
+    def reserved_size(self) -> int:
+        return sum(self._reserved.values())
+
+    def _update(self, channel_id: int, used: int | None = None, reserved_delta: int = 0) -> None:
+        if channel_id in self._used:
+            self._free.pop(bisect_left(self._free, (self.free_size(channel_id), channel_id)))
+        else:
+            self._used[channel_id] = 0
+            self._reserved[channel_id] = 0
+
+        if used is not None:
+            self._used[channel_id] = used
+        self._reserved[channel_id] = max(self._reserved[channel_id] + reserved_delta, 0)
+
+        insort(self._free, (self.free_size(channel_id), channel_id))
+
+    def set_used(self, channel_id: int, used: int) -> None:
+        """ Register channel or update it's used size (as saved in bucket's cache). """
+        self._update(channel_id, used=used)
+
+    def reserve(self, size: int) -> int | None:
+        """ Reserve space in the channel with the smallest free space fitting the size. Returns channel id. """
+        position = bisect_left(self._free, (size, 0))
+        if position == len(self._free):
+            return None
+
+        _, channel_id = self._free[position]
+        self._update(channel_id, reserved_delta=size)
+        return channel_id
+
+    def reserve_run(self, sizes: list[int], exclude: set[int] | None = None) -> tuple[int | None, int]:
+        """
+        Reserve space for messages sent one after another in a single channel.
+        Whole run is placed in the best fitting channel, otherwise the channel with the most free space
+        takes as many leading sizes as it can. Channels from `exclude` are skipped.
+        Returns (channel id, amount of reserved sizes).
+        """
+        exclude = exclude or set()
+        channel_id = None
+        fitting = len(sizes)
+
+        for position in range(bisect_left(self._free, (sum(sizes), 0)), len(self._free)):
+            if self._free[position][1] not in exclude:
+                channel_id = self._free[position][1]
+                break
+
+        if channel_id is None:
+            fitting = 0
+            for free, candidate_id in reversed(self._free):
+                if candidate_id in exclude:
+                    continue
+
+                channel_id = candidate_id
+                for size in sizes:
+                    if size > free:
+                        break
+                    free -= size
+                    fitting += 1
+                break
+
+        if fitting == 0:
+            return None, 0
+
+        self._update(channel_id, reserved_delta=sum(sizes[:fitting]))
+        return channel_id, fitting
+
+    def reserve_in(self, channel_id: int, sizes: list[int]) -> int:
+        """ Reserve space for as many leading sizes as given channel can fit. Returns amount of reserved sizes. """
+        if channel_id not in self._used:
+            return 0
+
+        free = self.free_size(channel_id)
+        fitting = 0
+        for size in sizes:
+            if size > free:
+                break
+            free -= size
+            fitting += 1
+
+        if fitting:
+            self._update(channel_id, reserved_delta=sum(sizes[:fitting]))
+        return fitting
+
+    def most_free_channel(self) -> int | None:
+        if not self._free or self._free[-1][0] <= 0:
+            return None
+        return self._free[-1][1]
+
+    def release(self, channel_id: int, size: int) -> None:
+        if channel_id in self._used:
+            self._update(channel_id, reserved_delta=-size)
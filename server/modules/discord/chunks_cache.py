@@ -0,0 +1,185 @@
+"""
+Module: chunks_cache.py
+
+Description:
+    In-process LRU cache of memory messages (chunks and index pages).
+
+    Cached message holds chunk's payload and next pointer in it's content,
+    so hot files can be traced and read without Discord calls. Cache is
+    limited by the total size of cached messages' content in bytes (UTF-8
+    encoded, b32k characters take 3 bytes each).
+
+    Messages fetched with a single channel history request additionally
+    remember id of the message following them in the channel, so whole
+    extents can be served from cache.
+
+    Optional disk cache is used as the second level: cached messages are
+    written through to it and messages missing in memory are restored from
+    it (with `restore` function creating message object from it's content).
+    Messages restored from entries written before restart stay unverified
+    until they are cached again from Discord (see `verified`).
+"""
+from modules.filesystem.fs import MemoryAddress
+from modules.discord.disk_cache import DiskChunksCache
+
+from collections.abc import Callable
+from collections import OrderedDict
+import datetime
+import discord
+
+
+T_Restore = Callable[[int, int, str, datetime.datetime], discord.Message | None]  # (channel_id, message_id, content, edited_at)
+
+
+def _entry_size(message: discord.Message) -> int:
+    return len(message.content.encode()) + 1
+
+
+class ChunksCache:
+    def __init__(self, budget: int, disk: DiskChunksCache | None = None, restore: T_Restore | None = None) -> None:
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk = disk
+        self.restore = restore
+        self._entries: OrderedDict[tuple[int, int], tuple[discord.Message, int | None]] = OrderedDict()  # (ch, msg): (message, following_id)
+        self._unverified: set[tuple[int, int]] = set()  # Messages restored from disk entries written before restart.
+
+    async def _entry(self, channel_id: int, message_id: int) -> tuple[discord.Message, int | None] | None:
+        """ Returns memory entry, message missing in memory is restored from disk cache. """
+        entry = self._entries.get((channel_id, message_id))
+        if entry is not None or self.disk is None or self.restore is None:
+            return entry
+
+        cached = await self.disk.get(channel_id, message_id)
+        if cached is None:
+            return None
+
+        content, edited, following_id, verified = cached
+        message = self.restore(channel_id, message_id, content, datetime.datetime.fromtimestamp(edited, datetime.timezone.utc))
+        if message is None:
+            return None
+
+        self._put_memory(message, following_id)
+        if not verified:
+            self._unverified.add((channel_id, message_id))
+        return message, following_id
+
+    async def get(self, addr: MemoryAddress) -> discord.Message | None:
+        entry = await self._entry(addr.channel_id, addr.message_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if (addr.channel_id, addr.message_id) in self._entries:
+            self._entries.move_to_end((addr.channel_id, addr.message_id))
+        self.hits += 1
+        return entry[0]
+
+    async def get_run(self, channel_id: int, first_id: int, count: int) -> list[discord.Message] | None:
+        """ Returns `count` messages sent one after another starting at `first_id` if all of them are cached. """
+        run = []
+        message_id = first_id
+
+        while len(run) < count:
+            entry = await self._entry(channel_id, message_id)
+            if entry is None or (entry[1] is None and len(run) < count - 1):
+                self.misses += 1
+                return None
+
+            run.append(entry[0])
+            message_id = entry[1]
+
+        for message in run:
+            if (channel_id, message.id) in self._entries:
+                self._entries.move_to_end((channel_id, message.id))
+
+        self.hits += 1
+        return run
+
+    def verified(self, channel_id: int, messages_ids: list[int]) -> bool:
+        """ Check if none of the cached messages was restored from disk entry written before restart. """
+        return not any((channel_id, message_id) in self._unverified for message_id in messages_ids)
+
+    def put(self, message: discord.Message, following_id: int | None = None) -> None:
+        """ Cache (or refresh) message. Known following message's id is kept if not given. """
+        following_id = self._put_memory(message, following_id)
+        self._unverified.discard((message.channel.id, message.id))
+
+        # Attachments urls expire, such messages are kept only in memory.
+        if self.disk is not None and not message.attachments:
+            edited_at = message.edited_at or message.created_at
+            self.disk.put(message.channel.id, message.id, message.content, edited_at.timestamp(), following_id)
+
+    def _put_memory(self, message: discord.Message, following_id: int | None) -> int | None:
+        key = (message.channel.id, message.id)
+        current = self._entries.pop(key, None)
+        if current is not None:
+            self.size -= _entry_size(current[0])
+            if following_id is None:
+                following_id = current[1]
+
+        self._entries[key] = (message, following_id)
+        self.size += _entry_size(message)
+        self._evict()
+        return following_id
+
+    def put_run(self, messages: list[discord.Message]) -> None:
+        """ Cache messages fetched with a single channel history request. """
+        for message, following in zip(messages, messages[1:] + [None]):
+            self.put(message, following.id if following is not None else None)
+
+    def link(self, channel_id: int, message_id: int, following_id: int) -> None:
+        """ Remember that cached message is followed by given one in the channel (eg. both written in one run). """
+        key = (channel_id, message_id)
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] != following_id:
+            unverified = key in self._unverified
+            self.put(entry[0], following_id)
+            if unverified:
+                self._unverified.add(key)
+
+    def following_id(self, channel_id: int, message_id: int) -> int | None:
+        """ Returns known id of the message following given one in the channel. """
+        entry = self._entries.get((channel_id, message_id))
+        if entry is not None:
+            return entry[1]
+        if self.disk is not None:
+            return self.disk.following_id(channel_id, message_id)
+        return None
+
+    def invalidate(self, channel_id: int, message_id: int, content: str | None = None) -> None:
+        """ Drop cached message. If it's current content is given, message is kept when cached copy is up to date. """
+        if self.disk is not None:
+            self.disk.invalidate(channel_id, message_id, content)
+
+        entry = self._entries.get((channel_id, message_id))
+        if entry is None or (content is not None and entry[0].content == content):
+            return
+
+        del self._entries[(channel_id, message_id)]
+        self._unverified.discard((channel_id, message_id))
+        self.size -= _entry_size(entry[0])
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._unverified.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "size": self.size,
+            "budget": self.budget,
+            "hits": self.hits,
+            "misses": self.misses,
+            "unverified": len(self._unverified),
+            "disk": self.disk.stats() if self.disk is not None else None,
+        }
+
+    def _evict(self) -> None:
+        while self.size > self.budget and self._entries:
+            key, (message, _) = self._entries.popitem(last=False)
+            self._unverified.discard(key)
+            self.size -= _entry_size(message)
@@ -7,10 +7,12 @@ from modules.filesystem import fs
 from modules.logs import Log
 from modules import database
 from modules import errors
+from modules import limits
 from modules import perms
 
 from discord.ext import commands
 import discord
+import asyncio
 import base64
 import json
 import os
@@ -49,6 +51,16 @@ def is_console_channel(ctx: commands.Context) -> bool:
     return ctx.channel.id == ids_reg.console_id
 
 
+def _defrag_status(progress: dict) -> str:
+    state = "running" if progress["running"] else "finished"
+    status = f"Defragmentation {state} (started {progress['started']}).\n"
+    status += f"Files: `{progress['done']}/{progress['files']}` (relocated: `{progress['relocated']}`, skipped: `{progress['skipped']}`)\n"
+    status += f"History requests saved per read: `{progress['requests_saved']}`"
+    if progress["current"] is not None:
+        status += f"\nCurrent: `{progress['current']}`"
+    return status
+
+
 def _build_file_edit_ui(drive_guild: DriveGuild, uid: int, file: fs.FS_File, all_content: str) -> discord.ui.View:
     page_content_size = 3800
     name = file.name
@@ -143,6 +155,7 @@ class BotConsoleCommands(commands.Cog):
             await ctx.reply(embed=build_error_message(f"_cache {index}", f"`Bucket {index}` not found."), ephemeral=True)
             return
 
+        await manager.memory_manager.load_bucket(bucket)
         cache_msg = json.dumps(bucket.cache, indent=2)
         await ctx.reply(embed=build_output_message(f"_cache {index}", f"`Bucket {index}` cache:\n```json\n{cache_msg}```"), ephemeral=True)
 
@@ -165,13 +178,32 @@ class BotConsoleCommands(commands.Cog):
             await ctx.reply(embed=build_error_message(f"_cache {index}", f"`Bucket {index}` not found."), ephemeral=True)
             return
 
-        new_cache = await bucket._build_cache(ctx.guild, index, bucket.data_channels)
-        bucket.cache = new_cache
-        await bucket._save_cache()
+        await manager.memory_manager.recache_bucket(bucket)
 
         cache_msg = json.dumps(bucket.cache, indent=2)
         await ctx.reply(embed=build_output_message(f"_recache {index}", f"Recalculated cache for `Bucket {index}`:\n```json\n{cache_msg}```"), ephemeral=True)
 
+    @commands.command(
+        name="_defrag",
+        brief=f"[files: int = {limits.DEFRAG_MAX_FILES}]",
+        help="Relocate the most fragmented (and most read) files into contiguous memory. Progress is updated until the job is finished.",
+        usage="Admin"
+    )
+    async def cmd_defrag(self, ctx: commands.Context, files: int = limits.DEFRAG_MAX_FILES) -> None:
+        if not is_console_channel(ctx):
+            return
+
+        manager = await DriveGuild.get(ctx.guild)
+        if not manager.get_permissions(ctx.author).admin:
+            return await ctx.reply(embed=perms.ADMIN_PERMS_ERROR_EMBED)
+
+        progress = await manager.start_defrag(files)
+        reply = await ctx.reply(embed=build_output_message("_defrag", _defrag_status(progress)), ephemeral=True)
+
+        while progress["running"]:
+            await asyncio.sleep(limits.DEFRAG_PROGRESS_INTERVAL)
+            await reply.edit(embed=build_output_message("_defrag", _defrag_status(progress)))
+
     @commands.command(
         name="_trace",
         brief="<name: FileName>",
@@ -199,7 +231,7 @@ class BotConsoleCommands(commands.Cog):
         else:
             return await ctx.reply(embed=build_error_message(f"_trace {name}", f"File not found: `{name}`"), ephemeral=True)
 
-        trace = await drive_man.memory_manager.get_content_trace(file.mem_addr)
+        trace = await drive_man.memory_manager.get_file_trace(file)
         if isinstance(trace, errors.T_Error):
             return await ctx.reply(embed=build_error_message(f"_trace {name}", f"Fail: `{trace}`"), ephemeral=True)
 
@@ -247,7 +279,7 @@ class BotConsoleCommands(commands.Cog):
     )
     async def cmd_memusage(self, ctx: commands.Context) -> None:
         manager = await DriveGuild.get(ctx.guild)
-        usage_per_bucket = manager.memory_manager.get_memory_usage()
+        usage_per_bucket = await manager.memory_manager.get_memory_usage()
         total_used = sum(usage_per_bucket.values())
 
         message = f"**Used memory**: `{sizeof_fmt(total_used)}`\n\nUsage per bucket:\n"
@@ -385,11 +417,11 @@ class BotConsoleCommands(commands.Cog):
     @commands.command(
         name="read",
         aliases=["cat"],
-        brief="<path: FilePath>",
-        help="Displays content of given file. Outputs \"(blank content)\" if file is blank.",
+        brief="<path: FilePath> [offset: int = 0] [length: int]",
+        help="Displays content of given file (or `length` bytes starting at `offset`). Outputs \"(blank content)\" if file is blank.",
         usage="Read"
     )
-    async def cmd_read(self, ctx: commands.Context, path: str = None) -> None:
+    async def cmd_read(self, ctx: commands.Context, path: str = None, offset: int = 0, length: int = None) -> None:
         if not is_console_channel(ctx):
             return
 
@@ -405,11 +437,15 @@ class BotConsoleCommands(commands.Cog):
             return
         target = cwd.move_to(path)
 
-        content_b = await drive_man.get_file_content(ctx.author.id, path)
+        if offset < 0 or (length is not None and length < 0):
+            return await ctx.reply(embed=build_error_message(f"{ctx.invoked_with}", "`offset` and `length` cannot be negative!"))
+
+        content_b = await drive_man.get_file_content(ctx.author.id, path, offset, length)
         if isinstance(content_b, errors.T_Error):
             return await ctx.reply(embed=build_error_message(f"{ctx.invoked_with} {path}", f"Fail: `{content_b}`"))
 
-        content = content_b.decode()
+        # Range can cut multi-byte characters.
+        content = content_b.decode(errors="replace")
         chunks = drive_man.memory_manager.split_content(content)
         ext = target.name.split(".")[-1]
 
@@ -507,6 +543,53 @@ class BotConsoleCommands(commands.Cog):
         view = _build_file_edit_ui(drive_man, ctx.author.id, target, content)
         await ctx.reply(embed=build_output_message(f"{ctx.invoked_with} {path}", f"Edit file: `{target.name}`"), view=view, ephemeral=True)
 
+    @commands.command(
+        name="append",
+        aliases=["app"],
+        brief="<path: FilePath> <content: Text>",
+        help="Append text to the end of file's content. Only the last chunks of the file are rewritten.",
+        usage="Write"
+    )
+    async def cmd_append(self, ctx: commands.Context, path: str = None, *, content: str = None) -> None:
+        if not is_console_channel(ctx):
+            return
+
+        drive_man = await DriveGuild.get(ctx.guild)
+        if not drive_man.get_permissions(ctx.author).write:
+            return await ctx.reply(embed=perms.WRITE_PERMS_ERROR_EMBED)
+
+        if path is None or content is None:
+            return await ctx.reply(embed=build_error_message(f"{ctx.invoked_with}", "Missing `<path>` or `<content>` attribute! (append <path> <content>)"))
+
+        status = await drive_man.append_file(ctx.author.id, path, content.encode())
+        if isinstance(status, errors.T_Error):
+            return await ctx.reply(embed=build_error_message(f"{ctx.invoked_with} {path}", f"Fail: `{status}`"))
+
+        await ctx.reply(embed=build_output_message(f"{ctx.invoked_with} {path}", f"Appended {len(content.encode())} bytes."))
+
+    @commands.command(
+        name="patch",
+        brief="<path: FilePath> <offset: int> <content: Text>",
+        help="Overwrite file's content starting at given byte offset with text. Content is extended if text goes past it's end.",
+        usage="Write"
+    )
+    async def cmd_patch(self, ctx: commands.Context, path: str = None, offset: int = None, *, content: str = None) -> None:
+        if not is_console_channel(ctx):
+            return
+
+        drive_man = await DriveGuild.get(ctx.guild)
+        if not drive_man.get_permissions(ctx.author).write:
+            return await ctx.reply(embed=perms.WRITE_PERMS_ERROR_EMBED)
+
+        if path is None or offset is None or content is None:
+            return await ctx.reply(embed=build_error_message(f"{ctx.invoked_with}", "Missing `<path>`, `<offset>` or `<content>` attribute! (patch <path> <offset> <content>)"))
+
+        status = await drive_man.patch_file(ctx.author.id, path, offset, content.encode())
+        if isinstance(status, errors.T_Error):
+            return await ctx.reply(embed=build_error_message(f"{ctx.invoked_with} {path}", f"Fail: `{status}`"))
+
+        await ctx.reply(embed=build_output_message(f"{ctx.invoked_with} {path}", f"Patched {len(content.encode())} bytes at offset {offset}."))
+
     @commands.command(
         name="rm",
         brief="<path: FilePath or DirPath>",
@@ -4,9 +4,12 @@ from modules.discord import assets
 from modules.discord import data
 from modules.logs import Log
 from modules import accounts
+from modules import limits
 
 from discord.ext import commands
+from collections.abc import Iterable
 import discord
+import asyncio
 
 
 class BotEvents(commands.Cog):
@@ -19,7 +22,7 @@ class BotEvents(commands.Cog):
         
         manager = await data.DriveGuild.get(channel.guild)
         
-        if channel.id in (manager.logs_channel.id, manager.struct_channel.id, manager.console_channel.id, manager.logs_channel.category_id):
+        if channel.id in (manager.logs_channel.id, manager.struct_channel.id, manager.journal_channel.id, manager.console_channel.id, manager.logs_channel.category_id):
             return True
         
         for bucket in manager.memory_manager.buckets.values():
@@ -28,6 +31,19 @@ class BotEvents(commands.Cog):
 
         return False
 
+    async def _drop_cached_messages(self, guild_id: int | None, channel_id: int, messages_ids: Iterable[int]) -> None:
+        """ Drop deleted messages from chunks cache (disk cache keeps tombstones of them). """
+        if guild_id is None or str(guild_id) not in guilds_ids_db.get_all_keys():
+            return
+
+        guild = self.client.get_guild(guild_id)
+        if guild is None:
+            return
+
+        manager = await data.DriveGuild.get(guild)
+        for message_id in messages_ids:
+            manager.memory_manager.chunks_cache.invalidate(channel_id, message_id)
+
     @commands.Cog.listener()
     async def on_guild_join(self, guild: discord.Guild) -> None:
         Log.info(f"Joined guild: {guild.name} ({guild.id})")
@@ -115,6 +131,28 @@ class BotEvents(commands.Cog):
         
         await data.panic_guild_error(message.guild, f"Removed client's message: {message.content}")
         
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent) -> None:
+        if payload.guild_id is None or str(payload.guild_id) not in guilds_ids_db.get_all_keys():
+            return
+        
+        guild = self.client.get_guild(payload.guild_id)
+        if guild is None:
+            return
+        
+        manager = await data.DriveGuild.get(guild)
+        # Own edits are already refreshed in cache.
+        content = payload.data.get("content")
+        manager.memory_manager.chunks_cache.invalidate(payload.channel_id, payload.message_id, content)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent) -> None:
+        await self._drop_cached_messages(payload.guild_id, payload.channel_id, [payload.message_id])
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent) -> None:
+        await self._drop_cached_messages(payload.guild_id, payload.channel_id, payload.message_ids)
+
     @commands.Cog.listener()
     async def on_guild_role_delete(self, role: discord.Role) -> None:
         manager = await data.DriveGuild.get(role.guild)
@@ -140,8 +178,12 @@ class BotEvents(commands.Cog):
 async def setup(client: discord.Client) -> None:
     await client.add_cog(BotEvents(client))
     
-    for guild in client.guilds:
-        await data.DriveGuild.get(guild)
-        
+    semaphore = asyncio.Semaphore(limits.GUILDS_WARMUP_CONCURRENCY)
+
+    async def warm_up(guild: discord.Guild) -> None:
+        async with semaphore:
+            await data.DriveGuild.get(guild)
+
+    await asyncio.gather(*(warm_up(guild) for guild in client.guilds))
     Log.info("Initialized all guilds.")
         
@@ -196,6 +196,7 @@ async def initialize_guild(guild: discord.Guild) -> None:
     meta_category = await guild.create_category("meta", overwrites=system_category_perms)
     logs_channel = await guild.create_text_channel("_logs", category=meta_category)
     struct_channel = await guild.create_text_channel("_struct", category=meta_category)
+    await guild.create_text_channel("_journal", category=meta_category)
     data0_category = await guild.create_category("data_0", overwrites=system_category_perms)
     await guild.create_text_channel("_cache", category=data0_category)
     await guild.create_text_channel("0", category=data0_category)
@@ -1,8 +1,18 @@
 from modules.discord.pointers import guilds_ids_db
 from modules.perms import DrivePermissions
 from modules.discord.client import client
+from modules.discord import chunks_cache
+from modules.discord import disk_cache
+from modules.discord import allocator
+from modules.discord import pool
+from modules.discord import scheduler
+from modules.discord import dedup
 from modules.logs import Log, get_time
+from modules.paths import Path
+from modules.filesystem import compression
+from modules.filesystem import encoding
 from modules.filesystem import parser
+from modules.filesystem import journal
 from modules.filesystem import fs
 from modules import database
 from modules import limits
@@ -10,16 +20,232 @@ from modules import errors
 
 from dataclasses import dataclass
 from discord.ext import commands
-from collections import deque
+from collections import deque, Counter
+from collections.abc import Awaitable, AsyncIterator, Callable
+import datetime
 import discord
 import zipfile
 import asyncio
 import base64
 import json
+import zlib
 import io
 import os
 
 
+INDEX_SEP = ","
+STRUCT_VERSION = 3
+STRUCT_HEADER_SEP = "|"  # Header: vVERSION|codec|encoding|payload_length|journal_seq|pages_extents|inline_payload
+STRUCT_CODEC = "zlib"
+DIRTY_CACHES_PATH = Path("./data/caches/")  # Buckets with size changes not saved on Discord yet (per guild).
+# Last scanned message and size per data channel (per guild). Kept locally, as they don't fit in `_cache` message next to sizes.
+CHECKPOINTS_SUFFIX = ".checkpoints.json"
+
+
+def _load_dirty_buckets(guild_id: int) -> set[int]:
+    path = DIRTY_CACHES_PATH + f"{guild_id}.json"
+    if not path.exists():
+        return set()
+    return set(path.get_json_content())
+
+
+def _save_dirty_buckets(guild_id: int, indexes: set[int]) -> None:
+    DIRTY_CACHES_PATH.touch()
+    (DIRTY_CACHES_PATH + f"{guild_id}.json").save_json_content(sorted(indexes))
+
+
+def _load_checkpoints(guild_id: int) -> dict[int, dict[int, tuple[int, int]]]:
+    path = DIRTY_CACHES_PATH + f"{guild_id}{CHECKPOINTS_SUFFIX}"
+    if not path.exists():
+        return {}
+    return {
+        int(index): {int(ch_id): tuple(checkpoint) for ch_id, checkpoint in channels.items()}
+        for index, channels in path.get_json_content().items()
+    }
+
+
+def _save_checkpoints(guild_id: int, checkpoints: dict[int, dict[int, tuple[int, int]]]) -> None:
+    DIRTY_CACHES_PATH.touch()
+    (DIRTY_CACHES_PATH + f"{guild_id}{CHECKPOINTS_SUFFIX}").save_json_content(checkpoints)
+
+
+def _split_mem_content(content: str) -> tuple[str, str]:
+    """ Split memory message's content into (payload, next address). """
+    payload, _, next_addr = content.rpartition("@")
+    return payload, next_addr
+
+
+class _CachedMessage(discord.PartialMessage):
+    """ Memory message restored from the disk chunks cache (without fetching it). """
+    __slots__ = ("content", "attachments", "edited_at")
+
+    def __init__(self, channel: discord.TextChannel, message_id: int, content: str, edited_at: datetime.datetime) -> None:
+        super().__init__(channel=channel, id=message_id)
+        self.content = content
+        self.attachments = []
+        self.edited_at = edited_at
+
+
+def _struct_header_fields(header: str) -> list[str] | None:
+    """ Returns [codec, encoding, payload_length, journal_seq, pages_extents, inline_payload] or None for legacy (base64) structure. """
+    version, _, fields = header.partition(STRUCT_HEADER_SEP)
+    if version == "v2":
+        # Saved before journal was introduced.
+        codec, encoding_name, length, extents, payload = fields.split(STRUCT_HEADER_SEP, 4)
+        return [codec, encoding_name, length, "0", extents, payload]
+
+    if version == f"v{STRUCT_VERSION}":
+        return fields.split(STRUCT_HEADER_SEP, 5)
+
+    return None
+
+
+def _struct_pages_extents(header: str) -> list[fs.MemoryExtent]:
+    """ Extents of pages pointed by structure's header. Legacy and inline structures have no pages. """
+    fields = _struct_header_fields(header)
+    if fields is None or not fields[4]:
+        return []
+    return [fs.MemoryExtent.from_str(raw) for raw in fields[4].split(INDEX_SEP)]
+
+
+def _attachment_position(attachment: discord.Attachment) -> int:
+    """ Position of attachment's part in the message. Parts are named: POSITION_HASH.part """
+    return int(attachment.filename.split(".")[0].split("_")[0])
+
+
+def _attachment_hash(attachment: discord.Attachment) -> str | None:
+    name = attachment.filename.split(".")[0]
+    return name.split("_")[1] if "_" in name else None
+
+
+def _attachment_parts(content: bytes) -> list[bytes]:
+    part_size = limits.ATTACHMENT_PART_SIZE
+    return [content[i:i + part_size] for i in range(0, len(content), part_size)]
+
+
+def _decode_blocks(encoding_name: str, chunks: list[str]) -> bytes:
+    """ Content of chunks holding independently compressed blocks. """
+    return b"".join(compression.decompress_block(encoding.decode(encoding_name, chunk)) for chunk in chunks)
+
+
+def _content_units(file: fs.FS_File) -> tuple[int, int]:
+    """
+    Returns (bytes per unit, units per message) of not compressed content stored in index based layout.
+    Unit is a text chunk or an attachment. All units except the last one hold the same amount of bytes.
+    """
+    if file.layout == fs.Layout.ATTACHMENTS:
+        return limits.ATTACHMENT_PART_SIZE, limits.MAX_ATTACHMENTS_PER_MSG
+
+    text_encoding = encoding.get(file.encoding)
+    return text_encoding.chunk_chars(limits.MSG_SIZE) // text_encoding.group_chars * text_encoding.group_bytes, 1
+
+
+def _extents_range(extents: list[fs.MemoryExtent], first: int, stop: int | None) -> tuple[list[fs.MemoryExtent], int]:
+    """
+    Extents covering messages [first, stop) of the trace. Last extent is shortened to the needed messages.
+    Returns (extents, amount of leading messages of the first extent outside the range).
+    """
+    covering = []
+    skip = 0
+    position = 0
+
+    for extent in extents:
+        end = position + extent.count
+        if end <= first:
+            position = end
+            continue
+
+        if stop is not None and position >= stop:
+            break
+
+        if not covering:
+            skip = first - position
+        if stop is not None and end > stop:
+            extent = fs.MemoryExtent(extent.channel_id, extent.message_id, stop - position)
+
+        covering.append(extent)
+        position = end
+
+    return covering, skip
+
+
+async def _skip_messages(runs: AsyncIterator[list[discord.Message]], skip: int) -> AsyncIterator[list[discord.Message]]:
+    try:
+        async for messages in runs:
+            if skip >= len(messages):
+                skip -= len(messages)
+                continue
+
+            yield messages[skip:]
+            skip = 0
+
+    finally:
+        await runs.aclose()
+
+
+async def _slice_stream(stream: AsyncIterator[bytes], skip: int, length: int | None) -> AsyncIterator[bytes]:
+    """ Drop `skip` leading bytes of the stream and end it after `length` bytes. """
+    try:
+        async for data in stream:
+            if skip >= len(data):
+                skip -= len(data)
+                continue
+
+            data = data[skip:]
+            skip = 0
+            if length is not None:
+                data = data[:length]
+                length -= len(data)
+
+            if data:
+                yield data
+            if length == 0:
+                return
+
+    finally:
+        await stream.aclose()
+
+
+def _memory_size(message: discord.Message) -> int:
+    """ Size of message counted in bucket's cache. Message with attachments occupies a whole message. """
+    if message.attachments:
+        return limits.MSG_SIZE
+    return len(_split_mem_content(message.content)[0])
+
+
+class MemoryStreamError(Exception):
+    """ Raised by content streams when broken memory is found after streaming has started. Holds T_Error. """
+
+
+class UploadInterruptedError(Exception):
+    """ Raised by uploaded content streams when the content will not be received completely. """
+
+
+@dataclass
+class StreamedObject:
+    name: str
+    content: AsyncIterator[bytes]
+    is_zip: bool
+
+
+class _ZipStreamBuffer(io.RawIOBase):
+    """ Unseekable output of streamed zip. Written data is taken out after every write. """
+    def __init__(self) -> None:
+        self.parts = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
 @dataclass
 class SendableFileData:
     name: str
@@ -61,34 +287,68 @@ class _DataBucket:
     """
     Represents single data bucket (category) on discord server.
     """
-    @staticmethod
-    async def _build_cache(guild: discord.Guild, index: int, data_channels: dict[int, discord.TextChannel]) -> dict[int, int]:
+    async def _scan_channel(self, data_ch: discord.TextChannel, checkpoint: tuple[int, int] | None) -> tuple[int, tuple[int, int]]:
+        """ Sum size of channel's messages. With checkpoint, only messages sent after it are scanned. Returns (size, checkpoint). """
+        last_id, size = checkpoint or (0, 0)
+
+        while True:
+            after = discord.Object(id=last_id) if last_id else None
+
+            async def read_page() -> list[discord.Message]:
+                return [msg async for msg in data_ch.history(limit=limits.HISTORY_BATCH_SIZE, after=after, oldest_first=True)]
+
+            # Rebuild is background work, it never delays reads and writes.
+            page = await self.scheduler.request(scheduler.HOUSEKEEPING, f"history:{data_ch.id}", read_page)
+            for msg in page:
+                last_id = max(last_id, msg.id)
+                if msg.author.id != client.user.id:
+                    Log.warn(f"Found junk message on data channel: {data_ch.name} in bucket {self.index} at guild: {self.guild.name}: {msg.content}")
+                    continue
+
+                size += _memory_size(msg)
+
+            if len(page) < limits.HISTORY_BATCH_SIZE:
+                return size, (last_id, size)
+
+    async def _build_cache(self, checkpoints: dict[int, tuple[int, int]] | None = None) -> tuple[dict[int, int], dict[int, tuple[int, int]]]:
         """
         Cache format:
             {
                 channel_id: int  <- Total content size in bytes stored per channel.
             }
-        """
-
-        cache = {}
 
-        for data_ch in data_channels.values():
-            size = 0
+        Channels are scanned concurrently. Channels with a checkpoint (last scanned message id and size
+        up to it) are scanned incrementally. Returns (cache, new checkpoints).
+        """
+        checkpoints = checkpoints or {}
+        semaphore = asyncio.Semaphore(limits.CACHE_REBUILD_CONCURRENCY)
 
-            async for msg in data_ch.history(limit=limits.MIN_MSG_PER_CHANNEL):
-                if msg.author.id != client.user.id:
-                    Log.warn(f"Found junk message on data channel: {data_ch.name} in bucket {index} at guild: {guild.name}: {msg.content}")
-                    continue
+        async def scan(data_ch: discord.TextChannel) -> tuple[int, tuple[int, int]]:
+            async with semaphore:
+                return await self._scan_channel(data_ch, checkpoints.get(data_ch.id))
 
-                size += len(msg.content.split("@")[0])
+        channels = list(self.data_channels.values())
+        results = await asyncio.gather(*(scan(data_ch) for data_ch in channels))
 
-            cache[data_ch.id] = size
+        cache = {data_ch.id: size for data_ch, (size, _) in zip(channels, results)}
+        new_checkpoints = {data_ch.id: checkpoint for data_ch, (_, checkpoint) in zip(channels, results)}
 
-        Log.info(f"Built cache for bucket {index} at guild {guild.name}")
-        return cache
+        resumed = sum(data_ch.id in checkpoints for data_ch in channels)
+        Log.info(f"Built cache for bucket {self.index} at guild {self.guild.name} ({resumed}/{len(channels)} channels resumed from checkpoint)")
+        return cache, new_checkpoints
 
     @staticmethod
-    async def init(guild: discord.Guild, category: discord.CategoryChannel, index: int) -> "_DataBucket":
+    async def init(guild: discord.Guild,
+                   category: discord.CategoryChannel,
+                   index: int,
+                   requests: scheduler.RequestScheduler,
+                   rebuild: bool = False,
+                   checkpoints: dict[int, tuple[int, int]] | None = None
+                   ) -> "_DataBucket":
+        """
+        Find bucket's data channels. Cache is fetched later by `load`. If `rebuild` is set, saved cache is not
+        trusted (eg. unsaved changes before crash) and it's rebuilt while loading, resuming from valid channels `checkpoints`.
+        """
         data_channels = {}
 
         for channel in category.text_channels:
@@ -100,12 +360,11 @@ class _DataBucket:
                 Log.warn(f"Invalid data channel name: {name} in bucket: {index} at guild: {guild.name}")
                 continue
 
-            index = int(name)
-            data_channels[index] = channel
+            data_channels[int(name)] = channel
 
         if not data_channels:
             Log.info(f"No data channels found at bucket {index} at guild {guild.name} (created 0)")
-            channel = await category.create_text_channel("0")
+            channel = await requests.request(scheduler.WRITE, "channels", lambda: category.create_text_channel("0"))
             data_channels[0] = channel
 
         # Check for missing channels.
@@ -114,114 +373,144 @@ class _DataBucket:
                 await panic_guild_error(guild, f"Missing/invalid data channel at bucket: {index} ({i} -> {name})")
                 return
 
-        # Fetch meta message and cache.
-        async def fetch_cache_msg() -> tuple[discord.Message, dict[int, int]]:
-            cache_channel = None
-            cache = None
-
-            for channel in category.text_channels:
-                if channel.name == "_cache":
-                    cache_channel = channel
-                    break
-            else:
-                Log.error(f"No _cache channel found in data bucket: {index} at guild: {guild.name}.")
-                Log.info("The _cache meta channel will be created and Bucket will be cached.")
-
-                cache = await _DataBucket._build_cache(guild, index, data_channels)
-                cache_channel = await category.create_text_channel("_cache")
-
-            cache_message = [message async for message in cache_channel.history(limit=1)]
-            cache_message = cache_message[0] if cache_message else None
-
-            if cache_message is None:
-                if cache is None:
-                    cache = await _DataBucket._build_cache(guild, index, data_channels)
-
-                Log.info(f"Cache mesasge not found on meta channel in bucket: {index} at guild: {guild.name}, sending...")
-                cache_content = base64.b64encode(json.dumps(cache or {}).encode()).decode()
-                cache_message = await cache_channel.send(cache_content)
-
-            else:
-                cache_message = await cache_message.fetch()
-                cache_enc = cache_message.content
-                raw_cache = json.loads(base64.b64decode(cache_enc).decode())
-                cache = {int(k): v for k, v in raw_cache.items()}
-
-            if cache_message.author.id != client.user.id:
-                Log.warn(f"Latest message on cache channel at bucket: {index} does not belong to bot at: {guild.name}")
-                await cache_message.delete()
-                return await fetch_cache_msg()
-
-            return (cache_message, cache)
-
-        cache_msg, cache = await fetch_cache_msg()
-
-        return _DataBucket(
-            guild,
-            category,
-            index,
-            data_channels,
-            cache_msg,
-            cache
-        )
+        return _DataBucket(guild, category, index, data_channels, requests, checkpoints, rebuild)
 
     def __init__(self,
                  guild: discord.Guild,
                  category: discord.CategoryChannel,
                  index: int,
                  data_channels: dict[int, discord.TextChannel],
-                 cache_msg: discord.Message,
-                 cache: dict[int, int]
+                 requests: scheduler.RequestScheduler,
+                 checkpoints: dict[int, tuple[int, int]] | None = None,
+                 rebuild: bool = False
                  ):
         self.guild = guild
         self.category = category
         self.index = index
         self.data_channels = data_channels
-        self._cache_msg = cache_msg
-        self.cache = cache
+        self._cache_msg: discord.Message | None = None
+        self.cache: dict[int, int] = {}
+        self.checkpoints = checkpoints or {}  # channel_id: (last scanned message id, size up to it)
+        self.loaded = False
+        self.needs_rebuild = rebuild
+        self.dirty = False
+        self.scheduler = requests  # Shared with MemoryManager.
+        self._channel_locks: dict[int, asyncio.Lock] = {}
+        self._load_lock = asyncio.Lock()
+
+    async def load(self) -> None:
+        """ Fetch (or rebuild) bucket's cache on first use. """
+        async with self._load_lock:
+            if self.loaded:
+                return
+
+            self._cache_msg, self.cache = await self._fetch_cache_msg()
+
+            if self.needs_rebuild:
+                Log.warn(f"Bucket {self.index} at guild {self.guild.name} has unsaved cache changes, rebuilding...")
+                self.cache, self.checkpoints = await self._build_cache(self.checkpoints)
+                self.needs_rebuild = False
+                self.dirty = True
+
+            self.loaded = True
+
+    async def _fetch_cache_msg(self) -> tuple[discord.Message, dict[int, int]]:
+        """ Fetch meta message and cache. """
+        cache_channel = None
+        cache = None
+
+        for channel in self.category.text_channels:
+            if channel.name == "_cache":
+                cache_channel = channel
+                break
+        else:
+            Log.error(f"No _cache channel found in data bucket: {self.index} at guild: {self.guild.name}.")
+            Log.info("The _cache meta channel will be created and Bucket will be cached.")
+
+            cache, self.checkpoints = await self._build_cache()
+            cache_channel = await self.scheduler.request(scheduler.WRITE, "channels", lambda: self.category.create_text_channel("_cache"))
+
+        async def latest_message() -> list[discord.Message]:
+            return [message async for message in cache_channel.history(limit=1)]
+
+        cache_message = await self.scheduler.request(scheduler.WRITE, f"history:{cache_channel.id}", latest_message)
+        cache_message = cache_message[0] if cache_message else None
+
+        if cache_message is None:
+            if cache is None:
+                cache, self.checkpoints = await self._build_cache()
+
+            Log.info(f"Cache mesasge not found on meta channel in bucket: {self.index} at guild: {self.guild.name}, sending...")
+            cache_content = base64.b64encode(json.dumps(cache or {}).encode()).decode()
+            cache_message = await self.scheduler.request(scheduler.WRITE, f"send:{cache_channel.id}", lambda: cache_channel.send(cache_content))
+
+        else:
+            cache_message = await self.scheduler.request(scheduler.WRITE, f"fetch:{cache_channel.id}", cache_message.fetch)
+            cache_enc = cache_message.content
+            raw_cache = json.loads(base64.b64decode(cache_enc).decode())
+            cache = {int(k): v for k, v in raw_cache.items()}
+
+        if cache_message.author.id != client.user.id:
+            Log.warn(f"Latest message on cache channel at bucket: {self.index} does not belong to bot at: {self.guild.name}")
+            await self.scheduler.request(scheduler.WRITE, f"delete:{cache_channel.id}", cache_message.delete)
+            return await self._fetch_cache_msg()
+
+        return (cache_message, cache)
+
+    def _channel_lock(self, ch_id: int) -> asyncio.Lock:
+        """ Lock held while sending messages to a data channel, so allocated runs are not interleaved. """
+        return self._channel_locks.setdefault(ch_id, asyncio.Lock())
 
     async def _save_cache(self) -> None:
+        self.dirty = False
         content = base64.b64encode(json.dumps(self.cache).encode()).decode()
+        cache_channel = self._cache_msg.channel
         try:
-            await self._cache_msg.edit(content=content)
+            await self.scheduler.request(scheduler.HOUSEKEEPING, f"edit:{cache_channel.id}", lambda: self._cache_msg.edit(content=content))
         except discord.HTTPException:
             Log.warn(f"Failed to save cache at bucket {self.index} at guild {self.guild.name} - Message edit error.")
-            await self._cache_msg.channel.send(content)
+            self._cache_msg = await self.scheduler.request(scheduler.HOUSEKEEPING, f"send:{cache_channel.id}", lambda: cache_channel.send(content))
 
-    async def _reduce_cache_size(self, ch_id: int, size: int) -> None:
-        """ Substract size from cache for channel. """
+    def _change_cache_size(self, ch_id: int, delta: int) -> bool:
+        """ Change cached size of channel in memory only. Cache is marked as dirty until it's saved. """
         if ch_id not in self.cache:
-            Log.error(f"Failed to subtract {size}b from sizecache for channel {ch_id} at {self.guild.name}")
-            return
-
-        self.cache[ch_id] -= size
-        if self.cache[ch_id] < 0:
-            self.cache[ch_id] = 0
-
-        await self._save_cache()
-        Log.info(f"Subtracted {size}b from cache for channel {ch_id} at {self.guild.name}")
+            Log.error(f"Failed to change sizecache by {delta}b for channel {ch_id} at {self.guild.name}")
+            return False
 
-    async def _increase_cache_size(self, ch_id: int, size: int) -> None:
-        """ Add size to cache for channel. """
-        await self._reduce_cache_size(ch_id, -size)
-        Log.info(f"Appended {size}b to cache for channel {ch_id} at {self.guild.name}")
+        self.cache[ch_id] = max(self.cache[ch_id] + delta, 0)
+        self.dirty = True
+        return True
 
-    async def alloc_message(self, msg_size: int) -> discord.Message | None:
+    async def send_run(self,
+                       channel: discord.TextChannel,
+                       count: int,
+                       attachments: list[list[bytes]] | None = None,
+                       lane: int = scheduler.WRITE
+                       ) -> list[discord.Message]:
         """
-        Sends blank message that will be edited with content.
+        Sends blank messages (with space reserved by allocator) one after another on a single channel,
+        so they form a contiguous run. If attachments are given, messages are sent with their parts attached.
+        Returns messages sent before any error occurred.
         """
-        for data_ch in self.data_channels.values():
-            ch_id = data_ch.id
-            used_size = self.cache[ch_id]
-            avb_size = limits.TOTAL_CHANNEL_CONTENT_SIZE - used_size
+        def send_attachments(parts: list[bytes]) -> Awaitable[discord.Message]:
+            files = [discord.File(io.BytesIO(part), f"{n}_{dedup.chunk_hash(part)}.part") for n, part in enumerate(parts)]
+            return channel.send("@END", files=files)
 
-            if msg_size <= avb_size:
-                message = await data_ch.send("⏱️ `waiting for data...`")
-                # self.cache[ch_id] += msg_size
-                # await self._save_cache()
-                return message
+        run = []
+        route = f"send:{channel.id}"
+        async with self._channel_lock(channel.id):
+            try:
+                for i in range(count):
+                    if attachments is None:
+                        run.append(await self.scheduler.request(lane, route, lambda: channel.send("⏱️ `waiting for data...`")))
+                        continue
 
-        return None
+                    run.append(await self.scheduler.request(lane, route, lambda: send_attachments(attachments[i])))
+
+            except discord.HTTPException as error:
+                Log.error(f"Failed to send memory message at channel {channel.name} in bucket {self.index} at {self.guild.name}: {error}")
+
+        return run
 
     def memory_usage(self) -> int:
         """ Return amount of bytes stored in this bucket. """
@@ -238,6 +527,9 @@ class MemoryManager:
     @staticmethod
     async def init(guild: discord.Guild) -> "MemoryManager":
         buckets = {}
+        dirty_buckets = _load_dirty_buckets(guild.id)
+        checkpoints = _load_checkpoints(guild.id)
+        requests = scheduler.RequestScheduler()
 
         for category in guild.categories:
             name = category.name.lower()
@@ -250,15 +542,32 @@ class MemoryManager:
                 continue
 
             index = int(index)
-            bucket = await _DataBucket.init(guild, category, index)
+            bucket = await _DataBucket.init(guild, category, index, requests, rebuild=index in dirty_buckets, checkpoints=checkpoints.get(index))
             buckets[index] = bucket
 
-        return MemoryManager(guild, buckets)
+        # Buckets caches are loaded lazily, on first allocation or usage query.
+        manager = MemoryManager(guild, buckets, requests)
+        manager._dirty_buckets = dirty_buckets
+        return manager
 
-    def __init__(self, guild: discord.Guild, buckets: dict[int, _DataBucket]) -> None:
+    def __init__(self, guild: discord.Guild, buckets: dict[int, _DataBucket], requests: scheduler.RequestScheduler) -> None:
         self.guild = guild
         self.buckets = buckets
-        self._removed_messages = deque([], 10)
+        self.scheduler = requests
+        self._removed_messages = deque([], 1000)
+        self._fetch_semaphore = asyncio.Semaphore(limits.MAX_PARALLEL_FETCHES)
+        self.registry = dedup.ChunksRegistry(guild.id)
+        self._dirty_buckets: set[int] = set()
+        self.allocator = allocator.ChannelsAllocator()
+        self._reservations: dict[int, tuple[int, int]] = {}  # message_id: (channel_id, reserved_size)
+        self.sync_allocator()
+        self.pool = pool.PlaceholderPool()
+        self._channel_creation_lock = asyncio.Lock()
+        self._refill_task: asyncio.Task | None = None
+        self._flush_task: asyncio.Task | None = None
+        self._verifications: dict[tuple[int, int], asyncio.Task] = {}  # (channel_id, first message's id): check of cached run
+        self.chunks_cache = chunks_cache.ChunksCache(limits.CHUNKS_CACHE_SIZE_B, disk_cache.DiskChunksCache(guild.id), self._restore_message)
+        self.gc_stats = {"runs": 0, "last_run": None, "last_reclaimed_bytes": 0, "reclaimed_bytes": 0, "deleted_messages": 0}
 
     def split_content(self, content: str, n=limits.MSG_SIZE) -> list[str]:
         return [content[i:i + n] for i in range(0, len(content), n)]
@@ -282,33 +591,101 @@ class MemoryManager:
         Log.error(f"Passed invalid query arg for find_bucket(): {type(q)} {q}")
         return None
 
-    def get_memory_usage(self) -> dict[int, int]:
+    async def get_memory_usage(self) -> dict[int, int]:
         """ Return total memory used per bucket. Returns INDEX:BYTES """
+        await self.load_buckets()
         return {i: b.memory_usage() for i, b in self.buckets.items()}
 
-    async def remove_from_cache(self, file: fs.FS_File) -> None:
-        """ Remove file sizes only from cache. """
-        trace = await self.get_content_trace(file.mem_addr)
-        if isinstance(trace, errors.T_Error):
-            Log.error(f"Failed to wipe file: {file.name} from cache: {trace}")
+    async def update_cache_size(self, message: discord.Message | discord.PartialMessage, delta: int) -> None:
+        """
+        Change cached size of message's channel by delta bytes. Bucket's cache is saved later by `flush_caches`.
+        Space reserved for the message while allocating is released, as it's real size is accounted now.
+        """
+        reservation = self._reservations.pop(message.id, None)
+        if reservation is not None:
+            self.allocator.release(*reservation)
+
+        if delta == 0:
             return
-        
-        for msg in trace:
-            alloc_size = len(msg.content.split("@")[0])
-            bucket = self.find_bucket(msg)
-            await bucket._reduce_cache_size(msg.channel.id, alloc_size)
-
-    async def cache_sizes(self, file: fs.FS_File) -> None:
-        """ Save file sizes in cache using it's trace. """
-        trace = await self.get_content_trace(file.mem_addr)
-        if isinstance(trace, errors.T_Error):
-            Log.error(f"Failed to save file: {file.name} in cache: {trace}")
+
+        bucket = self.find_bucket(message.channel)
+        await self.load_bucket(bucket)
+        if bucket._change_cache_size(message.channel.id, delta):
+            self._mark_dirty(bucket)
+            self.allocator.set_used(message.channel.id, bucket.cache[message.channel.id])
+
+        # Changes of already scanned messages can't be found by an incremental scan.
+        checkpoint = bucket.checkpoints.get(message.channel.id)
+        if checkpoint is not None and message.id <= checkpoint[0]:
+            del bucket.checkpoints[message.channel.id]
+            self.save_checkpoints()
+
+    async def load_bucket(self, bucket: _DataBucket) -> None:
+        """ Load bucket's cache (if not loaded yet) and register it's channels in the allocator. """
+        if bucket.loaded:
             return
-        
-        for msg in trace:
-            alloc_size = len(msg.content.split("@")[0])
-            bucket = self.find_bucket(msg)
-            await bucket._increase_cache_size(msg.channel.id, alloc_size)
+
+        await bucket.load()
+        for channel in bucket.data_channels.values():
+            self.allocator.set_used(channel.id, bucket.cache.get(channel.id, 0))
+
+        if bucket.dirty:
+            self._mark_dirty(bucket)
+            self.save_checkpoints()
+
+    async def load_buckets(self) -> None:
+        """ Load caches of all buckets not loaded yet concurrently. """
+        unloaded = [bucket for bucket in self.buckets.values() if not bucket.loaded]
+        if unloaded:
+            await asyncio.gather(*(self.load_bucket(bucket) for bucket in unloaded))
+
+    def sync_allocator(self) -> None:
+        """ Load used size of every data channel from loaded buckets caches into the allocator. """
+        for bucket in self.buckets.values():
+            if not bucket.loaded:
+                continue
+
+            for channel in bucket.data_channels.values():
+                self.allocator.set_used(channel.id, bucket.cache.get(channel.id, 0))
+
+    async def recache_bucket(self, bucket: _DataBucket, incremental: bool = False) -> None:
+        """ Recalculate bucket's cache from it's channels history and save it. Incremental recache resumes from checkpoints. """
+        await self.load_bucket(bucket)
+        checkpoints = bucket.checkpoints if incremental else None
+        bucket.cache, bucket.checkpoints = await bucket._build_cache(checkpoints)
+        await bucket._save_cache()
+        self.save_checkpoints()
+        self.sync_allocator()
+
+    def save_checkpoints(self) -> None:
+        _save_checkpoints(self.guild.id, {index: bucket.checkpoints for index, bucket in self.buckets.items()})
+
+    def _mark_dirty(self, bucket: _DataBucket) -> None:
+        """ Remember bucket with unsaved cache (also on disk, in case of crash) and schedule flush. """
+        if bucket.index not in self._dirty_buckets:
+            self._dirty_buckets.add(bucket.index)
+            _save_dirty_buckets(self.guild.id, self._dirty_buckets)
+
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(limits.CACHE_FLUSH_INTERVAL)
+        await self.flush_caches()
+
+        # Changes made while flushing couldn't schedule another flush (this one was still running).
+        if any(bucket.dirty for bucket in self.buckets.values()):
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def flush_caches(self) -> None:
+        """ Save caches of all dirty buckets. Changes made meanwhile are saved by the next flush. """
+        for bucket in self.buckets.values():
+            if bucket.dirty:
+                await bucket._save_cache()
+
+        # Not loaded buckets waiting for rebuild are still not trusted.
+        self._dirty_buckets = {bucket.index for bucket in self.buckets.values() if bucket.dirty or bucket.needs_rebuild}
+        _save_dirty_buckets(self.guild.id, self._dirty_buckets)
 
     async def __create_new_data_channel(self) -> discord.TextChannel | errors.T_Error:
         """ Create new data channel at lowest data bucket or create new bucket with a channel. """
@@ -318,10 +695,11 @@ class MemoryManager:
                 new_id = str(ch_amount)
 
                 Log.info(f"Created new data channel {new_id} at bucket {bucket.index} at guild {self.guild.name}")
-                channel = await bucket.category.create_text_channel(new_id)
+                channel = await self.scheduler.request(scheduler.WRITE, "channels", lambda: bucket.category.create_text_channel(new_id))
                 bucket.data_channels[ch_amount] = channel
                 bucket.cache[channel.id] = 0
                 await bucket._save_cache()
+                self.allocator.set_used(channel.id, 0)
                 return channel
 
         if len(self.buckets) >= limits.MAX_BUCKETS:
@@ -330,30 +708,82 @@ class MemoryManager:
 
         next_bucket_id = len(self.buckets)
         
-        admin_role = self.guild.get_role(guilds_ids_db.get(self.guild.id).admin_id)
+        admin_role = self.guild.get_role(guilds_ids_db.get(self.guild.id).admin_role)
         system_category_perms = {
             self.guild.default_role: discord.PermissionOverwrite(view_channel=False),
             admin_role: discord.PermissionOverwrite(view_channel=True, send_messages=False)
         }
-        bucket_category = await self.guild.create_category(f"data_{next_bucket_id}", overwrites=system_category_perms)
-        bucket = await _DataBucket.init(self.guild, bucket_category, next_bucket_id)
-        self.buckets[bucket] = bucket
+        bucket_category = await self.scheduler.request(
+            scheduler.WRITE, "channels",
+            lambda: self.guild.create_category(f"data_{next_bucket_id}", overwrites=system_category_perms)
+        )
+        bucket = await _DataBucket.init(self.guild, bucket_category, next_bucket_id, self.scheduler)
+        self.buckets[next_bucket_id] = bucket
+        await self.load_bucket(bucket)
 
         Log.info(f"Created new bucket {next_bucket_id} for guild {self.guild.name} (data channel needed)")
         return bucket.data_channels[0]
 
+    def _restore_message(self, channel_id: int, message_id: int, content: str, edited_at: datetime.datetime) -> discord.Message | None:
+        channel = self.guild.get_channel(channel_id)
+        if channel is None:
+            return None
+        return _CachedMessage(channel, message_id, content, edited_at)
+
+    def _verify_later(self, messages: list[discord.Message]) -> None:
+        """ Check run of messages restored from disk cache entries written before restart (in background). """
+        channel_id = messages[0].channel.id
+        key = (channel_id, messages[0].id)
+        if key in self._verifications or self.chunks_cache.verified(channel_id, [msg.id for msg in messages]):
+            return
+
+        task = asyncio.create_task(self._verify_run(channel_id, [msg.id for msg in messages]))
+        self._verifications[key] = task
+        task.add_done_callback(lambda _: self._verifications.pop(key, None))
+
+    async def _verify_run(self, channel_id: int, messages_ids: list[int]) -> None:
+        """ Compare cached run with Discord using a single history request. Changed messages are dropped from cache. """
+        channel = self.guild.get_channel(channel_id)
+        if channel is None:
+            return
+
+        async def read_history() -> list[discord.Message]:
+            after = discord.Object(id=messages_ids[0] - 1)
+            return [msg async for msg in channel.history(limit=len(messages_ids), after=after, oldest_first=True)]
+
+        try:
+            messages = await self.scheduler.request(scheduler.HOUSEKEEPING, f"history:{channel_id}", read_history)
+        except discord.HTTPException as error:
+            Log.warn(f"Failed to verify cached messages at {self.guild.name}: {error}")
+            return
+
+        if [msg.id for msg in messages] != messages_ids:
+            Log.warn(f"Cached messages changed while offline at {self.guild.name} (channel: {channel_id})")
+            for message_id in messages_ids:
+                self.chunks_cache.invalidate(channel_id, message_id)
+            return
+
+        # Up to date entries are only marked as verified.
+        self.chunks_cache.put_run(messages)
+
     async def seek_addr(self, addr: fs.MemoryAddress) -> discord.Message | None:
+        cached = await self.chunks_cache.get(addr)
+        if cached is not None:
+            self._verify_later([cached])
+            return cached
+
         channel = self.guild.get_channel(addr.channel_id)
         if channel is None:
             Log.error(f"Memory error at {self.guild.name}: Invalid channel id: {addr.channel_id}")
             return None
 
         try:
-            message = await channel.get_partial_message(addr.message_id).fetch()
+            message = await self.scheduler.request(scheduler.READ, f"fetch:{channel.id}", channel.get_partial_message(addr.message_id).fetch)
         except discord.NotFound:
             Log.error(f"Memory error at {self.guild.name}: Invalid message id: {addr.message_id} at channel: {channel.id}")
             return None
 
+        self.chunks_cache.put(message)
         return message
 
     async def get_content_trace(self, header_addr: fs.MemoryAddress) -> list[discord.Message] | errors.T_Error:
@@ -368,7 +798,7 @@ class MemoryManager:
 
             trace.append(msg)
 
-            _, addr = msg.content.split("@")
+            _, addr = _split_mem_content(msg.content)
             if addr == "END":
                 break
             ch_id, msg_id = addr.split(":")
@@ -376,38 +806,865 @@ class MemoryManager:
 
         return trace
 
+    async def get_index_trace(self, head_addr: fs.MemoryAddress) -> tuple[list[discord.Message], list[fs.MemoryExtent]] | errors.T_Error:
+        """ Walk file's index chain. Returns (index messages, chunks extents). """
+        index_messages = []
+        extents = []
+
+        addr = head_addr
+        while addr != "END":
+            msg = await self.seek_addr(addr)
+            if msg is None:
+                Log.error(f"Broken index trace at guild: {self.guild.name} (at: {addr.prepare_mem_addr()})")
+                return errors.INVALID_MEM_ADDR
+
+            index_messages.append(msg)
+
+            entries, addr = _split_mem_content(msg.content)
+            extents.extend(fs.MemoryExtent.from_str(entry) for entry in entries.split(INDEX_SEP) if entry)
+            if addr != "END":
+                addr = fs.MemoryAddress.from_str(addr)
+
+        return index_messages, extents
+
+    async def fetch_extent(self, extent: fs.MemoryExtent) -> list[discord.Message] | None:
+        """ Fetch all messages of an extent. Runs are read with a single history request per 100 messages. """
+        if extent.count == 1:
+            message = await self.seek_addr(extent.head())
+            return [message] if message is not None else None
+
+        cached = await self.chunks_cache.get_run(extent.channel_id, extent.message_id, extent.count)
+        if cached is not None:
+            self._verify_later(cached)
+            return cached
+
+        channel = self.guild.get_channel(extent.channel_id)
+        if channel is None:
+            Log.error(f"Memory error at {self.guild.name}: Invalid channel id: {extent.channel_id}")
+            return None
+
+        async def read_history() -> list[discord.Message]:
+            after = discord.Object(id=extent.message_id - 1)
+            return [msg async for msg in channel.history(limit=extent.count, after=after, oldest_first=True)]
+
+        messages = await self.scheduler.request(scheduler.READ, f"history:{channel.id}", read_history)
+
+        if len(messages) != extent.count or messages[0].id != extent.message_id:
+            Log.error(f"Memory error at {self.guild.name}: Broken extent: {extent.prepare_mem_addr()} (got {len(messages)} messages)")
+            return None
+
+        self.chunks_cache.put_run(messages)
+        return messages
+
+    async def fetch_extents(self, extents: list[fs.MemoryExtent]) -> list[discord.Message] | errors.T_Error:
+        """ Fetch messages of all extents concurrently. Order is preserved. """
+        async def fetch(extent: fs.MemoryExtent) -> list[discord.Message] | None:
+            async with self._fetch_semaphore:
+                return await self.fetch_extent(extent)
+
+        runs = await asyncio.gather(*(fetch(extent) for extent in extents))
+        if None in runs:
+            return errors.INVALID_MEM_ADDR
+
+        return [message for run in runs for message in run]
+
+    async def iter_extents(self, extents: list[fs.MemoryExtent]) -> AsyncIterator[list[discord.Message]]:
+        """ Yield messages of extents in order. Only a few following extents are fetched ahead. """
+        pending: deque[asyncio.Task] = deque()
+        extents = iter(extents)
+
+        async def fetch(extent: fs.MemoryExtent) -> list[discord.Message] | None:
+            async with self._fetch_semaphore:
+                return await self.fetch_extent(extent)
+
+        def fetch_ahead() -> None:
+            while len(pending) < limits.MAX_PARALLEL_FETCHES:
+                extent = next(extents, None)
+                if extent is None:
+                    return
+                pending.append(asyncio.create_task(fetch(extent)))
+
+        try:
+            fetch_ahead()
+            while pending:
+                messages = await pending.popleft()
+                if messages is None:
+                    raise MemoryStreamError(errors.INVALID_MEM_ADDR)
+
+                fetch_ahead()
+                yield messages
+
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def iter_content_trace(self, header_addr: fs.MemoryAddress) -> AsyncIterator[list[discord.Message]]:
+        """ Yield messages of a legacy chain one by one. """
+        addr = header_addr
+        while addr != "END":
+            msg = await self.seek_addr(addr)
+            if msg is None:
+                Log.error(f"Broken memory trace at guild: {self.guild.name} (at: {addr.prepare_mem_addr()})")
+                raise MemoryStreamError(errors.INVALID_MEM_ADDR)
+
+            yield [msg]
+
+            _, addr = _split_mem_content(msg.content)
+            if addr != "END":
+                addr = fs.MemoryAddress.from_str(addr)
+
+    async def get_file_trace(self, file: fs.FS_File, include_index: bool = False) -> list[discord.Message] | errors.T_Error:
+        """ Return file's content messages in order (optionally with index messages first) regardless of it's layout. """
+        if file.layout == fs.Layout.CHAIN:
+            return await self.get_content_trace(file.mem_addr)
+
+        index = await self.get_index_trace(file.mem_addr)
+        if isinstance(index, errors.T_Error):
+            return index
+
+        index_messages, extents = index
+        chunks = await self.fetch_extents(extents)
+        if isinstance(chunks, errors.T_Error) or not include_index:
+            return chunks
+
+        return index_messages + chunks
+
+    def build_extents(self, messages: list[discord.Message], runs: list[list[discord.Message]]) -> list[fs.MemoryExtent]:
+        """
+        Describe ordered chunks messages as extents. Neighbouring messages are merged only if
+        they are neighbours in one of known contiguous runs (messages sent one after another).
+        """
+        positions = {}
+        for run_index, run in enumerate(runs):
+            for position, msg in enumerate(run):
+                positions[msg.id] = (run_index, position)
+
+        extents = []
+        prev_key = None
+        prev_id = None
+
+        for msg in messages:
+            key = positions.get(msg.id)
+            is_next = (
+                extents and key is not None and prev_key is not None
+                and key[0] == prev_key[0] and key[1] == prev_key[1] + 1
+                and extents[-1].count < limits.HISTORY_BATCH_SIZE
+            )
+
+            if is_next:
+                extents[-1].count += 1
+                self.chunks_cache.link(msg.channel.id, prev_id, msg.id)
+            else:
+                extents.append(fs.MemoryExtent(msg.channel.id, msg.id))
+
+            prev_key = key
+            prev_id = msg.id
+
+        return extents
+
+    def build_index_pages(self, extents: list[fs.MemoryExtent]) -> list[str]:
+        """ Split chunks extents into index pages content. There is always at least one (maybe blank) page. """
+        pages = []
+        page = []
+        page_size = 0
+
+        for extent in extents:
+            entry = extent.prepare_mem_addr()
+            if page and page_size + len(entry) > limits.MSG_SIZE:
+                pages.append(INDEX_SEP.join(page))
+                page = []
+                page_size = 0
+
+            page.append(entry)
+            page_size += len(entry) + len(INDEX_SEP)
+
+        pages.append(INDEX_SEP.join(page))
+        return pages
+
+    async def write_index(self, extents: list[fs.MemoryExtent], index_messages: list[discord.Message]) -> fs.MemoryAddress | errors.T_Error:
+        """ Save chunks extents as index chain reusing given index messages. Returns index head address. """
+        pages = self.build_index_pages(extents)
+        old_sizes = {msg.id: len(_split_mem_content(msg.content)[0]) for msg in index_messages}
+
+        for msg in index_messages[len(pages):]:
+            await self.deallocate_message(msg)
+
+        index_messages = index_messages[:len(pages)]
+
+        while len(index_messages) < len(pages):
+            msg = await self.allocate_memory_chunk(len(pages[len(index_messages)]))
+            if isinstance(msg, errors.T_Error):
+                return msg
+
+            index_messages.append(msg)
+
+        for i, (msg, page) in enumerate(zip(index_messages, pages)):
+            next_addr = "END"
+            if i < len(pages) - 1:
+                next_addr = fs.MemoryAddress.from_message(index_messages[i + 1]).prepare_mem_addr()
+
+            await self.edit_message(msg, f"{page}@{next_addr}")
+            await self.update_cache_size(msg, len(page) - old_sizes.get(msg.id, 0))
+
+        return fs.MemoryAddress.from_message(index_messages[0])
+
+    async def edit_message(self,
+                           message: discord.Message | discord.PartialMessage,
+                           content: str,
+                           lane: int = scheduler.WRITE
+                           ) -> discord.Message | discord.PartialMessage:
+        """ Edit memory message and refresh it in chunks cache. Returns edited message. """
+        # Dropped before editing, so persistent cache never keeps the old content.
+        following_id = self.chunks_cache.following_id(message.channel.id, message.id)
+        self.chunks_cache.invalidate(message.channel.id, message.id)
+        edited = await self.scheduler.request(lane, f"edit:{message.channel.id}", lambda: message.edit(content=content))
+        if edited is None:
+            return message
+
+        self.chunks_cache.put(edited, following_id)
+        return edited
+
+    def _partial_message(self, addr: fs.MemoryAddress) -> discord.PartialMessage | None:
+        channel = self.guild.get_channel(addr.channel_id)
+        if channel is None:
+            return None
+        return channel.get_partial_message(addr.message_id)
+
+    async def store_chunks(self,
+                           current_trace: list[discord.Message],
+                           current_runs: list[list[discord.Message]],
+                           payloads: list[str]
+                           ) -> tuple[list[discord.Message | discord.PartialMessage], list[list[discord.Message]]] | errors.T_Error:
+        """
+        Place file's new content chunks in memory. Chunks already stored (by this or any other file) are only referenced.
+        Old chunks owned only by this file are overridden with new content or deallocated if not needed anymore.
+        Returns new trace and contiguous runs it is made of. Chunks registry is not saved.
+        """
+        registry = self.registry
+        hashes = [dedup.chunk_hash(payload) for payload in payloads]
+        old_hashes = {msg.id: dedup.chunk_hash(_split_mem_content(msg.content)[0]) for msg in current_trace}
+        old_by_id = {msg.id: msg for msg in current_trace}
+
+        # Old chunks referenced only by this file can be reused.
+        old_refs = Counter()
+        for msg in current_trace:
+            if registry.is_tracked(old_hashes[msg.id], fs.MemoryAddress.from_message(msg)):
+                old_refs[msg.id] += 1
+
+        owned = {}
+        for msg in current_trace:
+            hash = old_hashes[msg.id]
+            if msg.id not in old_refs or registry.refs(hash) == old_refs[msg.id]:
+                owned[msg.id] = msg
+
+        trace = [None] * len(payloads)
+        first_position = {}
+        to_store = []
+
+        for i, hash in enumerate(hashes):
+            if hash in first_position:
+                continue
+
+            first_position[hash] = i
+            addr = registry.get(hash)
+            if addr is None:
+                to_store.append(i)
+                continue
+
+            holder = old_by_id.get(addr.message_id) or self._partial_message(addr)
+            if holder is None:
+                registry.forget(hash)
+                to_store.append(i)
+                continue
+
+            trace[i] = holder
+            owned.pop(addr.message_id, None)
+
+        # Override old chunks (preferably at the same position) and allocate the rest.
+        free = list(owned.values())
+        stores = {}
+
+        for i in to_store:
+            if i < len(current_trace) and current_trace[i].id in owned and current_trace[i] in free:
+                stores[i] = current_trace[i]
+                free.remove(current_trace[i])
+
+        for i in to_store:
+            if i not in stores and free:
+                stores[i] = free.pop(0)
+
+        missing = [i for i in to_store if i not in stores]
+        new_runs = []
+        if missing:
+            new_runs = await self.allocate_memory_runs([len(payloads[i]) for i in missing], stripes=self.stripes_for(len(missing)))
+            if isinstance(new_runs, errors.T_Error):
+                return new_runs
+
+            allocated = [msg for run in new_runs for msg in run]
+            for i, msg in zip(missing, allocated):
+                stores[i] = msg
+
+        # Rate limits are per channel, so every channel's chunks are edited concurrently.
+        async def store_in_channel(channel_stores: list[tuple[int, discord.Message]]) -> None:
+            for i, msg in channel_stores:
+                old_size = 0
+                if msg.id in old_by_id:
+                    old_size = len(_split_mem_content(msg.content)[0])
+
+                # Chunk already holding the same content (eg. not registered) is not edited.
+                if msg.id in old_by_id and msg.content == payloads[i] + "@END":
+                    trace[i] = msg
+                    continue
+
+                trace[i] = await self.edit_message(msg, payloads[i] + "@END")
+                await self.update_cache_size(msg, len(payloads[i]) - old_size)
+
+        stores_per_channel = {}
+        for i, msg in stores.items():
+            stores_per_channel.setdefault(msg.channel.id, []).append((i, msg))
+        await asyncio.gather(*(store_in_channel(channel_stores) for channel_stores in stores_per_channel.values()))
+
+        for i, hash in enumerate(hashes):
+            if trace[i] is None:
+                trace[i] = trace[first_position[hash]]
+
+        # Update references: new ones first, so shared entries are never dropped.
+        new_refs = Counter(hashes)
+        for hash, n in new_refs.items():
+            if first_position[hash] not in stores:
+                registry.incref(hash, n)
+
+        for msg in current_trace:
+            if msg.id in old_refs:
+                registry.decref(old_hashes[msg.id])
+
+        for i, msg in stores.items():
+            registry.register(hashes[i], fs.MemoryAddress.from_message(msg), new_refs[hashes[i]])
+
+        for msg in free:
+            registry.forget(old_hashes[msg.id])
+            await self.deallocate_message(msg)
+
+        return trace, current_runs + new_runs
+
     async def allocate_memory_chunk(self, size: int) -> discord.Message | errors.T_Error:
         """ Allocate memory for given size. Do not override it with any content. """
-        for bucket in self.buckets.values():
-            message_holder = await bucket.alloc_message(size)
-            if message_holder is not None:
-                return message_holder
+        runs = await self.allocate_memory_runs([size])
+        if isinstance(runs, errors.T_Error):
+            return runs
 
-        channel = await self.__create_new_data_channel()
-        if isinstance(channel, errors.T_Error):
-            Log.error(f"Failed to allocate memory chunk of size {size}b at guild {self.guild.name}")
+        return runs[0][0]
 
-        return await self.allocate_memory_chunk(size)
+    async def relocate_chunks(self, payloads: list[str]) -> tuple[list[discord.Message], list[list[discord.Message]]] | errors.T_Error:
+        """
+        Store chunks in newly allocated messages as a single contiguous run if possible (not deduplicated).
+        Chunks are edited at low priority. Returns trace and runs.
+        """
+        runs = await self.allocate_memory_runs([len(payload) for payload in payloads])
+        if isinstance(runs, errors.T_Error):
+            return runs
+
+        trace = []
+        for msg, payload in zip([msg for run in runs for msg in run], payloads):
+            trace.append(await self.edit_message(msg, payload + "@END", scheduler.HOUSEKEEPING))
+            await self.update_cache_size(msg, len(payload))
+
+        return trace, runs
+
+    def stripes_for(self, chunks: int) -> int:
+        """ Amount of data channels used to write given amount of chunks in parallel. """
+        return max(1, min(limits.WRITE_STRIPES, chunks // limits.MIN_STRIPE_CHUNKS))
+
+    async def allocate_memory_runs(self,
+                                   sizes: list[int],
+                                   attachments: list[list[bytes]] | None = None,
+                                   stripes: int = 1
+                                   ) -> list[list[discord.Message]] | errors.T_Error:
+        """
+        Allocate memory for chunks of given sizes as few contiguous runs as possible. Do not override it with any content.
+        If attachments are given, every message is sent with it's parts attached.
+        With multiple stripes, chunks are split into contiguous stripes allocated concurrently in different channels.
+        Space is reserved until messages sizes are accounted. On failure all allocated messages are released.
+        """
+        await self.load_buckets()
+        if stripes <= 1 or len(sizes) < 2:
+            return await self._allocate_stripe(sizes, attachments, set())
+
+        unit = -(-len(sizes) // stripes)
+        busy_channels = set()
+        stripes_runs = await asyncio.gather(*(
+            self._allocate_stripe(sizes[i:i + unit], attachments[i:i + unit] if attachments is not None else None, busy_channels)
+            for i in range(0, len(sizes), unit)
+        ))
+
+        errors_found = [runs for runs in stripes_runs if isinstance(runs, errors.T_Error)]
+        if errors_found:
+            await self._release_runs([run for runs in stripes_runs if not isinstance(runs, errors.T_Error) for run in runs])
+            return errors_found[0]
+
+        return [run for runs in stripes_runs for run in runs]
+
+    async def _allocate_stripe(self,
+                               sizes: list[int],
+                               attachments: list[list[bytes]] | None,
+                               busy_channels: set[int]
+                               ) -> list[list[discord.Message]] | errors.T_Error:
+        """ Allocate runs preferably in channels not used by other stripes (busy channels). """
+        runs = []
+
+        while sizes:
+            channel_id, run = None, []
+            if attachments is None:
+                channel_id, run = self._take_placeholders(sizes, busy_channels)
+
+            if run:
+                fitting = len(run)
+            else:
+                channel_id, fitting = self.allocator.reserve_run(sizes, busy_channels)
+                if channel_id is None:
+                    channel_id, fitting = self.allocator.reserve_run(sizes)
+
+            if channel_id is None:
+                channel = await self._create_data_channel_once()
+                if isinstance(channel, errors.T_Error):
+                    Log.error(f"Failed to allocate {len(sizes)} memory chunks at guild {self.guild.name}")
+                    await self._release_runs(runs)
+                    return channel
+                continue
+
+            busy_channels.add(channel_id)
+            if not run:
+                channel = self.guild.get_channel(channel_id)
+                bucket = self.find_bucket(channel)
+                run = await bucket.send_run(channel, fitting, attachments[:fitting] if attachments is not None else None)
+
+            for message, size in zip(run, sizes):
+                self._reservations[message.id] = (channel_id, size)
+            self.allocator.release(channel_id, sum(sizes[len(run):fitting]))
+
+            runs.append(run)
+            if len(run) < fitting:
+                await self._release_runs(runs)
+                return errors.MEMORY_ERROR
+
+            sizes = sizes[fitting:]
+            if attachments is not None:
+                attachments = attachments[fitting:]
+
+        self.schedule_pool_refill()
+        return runs
+
+    async def _create_data_channel_once(self) -> discord.TextChannel | None | errors.T_Error:
+        """ Create new data channel unless other allocation has just created one. """
+        channels = self.allocator.channels_count()
+        async with self._channel_creation_lock:
+            if self.allocator.channels_count() != channels:
+                return None
+            return await self.__create_new_data_channel()
+
+    def _take_placeholders(self, sizes: list[int], exclude: set[int]) -> tuple[int | None, list[discord.Message]]:
+        """ Reserve space in a channel with pooled placeholders and take run of them. Returns (channel id, run). """
+        for channel_id in self.pool.channels():
+            if channel_id in exclude:
+                continue
+
+            fitting = self.allocator.reserve_in(channel_id, sizes[:self.pool.available_run(channel_id)])
+            if fitting:
+                return channel_id, self.pool.take(channel_id, fitting)
+
+        return None, []
+
+    def schedule_pool_refill(self) -> None:
+        """ Start background refill of placeholders pool if it's below the watermark. """
+        if self.pool.size() >= limits.PLACEHOLDER_POOL_WATERMARK:
+            return
+
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill_pool())
+
+    async def _refill_pool(self) -> None:
+        await self.load_buckets()
+        while self.pool.size() < limits.PLACEHOLDER_POOL_SIZE:
+            channel_id = self.allocator.most_free_channel()
+            if channel_id is None:
+                return
+
+            count = min(limits.PLACEHOLDER_POOL_SIZE - self.pool.size(), limits.PLACEHOLDER_POOL_REFILL_RATE)
+            channel = self.guild.get_channel(channel_id)
+            run = await self.find_bucket(channel).send_run(channel, count, lane=scheduler.HOUSEKEEPING)
+            if not run:
+                return
+
+            self.pool.put(channel_id, run)
+            await asyncio.sleep(len(run) / limits.PLACEHOLDER_POOL_REFILL_RATE)
+
+    async def drain_pool(self) -> None:
+        """ Delete all pooled placeholders (eg. at shutdown). """
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+
+        for channel_id, messages in self.pool.drain().items():
+            channel = self.guild.get_channel(channel_id)
+            self._removed_messages.extend(msg.id for msg in messages)
+            for i in range(0, len(messages), limits.HISTORY_BATCH_SIZE):
+                batch = messages[i:i + limits.HISTORY_BATCH_SIZE]
+                await self.scheduler.request(scheduler.HOUSEKEEPING, f"delete:{channel_id}", lambda: channel.delete_messages(batch))
+
+    async def _release_runs(self, runs: list[list[discord.Message]]) -> None:
+        for run in runs:
+            for message in run:
+                await self.deallocate_message(message)
+
+    async def store_attachments(self,
+                                content: bytes,
+                                current_trace: list[discord.Message],
+                                current_runs: list[list[discord.Message]]
+                                ) -> tuple[list[discord.Message], list[list[discord.Message]]] | errors.T_Error:
+        """
+        Store content in messages attachments (up to MAX_ATTACHMENTS_PER_MSG parts each). Returns trace and runs.
+        Current messages with the same parts are kept as they are, other ones are deallocated.
+        """
+        parts = _attachment_parts(content)
+        messages_parts = [parts[i:i + limits.MAX_ATTACHMENTS_PER_MSG] for i in range(0, len(parts), limits.MAX_ATTACHMENTS_PER_MSG)]
+
+        current = {}
+        for msg in current_trace:
+            key = tuple(_attachment_hash(att) for att in sorted(msg.attachments, key=_attachment_position))
+            current.setdefault(key, msg)
+
+        trace = [None] * len(messages_parts)
+        for i, msg_parts in enumerate(messages_parts):
+            key = tuple(dedup.chunk_hash(part) for part in msg_parts)
+            trace[i] = current.pop(key, None)
+
+        missing = [i for i, msg in enumerate(trace) if msg is None]
+        new_runs = []
+        if missing:
+            new_runs = await self.allocate_memory_runs(
+                [limits.MSG_SIZE] * len(missing),
+                [messages_parts[i] for i in missing],
+                stripes=min(limits.WRITE_STRIPES, len(missing))
+            )
+            if isinstance(new_runs, errors.T_Error):
+                return new_runs
+
+            allocated = [msg for run in new_runs for msg in run]
+            for i, msg in zip(missing, allocated):
+                trace[i] = msg
+                await self.update_cache_size(msg, limits.MSG_SIZE)
+
+        await self.release_messages(list(current.values()))
+        return trace, current_runs + new_runs
+
+    async def store_attachments_stream(self,
+                                       messages_parts: AsyncIterator[list[bytes]]
+                                       ) -> tuple[list[discord.Message], list[list[discord.Message]]] | errors.T_Error:
+        """
+        Store attachments messages while their parts are still being produced. Returns trace and runs.
+        Up to WRITE_STRIPES messages are sent concurrently, next parts are taken only when a sender is free,
+        so the producer is slowed down to the pace of Discord requests.
+        """
+        trace = {}
+        runs = []
+        failed = []
+        parts_lock = asyncio.Lock()
+        position = 0
+
+        async def sender() -> None:
+            nonlocal position
+            while True:
+                async with parts_lock:
+                    if failed:
+                        return
+
+                    try:
+                        parts = await anext(messages_parts, None)
+                    except UploadInterruptedError:
+                        failed.append(errors.UPLOAD_INTERRUPTED)
+                        return
+
+                    if parts is None:
+                        return
+
+                    message_position = position
+                    position += 1
+
+                new_runs = await self.allocate_memory_runs([limits.MSG_SIZE], [parts])
+                if isinstance(new_runs, errors.T_Error):
+                    failed.append(new_runs)
+                    return
+
+                message = new_runs[0][0]
+                trace[message_position] = message
+                runs.extend(new_runs)
+                await self.update_cache_size(message, limits.MSG_SIZE)
+
+        await asyncio.gather(*(sender() for _ in range(limits.WRITE_STRIPES)))
+
+        if failed:
+            await self.release_messages(list(trace.values()))
+            return failed[0]
+
+        return [trace[i] for i in range(position)], runs
+
+    async def download_attachment(self, attachment: discord.Attachment) -> bytes | None:
+        async with self._fetch_semaphore:
+            try:
+                return await self.scheduler.request(scheduler.READ, "cdn", attachment.read)
+            except (discord.HTTPException, discord.NotFound):
+                Log.error(f"Memory error at {self.guild.name}: Failed to download attachment: {attachment.url}")
+                return None
+
+    async def read_attachments(self, messages: list[discord.Message]) -> bytes | errors.T_Error:
+        """ Download attachments of given messages concurrently from CDN and join them in order. """
+        attachments = [att for msg in messages for att in sorted(msg.attachments, key=_attachment_position)]
+
+        parts = await asyncio.gather(*(self.download_attachment(att) for att in attachments))
+        if None in parts:
+            return errors.BROKEN_MEMORY
+
+        return b"".join(parts)
+
+    async def iter_attachments(self, message: discord.Message, first: int = 0, count: int | None = None) -> AsyncIterator[bytes]:
+        """ Yield message's attachments (optionally `count` of them starting at `first`) in order. All of them are downloaded concurrently. """
+        attachments = sorted(message.attachments, key=_attachment_position)[first:]
+        if count is not None:
+            attachments = attachments[:count]
+
+        downloads = deque(asyncio.create_task(self.download_attachment(att)) for att in attachments)
+
+        try:
+            while downloads:
+                part = await downloads.popleft()
+                if part is None:
+                    raise MemoryStreamError(errors.BROKEN_MEMORY)
+                yield part
+
+        finally:
+            for task in downloads:
+                task.cancel()
+
+    async def release_messages(self, messages: list[discord.Message]) -> None:
+        """ Deallocate messages not shared with other files. """
+        for message in messages:
+            await self.deallocate_message(message)
 
     async def deallocate_message(self, message: discord.Message) -> None:
         """ Remove message and reduce bucket's cache. """
-        bucket = self.find_bucket(message)
-        content_size = len(message.content.split("@")[0])
+        # Message with reserved space only was never accounted in bucket's cache.
+        content_size = 0 if message.id in self._reservations else _memory_size(message)
         self._removed_messages.append(message.id)
-        await bucket._reduce_cache_size(message.channel.id, content_size)
-        await message.delete()
+        self.chunks_cache.invalidate(message.channel.id, message.id)
+        await self.update_cache_size(message, -content_size)
+        await self.scheduler.request(scheduler.WRITE, f"delete:{message.channel.id}", message.delete)
 
     async def wipe_file(self, file: fs.FS_File) -> None:
-        """ Deallocate all file's memory chunks. """
-        content_trace = await self.get_content_trace(file.mem_addr)
+        """ Deallocate all file's memory chunks. Chunks shared with other files are only dereferenced. """
+        index_messages = []
+        if file.layout != fs.Layout.CHAIN:
+            index = await self.get_index_trace(file.mem_addr)
+            if isinstance(index, errors.T_Error):
+                Log.warn(f"Broken index trace for deleted file: {file.path_to()}")
+                return
+
+            index_messages, extents = index
+            content_trace = await self.fetch_extents(extents)
+        else:
+            content_trace = await self.get_content_trace(file.mem_addr)
 
         if isinstance(content_trace, errors.T_Error):
             Log.warn(f"Broken memory trace for deleted file: {file.path_to()}")
             return
 
+        await self.release_trace(index_messages, content_trace)
+
+    async def release_trace(self, index_messages: list[discord.Message], content_trace: list[discord.Message]) -> None:
+        """ Deallocate index and content messages. Chunks shared with other files are only dereferenced. """
+        for index_msg in index_messages:
+            await self.deallocate_message(index_msg)
+
+        removed = set()
         for content_msg in content_trace:
+            hash = dedup.chunk_hash(_split_mem_content(content_msg.content)[0])
+            if self.registry.is_tracked(hash, fs.MemoryAddress.from_message(content_msg)):
+                if self.registry.decref(hash) > 0:
+                    continue
+
+            if content_msg.id in removed:
+                continue
+
+            removed.add(content_msg.id)
             await self.deallocate_message(content_msg)
 
+        self.registry.save()
+
+    async def rebuild_registry(self, struct: fs.FS_Dir) -> None:
+        """ Count references of all indexed files' chunks and recreate chunks registry. """
+        refs = Counter()
+        hashes = {}
+
+        for file in struct.walk(file_only=True):
+            if file.layout != fs.Layout.INDEX:
+                continue
+
+            trace = await self.get_file_trace(file)
+            if isinstance(trace, errors.T_Error):
+                Log.warn(f"Broken memory trace while rebuilding chunks registry: {file.path_to()}")
+                continue
+
+            for msg in trace:
+                key = (msg.channel.id, msg.id)
+                refs[key] += 1
+                hashes[key] = dedup.chunk_hash(_split_mem_content(msg.content)[0])
+
+        self.registry.rebuild(refs, hashes)
+        Log.info(f"Rebuilt chunks registry for guild {self.guild.name} ({len(self.registry.entries)} entries)")
+
+    async def collect_garbage(self, struct: fs.FS_Dir, is_busy: Callable[[], bool]) -> dict | None:
+        """
+        Mark every memory message reachable from the struct and delete unreachable bot messages
+        from data channels (eg. left by a crash during write). Messages younger than GC_GRACE_PERIOD are kept.
+        Sweep is abandoned when `is_busy` (files are being written). Returns report or None if abandoned.
+        """
+        cutoff = discord.utils.time_snowflake(discord.utils.utcnow() - datetime.timedelta(seconds=limits.GC_GRACE_PERIOD))
+        marked = set(self._reservations) | self.pool.message_ids()
+        extents_starts: dict[int, dict[int, int]] = {}  # channel_id: {first message id: count}
+
+        for file in struct.walk(file_only=True):
+            if file.layout == fs.Layout.CHAIN:
+                trace = await self.get_content_trace(file.mem_addr)
+                if isinstance(trace, errors.T_Error):
+                    Log.warn(f"Garbage collection abandoned at guild {self.guild.name}: broken memory trace of {file.path_to()}")
+                    return None
+
+                marked.update(msg.id for msg in trace)
+                continue
+
+            index = await self.get_index_trace(file.mem_addr)
+            if isinstance(index, errors.T_Error):
+                Log.warn(f"Garbage collection abandoned at guild {self.guild.name}: broken index trace of {file.path_to()}")
+                return None
+
+            index_messages, extents = index
+            marked.update(msg.id for msg in index_messages)
+            for extent in extents:
+                starts = extents_starts.setdefault(extent.channel_id, {})
+                starts[extent.message_id] = max(starts.get(extent.message_id, 0), extent.count)
+
+        # Write started after marking could reference registered chunk, so registry changes are detected.
+        registry_snapshot = {hash: list(entry) for hash, entry in self.registry.entries.items()}
+        report = {"scanned_messages": 0, "deleted_messages": 0, "reclaimed_bytes": 0}
+
+        await self.load_buckets()
+        for bucket in list(self.buckets.values()):
+            for channel in list(bucket.data_channels.values()):
+                orphans = await self._sweep_channel(channel, marked, extents_starts.get(channel.id, {}), cutoff, report)
+                if orphans and not await self._delete_orphans(channel, orphans, registry_snapshot, is_busy, report):
+                    Log.warn(f"Garbage collection abandoned at guild {self.guild.name}: files are being written")
+                    return None
+
+        if report["deleted_messages"]:
+            self.registry.save()
+
+        self.gc_stats["runs"] += 1
+        self.gc_stats["last_run"] = get_time()
+        self.gc_stats["last_reclaimed_bytes"] = report["reclaimed_bytes"]
+        self.gc_stats["reclaimed_bytes"] += report["reclaimed_bytes"]
+        self.gc_stats["deleted_messages"] += report["deleted_messages"]
+        Log.info(f"Garbage collection at guild {self.guild.name}: deleted {report['deleted_messages']} messages ({report['reclaimed_bytes']}b)")
+        return report
+
+    async def _sweep_channel(self,
+                             channel: discord.TextChannel,
+                             marked: set[int],
+                             extents_starts: dict[int, int],
+                             cutoff: int,
+                             report: dict
+                             ) -> list[discord.Message]:
+        """ Find unreachable bot messages older than cutoff in channel's history. """
+        orphans = []
+        extent_left = 0
+        last_id = None
+
+        while True:
+            after = discord.Object(id=last_id) if last_id else None
+
+            async def read_page() -> list[discord.Message]:
+                return [msg async for msg in channel.history(limit=limits.HISTORY_BATCH_SIZE, before=discord.Object(id=cutoff), after=after, oldest_first=True)]
+
+            page = await self.scheduler.request(scheduler.HOUSEKEEPING, f"history:{channel.id}", read_page)
+            for msg in page:
+                report["scanned_messages"] += 1
+
+                # Extent covers `count` messages following it's first message.
+                extent_left = max(extent_left, extents_starts.get(msg.id, 0))
+                if extent_left:
+                    extent_left -= 1
+                    continue
+
+                if msg.author.id != client.user.id or msg.id in marked or msg.id in self._removed_messages:
+                    continue
+
+                orphans.append(msg)
+
+            if len(page) < limits.HISTORY_BATCH_SIZE:
+                return orphans
+
+            last_id = page[-1].id
+            await asyncio.sleep(limits.GC_THROTTLE_DELAY)
+
+    async def _delete_orphans(self,
+                              channel: discord.TextChannel,
+                              orphans: list[discord.Message],
+                              registry_snapshot: dict[str, list[int]],
+                              is_busy: Callable[[], bool],
+                              report: dict
+                              ) -> bool:
+        """ Delete unreachable messages (in bulk if possible) at low priority. Returns False if abandoned. """
+        bulk_after = discord.utils.utcnow() - datetime.timedelta(seconds=limits.BULK_DELETE_MAX_AGE)
+        batches = [[msg] for msg in orphans if msg.created_at <= bulk_after]
+        recent = [msg for msg in orphans if msg.created_at > bulk_after]
+        batches += [recent[i:i + limits.HISTORY_BATCH_SIZE] for i in range(0, len(recent), limits.HISTORY_BATCH_SIZE)]
+
+        for batch in batches:
+            if is_busy():
+                return False
+
+            deleted = []
+            for msg in batch:
+                hash = dedup.chunk_hash(_split_mem_content(msg.content)[0])
+                entry = self.registry.entries.get(hash)
+                if entry is not None and entry[:2] == [channel.id, msg.id]:
+                    if registry_snapshot.get(hash) != entry:
+                        continue  # Referenced by write made after marking.
+                    self.registry.forget(hash)
+
+                deleted.append(msg)
+
+            if not deleted:
+                continue
+
+            # Registered before deleting, so their delete events never look like external removal.
+            self._removed_messages.extend(msg.id for msg in deleted)
+            try:
+                if len(deleted) == 1:
+                    await self.scheduler.request(scheduler.HOUSEKEEPING, f"delete:{channel.id}", deleted[0].delete)
+                else:
+                    await self.scheduler.request(scheduler.HOUSEKEEPING, f"delete:{channel.id}", lambda: channel.delete_messages(deleted))
+            except discord.HTTPException as error:
+                Log.error(f"Failed to delete {len(deleted)} orphaned messages at channel {channel.name} at {self.guild.name}: {error}")
+                continue
+
+            for msg in deleted:
+                size = _memory_size(msg)
+                self.chunks_cache.invalidate(channel.id, msg.id)
+                await self.update_cache_size(msg, -size)
+                report["reclaimed_bytes"] += size
+
+            report["deleted_messages"] += len(deleted)
+
+        return True
+
     async def wipe_dir(self, dir: fs.FS_Dir) -> None:
         """ Remove dir and deallocate all files and subdirs. """
         if dir.name == "~":
@@ -441,6 +1698,15 @@ class DriveGuild:
         DriveGuild._register[guild.id] = instance
         return instance
 
+    @staticmethod
+    async def flush_all() -> None:
+        """ Send pending logs, save unsaved buckets caches and remove unused placeholders of all initialized guilds (eg. at shutdown). """
+        for instance in list(DriveGuild._register.values()):
+            if isinstance(instance, DriveGuild):
+                await asyncio.gather(*instance._log_tasks)
+                await instance.memory_manager.flush_caches()
+                await instance.memory_manager.drain_pool()
+
     @staticmethod
     async def init(guild: discord.Guild) -> "DriveGuild":
         try:
@@ -477,8 +1743,18 @@ class DriveGuild:
 
         data_manager = await MemoryManager.init(guild)
 
-        instance = DriveGuild(guild, logs_channel, struct_channel, console_channel, read_role, write_role, data_manager)
+        # Journal channel is created for guilds set up before it was introduced.
+        journal_channel = discord.utils.get(guild.text_channels, name="_journal", category_id=struct_channel.category_id)
+        if journal_channel is None:
+            journal_channel = await data_manager.scheduler.request(
+                scheduler.WRITE, "channels",
+                lambda: guild.create_text_channel("_journal", category=struct_channel.category)
+            )
+            Log.info(f"Created structure journal channel for guild {guild.name}")
+
+        instance = DriveGuild(guild, logs_channel, struct_channel, console_channel, read_role, write_role, data_manager, journal_channel)
         DriveGuild._register[guild.id] = instance
+        instance._maintenance_task = asyncio.create_task(instance._maintenance_loop())
         return instance
 
     def __init__(self,
@@ -488,54 +1764,460 @@ class DriveGuild:
                  console_ch: discord.TextChannel,
                  read_role: discord.Role,
                  write_role: discord.Role,
-                 data_manager: MemoryManager
+                 data_manager: MemoryManager,
+                 journal_ch: discord.TextChannel
                  ) -> None:
 
         self.guild = guild
         self.logs_channel = logs_ch
         self.struct_channel = struct_ch
+        self.journal_channel = journal_ch
         self.console_channel = console_ch
         self.read_role = read_role
         self.write_role = write_role
         self.memory_manager = data_manager
         self.locked_files = set()
         self._cwd_cache = {}
+        self._struct_lock = asyncio.Lock()  # Held while structure is read, modified and saved.
+        self._struct_write_lock = asyncio.Lock()  # Held while structure's pages are sent or swept.
+        self._struct_msg_id: int | None = None
+        self._struct_cache: tuple[str, str] | None = None  # (header, export) of the last read or saved structure.
+        self._struct_pages_ids: set[int] = set()
+        self._struct_sweep_task: asyncio.Task | None = None
+        self._struct_export: str | None = None  # Current structure (last checkpoint with journal entries applied).
+        self._checkpoint_seq = 0
+        self._journal_seq = 0
+        self._journal_messages: list[discord.Message] = []  # Entries not removed by compaction yet.
+        self._compaction_task: asyncio.Task | None = None
+        self._maintenance_task: asyncio.Task | None = None
+        self._defrag_task: asyncio.Task | None = None
+        self._log_tasks: set[asyncio.Task] = set()  # Log messages being sent.
+        self._content_versions = Counter()  # path: amount of content commits (detects writes during relocation).
+        self.read_counts = Counter()  # path: amount of reads since startup.
+        self.defrag_progress = {"running": False, "started": None, "files": 0, "done": 0, "relocated": 0, "skipped": 0, "requests_saved": 0, "current": None}
 
         Log.info(f"DriveGuild instance initialized for: {guild.name}")
 
     async def __find_struct_msg(self) -> discord.Message | None:
-        message = [message async for message in self.struct_channel.history(limit=1)]
+        """ Structure's header is the oldest message on struct channel (pages are sent after it). """
+        requests = self.memory_manager.scheduler
+        if self._struct_msg_id is not None:
+            header = self.struct_channel.get_partial_message(self._struct_msg_id)
+            try:
+                return await requests.request(scheduler.READ, f"fetch:{self.struct_channel.id}", header.fetch)
+            except discord.NotFound:
+                self._struct_msg_id = None
+
+        async def oldest_messages() -> list[discord.Message]:
+            return [message async for message in self.struct_channel.history(limit=1, oldest_first=True)]
+
+        message = await requests.request(scheduler.READ, f"history:{self.struct_channel.id}", oldest_messages)
         message = message[0] if message else None
 
         if message is None:
             return None
 
-        message = await message.fetch()
-
         if message.author.id != client.user.id:
-            Log.warn(f"Latest message on struct channel does not belong to bot at: {self.guild.name}")
-            await message.delete()
+            Log.warn(f"Oldest message on struct channel does not belong to bot at: {self.guild.name}")
+            await requests.request(scheduler.HOUSEKEEPING, f"delete:{self.struct_channel.id}", message.delete)
             return await self.__find_struct_msg()
 
+        self._struct_msg_id = message.id
         return message
 
-    async def _read_file(self, file: fs.FS_File) -> bytes | errors.T_Error:
+    async def _fetch_struct_pages(self, extent: fs.MemoryExtent) -> list[discord.Message]:
+        """ Read pages of an extent. Messages sent in between by others are skipped. """
+        pages = []
+        after = extent.message_id - 1
+
+        while len(pages) < extent.count:
+            async def read_history() -> list[discord.Message]:
+                return [msg async for msg in self.struct_channel.history(limit=extent.count - len(pages), after=discord.Object(id=after), oldest_first=True)]
+
+            messages = await self.memory_manager.scheduler.request(scheduler.READ, f"history:{self.struct_channel.id}", read_history)
+            if not messages:
+                break
+
+            pages.extend(msg for msg in messages if msg.author.id == client.user.id)
+            after = messages[-1].id
+
+        return pages
+
+    async def _read_struct_export(self, header: str) -> str | None:
+        """ Returns structure's export saved under given header (all pages are fetched concurrently). """
+        if self._struct_cache is not None and self._struct_cache[0] == header:
+            return self._struct_cache[1]
+
+        fields = _struct_header_fields(header)
+        if fields is None:
+            # Legacy structure: base64 encoded export in a single message.
+            export = base64.b64decode(header).decode()
+            self._struct_cache = (header, export)
+            self._struct_pages_ids = set()
+            return export
+
+        codec, encoding_name, length, _, _, payload = fields
+        pages = []
+        extents = _struct_pages_extents(header)
+        if extents:
+            runs = await asyncio.gather(*(self._fetch_struct_pages(extent) for extent in extents))
+            pages = [msg for run in runs for msg in run]
+            payload = "".join(msg.content for msg in pages)
+
+        if len(payload) != int(length):
+            Log.error(f"Structure pages are incomplete at: {self.guild.name} ({len(payload)}/{length} characters)")
+            return None
+
+        try:
+            export = compression.decompress(codec, encoding.decode(encoding_name, payload)).decode()
+        except (ValueError, KeyError, zlib.error):
+            Log.error(f"Failed to decode structure at: {self.guild.name}")
+            return None
+
+        self._struct_cache = (header, export)
+        self._struct_pages_ids = {msg.id for msg in pages}
+        return export
+
+    async def _send_struct_pages(self, pages: list[str]) -> tuple[list[fs.MemoryExtent], set[int]]:
+        """ Send pages one after another, so they are read with a single history request per 100 pages. Returns (extents, ids). """
+        extents = []
+        ids = set()
+
+        for page in pages:
+            msg = await self.memory_manager.scheduler.request(scheduler.WRITE, f"send:{self.struct_channel.id}", lambda: self.struct_channel.send(page))
+            ids.add(msg.id)
+
+            if extents and extents[-1].count < limits.HISTORY_BATCH_SIZE:
+                extents[-1].count += 1
+            else:
+                extents.append(fs.MemoryExtent(self.struct_channel.id, msg.id))
+
+        return extents, ids
+
+    async def _sweep_struct_pages(self) -> None:
+        """ Delete messages sent after structure's header which are not it's current pages (old pages, leftovers of interrupted saves). """
+        async with self._struct_write_lock:
+            header = await self.__find_struct_msg()
+            if header is None or await self._read_struct_export(header.content) is None:
+                return
+
+            async def read_history() -> list[discord.Message]:
+                return [msg async for msg in self.struct_channel.history(limit=None, after=discord.Object(id=header.id), oldest_first=True)]
+
+            requests = self.memory_manager.scheduler
+            messages = await requests.request(scheduler.HOUSEKEEPING, f"history:{self.struct_channel.id}", read_history)
+            stale = [msg for msg in messages if msg.id not in self._struct_pages_ids]
+
+        await self._delete_meta_messages(self.struct_channel, stale)
+
+    async def _delete_meta_messages(self, channel: discord.TextChannel, messages: list[discord.Message]) -> None:
+        """ Delete messages (in bulk if possible) at low priority. """
+        # Registered before deleting, so their delete events never look like external removal.
+        self.memory_manager._removed_messages.extend(msg.id for msg in messages)
+
+        bulk_after = discord.utils.utcnow() - datetime.timedelta(seconds=limits.BULK_DELETE_MAX_AGE)
+        recent = [msg for msg in messages if msg.created_at > bulk_after]
+        batches = [[msg] for msg in messages if msg.created_at <= bulk_after]
+        batches += [recent[i:i + limits.HISTORY_BATCH_SIZE] for i in range(0, len(recent), limits.HISTORY_BATCH_SIZE)]
+
+        requests = self.memory_manager.scheduler
+        for batch in batches:
+            try:
+                if len(batch) == 1:
+                    await requests.request(scheduler.HOUSEKEEPING, f"delete:{channel.id}", batch[0].delete)
+                else:
+                    await requests.request(scheduler.HOUSEKEEPING, f"delete:{channel.id}", lambda: channel.delete_messages(batch))
+            except discord.HTTPException as error:
+                Log.error(f"Failed to delete {len(batch)} messages on {channel.name} at {self.guild.name}: {error}")
+
+    async def _read_file(self, file: fs.FS_File, offset: int = 0, length: int | None = None, locked: bool = False) -> bytes | errors.T_Error:
+        """ Read file's content. `locked` - file is locked by the caller's own write. """
+        stream = await (self._open_stream(file, offset, length) if locked else self.stream_file(file, offset, length))
+        if isinstance(stream, errors.T_Error):
+            return stream
+
+        try:
+            return b"".join([part async for part in stream])
+        except MemoryStreamError as error:
+            return error.args[0]
+
+    async def stream_file(self, file: fs.FS_File, offset: int = 0, length: int | None = None) -> AsyncIterator[bytes] | errors.T_Error:
+        """
+        Open stream of file's content (or of `length` bytes starting at `offset`). Content is decoded and
+        decompressed per fetched extent (or attachment), so memory usage does not depend on file's size.
+        Not compressed content of index based layouts is seekable: only chunks covering the range are fetched.
+        Other content is read from the beginning and the stream ends as soon as the range is read.
+        Stream raises MemoryStreamError if memory turns out to be broken while streaming.
+        """
         if file.path_to() in self.locked_files:
             await self.log(f"failed to read file {file.name} (file is locked due to ongoing operation)")
             return errors.FILE_LOCKED
 
-        content = ""
-        content_messages = await self.memory_manager.get_content_trace(file.mem_addr)
-        if isinstance(content_messages, errors.T_Error):
-            return content_messages
+        self.read_counts[file.path_to()] += 1
+        return await self._open_stream(file, offset, length)
+
+    async def _open_stream(self, file: fs.FS_File, offset: int = 0, length: int | None = None) -> AsyncIterator[bytes] | errors.T_Error:
+        if file.layout == fs.Layout.CHAIN:
+            stream = self._decode_stream(file, self.memory_manager.iter_content_trace(file.mem_addr))
+            return _slice_stream(stream, offset, length)
+
+        index = await self.memory_manager.get_index_trace(file.mem_addr)
+        if isinstance(index, errors.T_Error):
+            return index
+
+        _, extents = index
+        if file.codec != compression.RAW or (offset == 0 and length is None):
+            stream = self._decode_stream(file, self.memory_manager.iter_extents(extents))
+            return _slice_stream(stream, offset, length)
+
+        unit_size, units_per_msg = _content_units(file)
+        first_unit = offset // unit_size
+        stop_unit = None if length is None else -(-(offset + length) // unit_size)
+        stop_msg = None if stop_unit is None else -(-stop_unit // units_per_msg)
+
+        extents, skip = _extents_range(extents, first_unit // units_per_msg, stop_msg)
+        runs = _skip_messages(self.memory_manager.iter_extents(extents), skip)
+
+        parts_count = None if stop_unit is None else stop_unit - first_unit
+        stream = self._decode_stream(file, runs, first_unit % units_per_msg, parts_count)
+        return _slice_stream(stream, offset - first_unit * unit_size, length)
+
+    async def _decode_stream(self,
+                             file: fs.FS_File,
+                             runs: AsyncIterator[list[discord.Message]],
+                             first_part: int = 0,
+                             parts_count: int | None = None
+                             ) -> AsyncIterator[bytes]:
+        """ Decode messages content. For attachments, `parts_count` parts starting at `first_part` of the first message are read. """
+        decompress = compression.decompressor(file.codec) if file.codec != compression.BLOCKS else None
+        group_chars = encoding.get(file.encoding).group_chars
+        pending = ""
+
+        try:
+            async for messages in runs:
+                if file.layout == fs.Layout.ATTACHMENTS:
+                    for message in messages:
+                        count = None
+                        if parts_count is not None:
+                            count = min(parts_count, len(message.attachments) - first_part)
+                            parts_count -= count
+
+                        async for stored_content in self.memory_manager.iter_attachments(message, first_part, count):
+                            if stored_content and (content := await asyncio.to_thread(decompress, stored_content)):
+                                yield content
+
+                        first_part = 0
+                        if parts_count == 0:
+                            return
+                    continue
+
+                chunks = [_split_mem_content(message.content)[0] for message in messages]
+                if file.codec == compression.BLOCKS:
+                    blocks = [chunk for chunk in chunks if chunk != fs.BLANK_FILE_CONTENT]
+                    if blocks and (content := await asyncio.to_thread(_decode_blocks, file.encoding, blocks)):
+                        yield content
+                    continue
+
+                # Legacy chains' chunks are not aligned to encoding groups, rest is decoded with next chunks.
+                pending += "".join(chunk for chunk in chunks if chunk != fs.BLANK_FILE_CONTENT)
+                decodable = len(pending) - len(pending) % group_chars
+                text, pending = pending[:decodable], pending[decodable:]
+
+                if text and (content := await asyncio.to_thread(lambda: decompress(encoding.decode(file.encoding, text)))):
+                    yield content
+
+            if pending and (content := await asyncio.to_thread(lambda: decompress(encoding.decode(file.encoding, pending)))):
+                yield content
+
+        finally:
+            await runs.aclose()
+
+    async def _ensure_chunks_registry(self) -> None:
+        """ Rebuild chunks registry from the structure if it's file is missing. """
+        if not self.memory_manager.registry.loaded:
+            await self.memory_manager.rebuild_registry(await self.get_struct())
+
+    async def collect_garbage(self) -> dict | None:
+        """ Delete memory messages not reachable from the structure. Returns report or None if abandoned. """
+        struct = await self.get_struct()
+        if struct is None:
+            return None
+
+        report = await self.memory_manager.collect_garbage(struct, lambda: bool(self.locked_files) or self.defrag_progress["running"])
+        if report is not None and report["deleted_messages"]:
+            await self.log(f"garbage collector deleted {report['deleted_messages']} orphaned messages ({report['reclaimed_bytes']}b)")
+        return report
+
+    async def _maintenance_loop(self) -> None:
+        while True:
+            await asyncio.sleep(limits.GC_INTERVAL)
+            try:
+                await self.collect_garbage()
+                await self.start_defrag()
+            except discord.HTTPException as error:
+                Log.error(f"Memory maintenance failed at guild {self.guild.name}: {error}")
+
+    async def _fragmented_files(self) -> list[fs.FS_File]:
+        """
+        Text layout files which can be read with less history requests, ranked by fragmentation (amount of
+        requests above the minimum) times reads count. Attachments are downloaded per message anyway, so they are skipped.
+        """
+        ranked = []
+        for file in (await self.get_struct()).walk(file_only=True):
+            if file.layout == fs.Layout.ATTACHMENTS or file.path_to() in self.locked_files:
+                continue
+
+            if file.layout == fs.Layout.CHAIN:
+                # Every chunk of legacy chain is fetched on it's own (size estimated for base64 chunks).
+                chunks = -(-(-(-file.size // 3) * 4) // limits.MSG_SIZE)
+                requests = chunks
+            else:
+                index = await self.memory_manager.get_index_trace(file.mem_addr)
+                if isinstance(index, errors.T_Error):
+                    continue
+
+                _, extents = index
+                chunks = sum(extent.count for extent in extents)
+                requests = len(extents)
+
+            fragmentation = requests - max(1, -(-chunks // limits.HISTORY_BATCH_SIZE))
+            if fragmentation > 0:
+                ranked.append((fragmentation * (1 + self.read_counts[file.path_to()]), file))
+
+        ranked.sort(key=lambda item: item[0], reverse=True)
+        return [file for _, file in ranked]
+
+    async def start_defrag(self, max_files: int = limits.DEFRAG_MAX_FILES) -> dict:
+        """ Start defragmentation job in the background (unless it's running). Returns it's progress. """
+        if not self.defrag_progress["running"]:
+            self.defrag_progress = {
+                "running": True, "started": get_time(), "files": 0, "done": 0,
+                "relocated": 0, "skipped": 0, "requests_saved": 0, "current": None
+            }
+            self._defrag_task = asyncio.create_task(self._defragment(max_files))
+
+        return self.defrag_progress
+
+    async def _defragment(self, max_files: int) -> None:
+        """ Relocate the most fragmented files into contiguous runs. """
+        progress = self.defrag_progress
+        try:
+            files = (await self._fragmented_files())[:max_files]
+            progress["files"] = len(files)
+
+            for file in files:
+                progress["current"] = file.path_to()
+                saved = await self._relocate_file(file)
+                if isinstance(saved, errors.T_Error):
+                    Log.warn(f"Defragmentation of {file.path_to()} at guild {self.guild.name} skipped: {saved}")
+                    progress["skipped"] += 1
+                else:
+                    progress["relocated"] += 1
+                    progress["requests_saved"] += saved
+                progress["done"] += 1
+
+        finally:
+            progress["running"] = False
+            progress["current"] = None
+
+        if progress["relocated"]:
+            await self.log(f"defragmenter relocated {progress['relocated']} files ({progress['requests_saved']} less history requests per read)")
+
+    async def _relocate_file(self, file: fs.FS_File) -> int | errors.T_Error:
+        """
+        Copy file's chunks into a contiguous run and swap file's index in the structure.
+        Relocation is abandoned if the file is written meanwhile. File is not locked, so old chunks are freed
+        after DEFRAG_FREE_DELAY (reads in progress can still finish). Returns amount of saved history requests.
+        """
+        memory = self.memory_manager
+        path = file.path_to()
+        version = self._content_versions[path]
+        if path in self.locked_files:
+            return errors.FILE_LOCKED
+
+        index_messages, extents = [], None
+        if file.layout == fs.Layout.CHAIN:
+            trace = await memory.get_content_trace(file.mem_addr)
+        else:
+            index = await memory.get_index_trace(file.mem_addr)
+            if isinstance(index, errors.T_Error):
+                return errors.BROKEN_MEMORY
+
+            index_messages, extents = index
+            trace = await memory.fetch_extents(extents)
 
-        for message in content_messages:
-            chunk = message.content.split("@")[0]
-            if chunk == fs.BLANK_FILE_CONTENT:
-                chunk = ""
-            content += chunk
+        if isinstance(trace, errors.T_Error):
+            return errors.BROKEN_MEMORY
 
-        return base64.b64decode(content)
+        old_requests = len(trace) if extents is None else len(extents)
+        payloads = [_split_mem_content(msg.content)[0] for msg in trace]
+
+        # Moving chunks shared with other files would store them twice.
+        hashes = Counter(dedup.chunk_hash(payload) for payload in payloads)
+        for msg, payload in zip(trace, payloads):
+            hash = dedup.chunk_hash(payload)
+            if memory.registry.is_tracked(hash, fs.MemoryAddress.from_message(msg)) and memory.registry.refs(hash) > hashes[hash]:
+                return errors.CHUNKS_SHARED
+
+        payloads = [payload for payload in payloads if payload != fs.BLANK_FILE_CONTENT]
+
+        # Legacy chunks are re-encoded, so they are aligned to encoding groups (and seekable).
+        if file.layout != fs.Layout.INDEX or file.encoding != encoding.DEFAULT:
+            stored_content = await asyncio.to_thread(encoding.decode, file.encoding, "".join(payloads))
+            text_encoding = encoding.get(encoding.DEFAULT)
+            encoded_content = await asyncio.to_thread(text_encoding.encode, stored_content)
+            payloads = memory.split_content(encoded_content, text_encoding.chunk_chars(limits.MSG_SIZE))
+
+        stored = await memory.relocate_chunks(payloads)
+        if isinstance(stored, errors.T_Error):
+            return stored
+
+        new_trace, new_runs = stored
+        new_extents = memory.build_extents(new_trace, new_runs)
+        if len(new_extents) >= old_requests:
+            await memory.release_messages(new_trace)
+            return errors.NO_CONTIGUOUS_MEMORY
+
+        index_head = await memory.write_index(new_extents, [])
+        if isinstance(index_head, errors.T_Error):
+            await memory.release_messages(new_trace)
+            return index_head
+
+        async with self._struct_lock:
+            struct = await self.get_struct()
+            target = struct.move_to(path)
+            swapped = isinstance(target, fs.FS_File) and path not in self.locked_files and self._content_versions[path] == version
+            if swapped:
+                target.mem_addr = index_head
+                target.layout = fs.Layout.INDEX
+                target.encoding = encoding.DEFAULT
+                swapped = await self.journal_struct(journal.put_file(target))
+            if swapped:
+                self._content_versions[path] += 1
+                version = self._content_versions[path]
+
+        if not swapped:
+            new_index = await memory.get_index_trace(index_head)
+            await memory.release_messages(new_trace + (new_index[0] if not isinstance(new_index, errors.T_Error) else []))
+            return errors.FILE_CHANGED
+
+        await asyncio.sleep(limits.DEFRAG_FREE_DELAY)
+
+        # Write started before the swap could reuse old chunks, those are left for the garbage collector.
+        if self._content_versions[path] != version or path in self.locked_files:
+            return old_requests - len(new_extents)
+
+        await memory.release_trace(index_messages, trace)
+
+        target = (await self.get_struct()).move_to(path)
+        if isinstance(target, fs.FS_File) and target.mem_addr == index_head:
+            for msg, payload in zip(new_trace, payloads):
+                hash = dedup.chunk_hash(payload)
+                if memory.registry.get(hash) is None:
+                    memory.registry.register(hash, fs.MemoryAddress.from_message(msg))
+            memory.registry.save()
+
+        return old_requests - len(new_extents)
 
     def get_permissions(self, user_or_id: int | discord.Member) -> DrivePermissions:
         """ Return user's permissions based on it's roles. If user was not found, lowest permissions are returned. """ 
@@ -573,47 +2255,194 @@ class DriveGuild:
         true_roles.append(write_role) if new_perms.write else false_roles.append(write_role)
         true_roles.append(admin_role) if new_perms.admin else false_roles.append(admin_role)
             
-        await member.remove_roles(*false_roles)
-        await member.add_roles(*true_roles)
+        requests = self.memory_manager.scheduler
+        await requests.request(scheduler.WRITE, f"roles:{member.id}", lambda: member.remove_roles(*false_roles))
+        await requests.request(scheduler.WRITE, f"roles:{member.id}", lambda: member.add_roles(*true_roles))
         
         await self.log(f"Updated {member.name}'s permissions to: {str(new_perms)}")
 
     async def log(self, message: str) -> None:
+        """ Log message and send it to logs channel in background (operations never wait for housekeeping lane). """
         Log.info(f"(drive@{self.guild.name}) {message}")
-        content = f"{get_time()} | `{message}`"
-        await self.logs_channel.send(content)
+        task = asyncio.create_task(self._send_log(f"{get_time()} | `{message}`"))
+        self._log_tasks.add(task)
+        task.add_done_callback(self._log_tasks.discard)
+
+    async def _send_log(self, content: str) -> None:
+        try:
+            await self.memory_manager.scheduler.request(scheduler.HOUSEKEEPING, f"send:{self.logs_channel.id}", lambda: self.logs_channel.send(content))
+        except discord.HTTPException as error:
+            Log.error(f"Failed to send log message at {self.guild.name}: {error}")
+
+    async def _load_struct(self) -> bool:
+        """ Restore structure from the last checkpoint and journal entries recorded after it. """
+        if self._struct_export is not None:
+            return True
+
+        async with self._struct_write_lock:
+            if self._struct_export is not None:
+                return True
+
+            message = await self.__find_struct_msg()
+            if message is None:
+                await panic_guild_error(self.guild, "Missing files structure message.")
+                return False
+
+            export = await self._read_struct_export(message.content)
+            if export is None:
+                await panic_guild_error(self.guild, "Failed to read structure.")
+                return False
+
+            try:
+                struct = parser.Parser(export).parse()
+            except ValueError:
+                await panic_guild_error(self.guild, "Failed to parse structure.")
+                return False
+
+            async def read_journal() -> list[discord.Message]:
+                return [msg async for msg in self.journal_channel.history(limit=None, oldest_first=True)]
+
+            messages = await self.memory_manager.scheduler.request(scheduler.READ, f"history:{self.journal_channel.id}", read_journal)
+            fields = _struct_header_fields(message.content)
+            self._checkpoint_seq = self._journal_seq = int(fields[3]) if fields is not None else 0
+
+            # Entries included in the checkpoint (left by interrupted compaction) are only deleted with the next one.
+            entries = []
+            for msg in messages:
+                entry = journal.JournalEntry.from_str(msg.content) if msg.author.id == client.user.id else None
+                if entry is None:
+                    Log.warn(f"Invalid journal entry at {self.guild.name}: {msg.content[:100]}")
+                elif entry.seq > self._checkpoint_seq:
+                    entries.append(entry)
+
+            for entry in sorted(entries, key=lambda entry: entry.seq):
+                if not journal.apply(struct, entry):
+                    Log.warn(f"Skipped journal entry not matching the structure at {self.guild.name}: {entry.export()}")
+                self._journal_seq = max(self._journal_seq, entry.seq)
+
+            self._journal_messages = messages
+            self._struct_export = struct.export()
+            Log.info(f"Loaded structure of {self.guild.name} ({len(entries)} journal entries replayed)")
+
+        if self._journal_seq - self._checkpoint_seq >= limits.STRUCT_JOURNAL_CHECKPOINT_ENTRIES:
+            self._schedule_struct_compaction()
+        return True
 
     async def get_struct(self) -> fs.FS_Dir:
-        message = await self.__find_struct_msg()
-        if message is None:
-            await panic_guild_error(self.guild, "Missing files structure message.")
+        """ Returns a copy of the current structure. Changes are saved with `journal_struct`. """
+        if not await self._load_struct():
             return None
 
-        content_enc = message.content
-        content_raw = base64.b64decode(content_enc).decode()
-
         try:
-            struct = parser.Parser(content_raw).parse()
+            struct = parser.Parser(self._struct_export).parse()
         except ValueError:
             await panic_guild_error(self.guild, "Failed to parse structure.")
             return None
 
         return struct
 
-    async def set_struct(self, struct: fs.FS_Dir) -> None:
-        struct_export = struct.export()
-        content = base64.b64encode(struct_export.encode()).decode()
+    async def journal_struct(self, entry: journal.JournalEntry) -> bool:
+        """
+        Apply mutation to the current structure and record it as a journal entry (single message, whatever the structure's size is).
+        Returns False if the mutation doesn't match the structure (eg. name is already in use).
+        """
+        if not await self._load_struct():
+            return False
+
+        stale = []
+        async with self._struct_write_lock:
+            struct = parser.Parser(self._struct_export).parse()
+            if not journal.apply(struct, entry):
+                return False
+
+            entry.seq = self._journal_seq + 1
+            content = entry.export()
+            struct_export = struct.export()
+
+            if len(content) > limits.MSG_SIZE:
+                # Entry of a very deep path doesn't fit in a message, whole structure is saved instead.
+                self._journal_seq = entry.seq
+                if not await self._save_checkpoint(struct_export):
+                    return False
+                stale, self._journal_messages = self._journal_messages, []
+            else:
+                message = await self.memory_manager.scheduler.request(scheduler.WRITE, f"send:{self.journal_channel.id}", lambda: self.journal_channel.send(content))
+                self._journal_messages.append(message)
+                self._journal_seq = entry.seq
 
-        if len(content) > limits.MSG_SIZE:
-            await self.log("Couldn't save new structure: message too long!")
-            return
+            self._struct_export = struct_export
+
+        await self._delete_meta_messages(self.journal_channel, stale)
+        if self._journal_seq - self._checkpoint_seq >= limits.STRUCT_JOURNAL_CHECKPOINT_ENTRIES:
+            self._schedule_struct_compaction()
+        return True
+
+    async def _save_checkpoint(self, struct_export: str) -> bool:
+        """
+        Save structure as a checkpoint including all journal entries recorded so far (structure's write lock must be held).
+        Compressed export is kept in the header message if it fits, otherwise it's split into pages
+        sent on struct channel. Header is edited last, so readers never see partially saved structure.
+        """
+        codec, data = compression.compress(struct_export.encode(), STRUCT_CODEC)
+        payload = encoding.encode(encoding.DEFAULT, data)
+        fields = [f"v{STRUCT_VERSION}", codec, encoding.DEFAULT, str(len(payload)), str(self._journal_seq)]
 
         message = await self.__find_struct_msg()
         if message is None:
-            panic_guild_error(self.guild, "Missing structure message.")
-            return None
+            await panic_guild_error(self.guild, "Missing structure message.")
+            return False
+
+        had_pages = bool(_struct_pages_extents(message.content))
+        pages_ids = set()
+        content = STRUCT_HEADER_SEP.join(fields + ["", payload])
+        if len(content) > limits.MSG_SIZE:
+            extents, pages_ids = await self._send_struct_pages(self.memory_manager.split_content(payload))
+            content = STRUCT_HEADER_SEP.join(fields + [INDEX_SEP.join(extent.prepare_mem_addr() for extent in extents), ""])
+
+            if len(content) > limits.MSG_SIZE:
+                await self.log("Couldn't save new structure: too many pages!")
+                self._schedule_struct_sweep()
+                return False
+
+        await self.memory_manager.scheduler.request(scheduler.WRITE, f"edit:{self.struct_channel.id}", lambda: message.edit(content=content))
+        self._struct_cache = (content, struct_export)
+        self._struct_pages_ids = pages_ids
+        self._checkpoint_seq = self._journal_seq
+
+        if had_pages or pages_ids:
+            self._schedule_struct_sweep()
+        return True
+
+    async def _compact_struct_journal(self) -> None:
+        """ Save current structure as a checkpoint and delete journal entries included in it. """
+        async with self._struct_write_lock:
+            if self._journal_seq == self._checkpoint_seq and not self._journal_messages:
+                return
+
+            if not await self._save_checkpoint(self._struct_export):
+                return
 
-        await message.edit(content=content)
+            stale, self._journal_messages = self._journal_messages, []
+
+        await self._delete_meta_messages(self.journal_channel, stale)
+        Log.info(f"Compacted structure journal of {self.guild.name} (checkpoint at entry {self._checkpoint_seq})")
+
+    def _schedule_struct_compaction(self) -> None:
+        if self._compaction_task is None or self._compaction_task.done():
+            self._compaction_task = asyncio.create_task(self._compact_struct_journal())
+
+    def _schedule_struct_sweep(self) -> None:
+        if self._struct_sweep_task is None or self._struct_sweep_task.done():
+            self._struct_sweep_task = asyncio.create_task(self._sweep_struct_pages())
+
+    def struct_stats(self) -> dict:
+        return {
+            "loaded": self._struct_export is not None,
+            "checkpoint_seq": self._checkpoint_seq,
+            "journal_seq": self._journal_seq,
+            "journal_messages": len(self._journal_messages),
+            "pages": len(self._struct_pages_ids),
+        }
 
     async def get_cwd(self, user_id: int, _ctx: commands.Context | None = None) -> tuple[fs.FS_Dir, bool]:
         """ Return user's current working directory. Returns (FS_DIR, HAS_CHANGED)"""
@@ -669,10 +2498,9 @@ class DriveGuild:
         if target_parent.has_object(name):
             return errors.NAME_IN_USE
 
-        fs.FS_Dir(name, target_parent)
+        if not await self.journal_struct(journal.mkdir(target_parent.path_to() + name)):
+            return errors.NAME_IN_USE
 
-        base = target_parent.base_dir()
-        await self.set_struct(base)
         await self.log(f"{uid} created dir {name} at: {target_parent.path_to()}")
 
     async def create_file(self, uid: int, path: str) -> T_OpStatus:
@@ -697,18 +2525,27 @@ class DriveGuild:
         if target_parent.has_object(name):
             return errors.NAME_IN_USE
 
-        content_msg = await self.memory_manager.allocate_memory_chunk(len(fs.BLANK_FILE_CONTENT))
-        if isinstance(content_msg, errors.T_Error):
-            return content_msg
+        # Blank file is represented by a single, empty index page.
+        index_msg = await self.memory_manager.allocate_memory_chunk(len(fs.BLANK_FILE_CONTENT))
+        if isinstance(index_msg, errors.T_Error):
+            return index_msg
+
+        await self.memory_manager.edit_message(index_msg, fs.BLANK_FILE_CONTENT + "@END")
+        await self.memory_manager.update_cache_size(index_msg, len(fs.BLANK_FILE_CONTENT))
+        mem_addr = fs.MemoryAddress.from_message(index_msg)
 
-        await content_msg.edit(content=fs.BLANK_FILE_CONTENT + "@END")
-        mem_addr = fs.MemoryAddress.from_message(content_msg)
+        # Structure could be changed by other operation in the meantime.
+        async with self._struct_lock:
+            target_parent = (await self.get_struct()).move_to(target_parent.path_to())
+            if target_parent is None or target_parent.has_object(name):
+                await self.memory_manager.deallocate_message(index_msg)
+                return errors.NAME_IN_USE
 
-        new_file = fs.FS_File(name, target_parent, mem_addr, 1)
-        target_parent.insert_file(new_file)
+            new_file = fs.FS_File(name, target_parent, mem_addr, 0, fs.Layout.INDEX)
+            if not await self.journal_struct(journal.put_file(new_file)):
+                await self.memory_manager.deallocate_message(index_msg)
+                return errors.NAME_IN_USE
 
-        base = target_parent.base_dir()
-        await self.set_struct(base)
         await self.log(f"{uid} created file {name} at: {target_parent.path_to()}")
         return True
 
@@ -722,24 +2559,26 @@ class DriveGuild:
             return errors.INVALID_PATH
         target_path = target_obj.path_to()
 
+        if self._is_locked(target_obj):
+            await self.log(f"{uid} failed to remove object: {target_path} (File is locked)")
+            return errors.FILE_LOCKED
+
         if not target_obj.remove():
             await self.log(f"{uid} failed to removed object: {target_path} (Permission error)")
             return errors.PERMISSION_ERROR
 
+        await self._ensure_chunks_registry()
+
         if isinstance(target_obj, fs.FS_File):
-            if target_path in self.locked_files:
-                await self.log(f"{uid} failed to remove object: {target_path} (File is locked)")
-                return errors.FILE_LOCKED
             await self.memory_manager.wipe_file(target_obj)
 
         if isinstance(target_obj, fs.FS_Dir):
             await self.memory_manager.wipe_dir(target_obj)
 
-        base = cwd.base_dir()
-        await self.set_struct(base)
+        await self.journal_struct(journal.remove(target_path))
         await self.log(f"{uid} removed object: {target_path}")
 
-    async def get_file_content(self, uid: int, path: str) -> bytes | errors.T_Error:
+    async def get_file_content(self, uid: int, path: str, offset: int = 0, length: int | None = None) -> bytes | errors.T_Error:
         cwd, cwd_ok = await self.get_cwd(uid)
         if not cwd_ok:
             await self.log(f"{uid} failed to read file {path} (cwd error)")
@@ -752,7 +2591,7 @@ class DriveGuild:
         if isinstance(target, fs.FS_Dir):
             return errors.PATH_TO_DIR
 
-        return await self._read_file(target)
+        return await self._read_file(target, offset, length)
 
     async def pull_object(self, uid: int, path: str) -> SendableFileData | errors.T_Error:
         cwd, cwd_ok = await self.get_cwd(uid)
@@ -792,7 +2631,59 @@ class DriveGuild:
         
         return SendableFileData(zip_name, zipfile_content, True)            
 
-    async def write_file(self, uid: int, path: str, content: str, skip_encoding: bool = False, fixed_size: int = None) -> T_OpStatus:
+    async def stream_object(self, uid: int, path: str, offset: int = 0, length: int | None = None) -> StreamedObject | errors.T_Error:
+        """ Open stream of file's content (range is ignored for directories) or of directory's zip. Unlike pull_object, size is not limited. """
+        cwd, cwd_ok = await self.get_cwd(uid)
+        if not cwd_ok:
+            await self.log(f"{uid} failed to pull object {path} (cwd error)")
+            return errors.INVALID_PATH
+
+        target = cwd.move_to(path)
+        if target is None:
+            await self.log(f"{uid} failed to pull object {path} (target not found)")
+            return errors.INVALID_PATH
+
+        if isinstance(target, fs.FS_File):
+            stream = await self.stream_file(target, offset, length)
+            if isinstance(stream, errors.T_Error):
+                return stream
+
+            return StreamedObject(target.name, stream, False)
+
+        zip_name = target.name + ".zip"
+        if target.name == "~":
+            zip_name = "home.zip"
+
+        return StreamedObject(zip_name, self._zip_stream(target), True)
+
+    async def _zip_stream(self, dir: fs.FS_Dir) -> AsyncIterator[bytes]:
+        """ Zip directory's files while they are streamed. Compressed data is yielded as soon as it's written. """
+        output = _ZipStreamBuffer()
+
+        with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for file in dir.walk(file_only=True):
+                stream = await self.stream_file(file)
+                if isinstance(stream, errors.T_Error):
+                    raise MemoryStreamError(stream)
+
+                with zf.open(file.path_to().removeprefix("~/"), "w") as zipped_file:
+                    async for part in stream:
+                        await asyncio.to_thread(zipped_file.write, part)
+                        if data := output.take():
+                            yield data
+
+        if data := output.take():
+            yield data
+
+    def _is_locked(self, obj: fs.FS_File | fs.FS_Dir) -> bool:
+        """ Check if file (or any file inside of directory) is locked by an ongoing write. """
+        path = obj.path_to()
+        if isinstance(obj, fs.FS_File):
+            return path in self.locked_files
+        return any(locked.startswith(path.rstrip("/") + "/") for locked in self.locked_files)
+
+    async def _writable_file(self, uid: int, path: str) -> fs.FS_File | errors.T_Error:
+        """ Find file and lock it for the write. Caller unlocks it when the write is done. """
         cwd, cwd_ok = await self.get_cwd(uid)
         if not cwd_ok:
             await self.log(f"{uid} failed to write file {path} (cwd error)")
@@ -810,86 +2701,355 @@ class DriveGuild:
             await self.log(f"{uid} failed to write file {file.name} (file is locked due to an ongoing operation.)")
             return errors.FILE_LOCKED
 
-        current_trace = await self.memory_manager.get_content_trace(file.mem_addr)
+        # Locked before any await, so concurrent writes of the same file can't both pass the check.
+        self.locked_files.add(file.path_to())
+        return file
+
+    async def _current_content(self, uid: int, file: fs.FS_File) -> tuple[list[discord.Message], list[discord.Message], list[list[discord.Message]]] | errors.T_Error:
+        """ Walk file's trace once. Returns (index messages, content messages, runs known from the index). """
+        index_messages = []
+        current_runs = []
+        if file.layout != fs.Layout.CHAIN:
+            index = await self.memory_manager.get_index_trace(file.mem_addr)
+            if isinstance(index, errors.T_Error):
+                await self.log(f"{uid} failed to edit {file.name}: Broken index trace: {index}")
+                return errors.BROKEN_MEMORY
+
+            index_messages, extents = index
+            current_trace = await self.memory_manager.fetch_extents(extents)
+        else:
+            current_trace = await self.memory_manager.get_content_trace(file.mem_addr)
+
         if isinstance(current_trace, errors.T_Error):
             await self.log(f"{uid} failed to edit {file.name}: Broken file trace: {current_trace}")
             return errors.BROKEN_MEMORY
 
-        b64_content = content
-        if not skip_encoding:
-            b64_content = base64.b64encode(content.encode()).decode()
-        new_content_chunks = self.memory_manager.split_content(b64_content)
-        self.locked_files.add(file.path_to())
+        if file.layout != fs.Layout.CHAIN:
+            offset = 0
+            for extent in extents:
+                current_runs.append(current_trace[offset:offset + extent.count])
+                offset += extent.count
+
+        return index_messages, current_trace, current_runs
+
+    async def _store_text_content(self,
+                                  stored_content: bytes,
+                                  current_trace: list[discord.Message],
+                                  current_runs: list[list[discord.Message]]
+                                  ) -> tuple[list[discord.Message], list[list[discord.Message]]] | errors.T_Error:
+        text_encoding = encoding.get(encoding.DEFAULT)
+        encoded_content = await asyncio.to_thread(text_encoding.encode, stored_content)
+        new_content_chunks = self.memory_manager.split_content(encoded_content, text_encoding.chunk_chars(limits.MSG_SIZE))
+        return await self.memory_manager.store_chunks(current_trace, current_runs, new_content_chunks)
+
+    async def _store_text_blocks(self,
+                                 raw_content: bytes,
+                                 current_trace: list[discord.Message],
+                                 current_runs: list[list[discord.Message]]
+                                 ) -> tuple[list[discord.Message], list[list[discord.Message]]] | errors.T_Error:
+        """ Store content compressed in blocks (see `compression.compress_blocks`), every chunk holds a single block. """
+        text_encoding = encoding.get(encoding.DEFAULT)
+        block_size = text_encoding.chunk_chars(limits.MSG_SIZE) // text_encoding.group_chars * text_encoding.group_bytes
+        blocks = await asyncio.to_thread(compression.compress_blocks, raw_content, block_size)
+        new_content_chunks = await asyncio.to_thread(lambda: [text_encoding.encode(block) for block in blocks])
+        return await self.memory_manager.store_chunks(current_trace, current_runs, new_content_chunks)
+
+    async def _commit_content(self,
+                              uid: int,
+                              file: fs.FS_File,
+                              index_messages: list[discord.Message],
+                              extents: list[fs.MemoryExtent],
+                              layout: str,
+                              codec: str,
+                              size: int
+                              ) -> T_OpStatus:
+        """ Write index of stored content and point file at it. """
+        path = file.path_to()
+        index_head = await self.memory_manager.write_index(extents, index_messages)
+        self.memory_manager.registry.save()
+        if isinstance(index_head, errors.T_Error):
+            await self.log(f"{uid} failed to edit {file.name}: Failed to save index: {index_head}")
+            return index_head
+
+        # Structure could be changed by other operation in the meantime.
+        async with self._struct_lock:
+            target = (await self.get_struct()).move_to(path)
+            committed = False
+            if isinstance(target, fs.FS_File):
+                target.mem_addr = index_head
+                target.layout = layout
+                target.codec = codec
+                target.encoding = encoding.DEFAULT
+                target.size = size
+                committed = await self.journal_struct(journal.put_file(target))
+
+            if committed:
+                self._content_versions[path] += 1
+
+        if not committed:
+            # New content is not referenced by any file.
+            file.mem_addr = index_head
+            file.layout = layout
+            await self.memory_manager.wipe_file(file)
+            await self.log(f"{uid} failed to edit {file.name}: File was removed or changed during write")
+            return errors.FILE_CHANGED
+
+        await self.log(f"{uid} edited file: {file.name}")
+        return True
 
-        file.size = len(content) if fixed_size is None else fixed_size
-        struct = cwd.base_dir()
-        await self.set_struct(struct)
-        await self.memory_manager.remove_from_cache(file)
-        
-        # Just override all used chunks.
-        if len(new_content_chunks) == len(current_trace):
-            for msg_chunk, content in zip(current_trace, new_content_chunks):
-                next_id = msg_chunk.content.split("@")[1]
-                new_content = content + f"@{next_id}"
-                await msg_chunk.edit(content=new_content)
-                
-            await self.memory_manager.cache_sizes(file)
+    async def write_file(self, uid: int, path: str, content: str, skip_encoding: bool = False, fixed_size: int = None) -> T_OpStatus:
+        file = await self._writable_file(uid, path)
+        if isinstance(file, errors.T_Error):
+            return file
+
+        try:
+            raw_content = base64.b64decode(content) if skip_encoding else content.encode()
+            size = len(raw_content) if fixed_size is None else fixed_size
+            return await self._write_content(uid, file, raw_content, size)
+        finally:
             self.locked_files.discard(file.path_to())
-            await self.log(f"{uid} edited file: {file.name}")
-            return True
 
-        # Allocate missing chunks if new messages required.
-        if len(new_content_chunks) > len(current_trace):
-            missing_chunks = len(new_content_chunks) - len(current_trace)
-            new_chunks_offset = len(current_trace) - 1
-            created_chunks = []
+    async def _write_content(self, uid: int, file: fs.FS_File, raw_content: bytes, size: int, codec: str | None = None) -> T_OpStatus:
+        """ Replace whole content of the file. Codec is chosen automatically if not given. """
+        # Current trace is walked once, runs are known from the index.
+        current = await self._current_content(uid, file)
+        if isinstance(current, errors.T_Error):
+            return current
+
+        index_messages, current_trace, current_runs = current
+        codec, stored_content = await asyncio.to_thread(compression.compress, raw_content, codec)
+
+        # Old attachments are never reused as text chunks (and vice versa).
+        old_attachments, old_attachments_runs = [], []
+        if file.layout == fs.Layout.ATTACHMENTS:
+            old_attachments, old_attachments_runs = current_trace, current_runs
+            current_trace, current_runs = [], []
+
+        layout = fs.Layout.INDEX
+        if len(stored_content) >= limits.ATTACHMENTS_TIER_MIN_SIZE:
+            layout = fs.Layout.ATTACHMENTS
+
+        await self._ensure_chunks_registry()
+
+        if layout == fs.Layout.ATTACHMENTS:
+            stored = await self.memory_manager.store_attachments(stored_content, old_attachments, old_attachments_runs)
+            old_attachments = []
+            if not isinstance(stored, errors.T_Error):
+                await self.memory_manager.store_chunks(current_trace, current_runs, [])
+        elif codec != compression.RAW:
+            # Single compressed stream would change every chunk after an edit.
+            codec = compression.BLOCKS
+            stored = await self._store_text_blocks(raw_content, current_trace, current_runs)
+        else:
+            stored = await self._store_text_content(stored_content, current_trace, current_runs)
+
+        if isinstance(stored, errors.T_Error):
+            await self.log(f"{uid} failed to edit {file.name}: Out of memory")
+            return stored
+
+        await self.memory_manager.release_messages(old_attachments)
+
+        extents = self.memory_manager.build_extents(*stored)
+        return await self._commit_content(uid, file, index_messages, extents, layout, codec, size)
+
+    async def append_file(self, uid: int, path: str, data: bytes) -> T_OpStatus:
+        """ Append data to the end of file's content. See: patch_file. """
+        file = await self._writable_file(uid, path)
+        if isinstance(file, errors.T_Error):
+            return file
 
-            for i in range(missing_chunks):
-                alloc_size = len(new_content_chunks[new_chunks_offset + i])
-                msg_chunk = await self.memory_manager.allocate_memory_chunk(alloc_size)
-                if isinstance(msg_chunk, errors.T_Error):
-                    self.locked_files.discard(file.path_to())
-                    await self.log(f"{uid} failed to edit {file.name}: Out of memory")
-                    return msg_chunk
+        try:
+            return await self._patch_content(uid, file, None, data)
+        finally:
+            self.locked_files.discard(file.path_to())
 
-                created_chunks.append(msg_chunk)
+    async def patch_file(self, uid: int, path: str, offset: int, data: bytes) -> T_OpStatus:
+        """
+        Overwrite file's content with data starting at offset (content is extended if data goes past it's end).
+        In not compressed files only messages covering the patched range are read and stored again.
+        Other files are rewritten once without compression, so following patches are cheap.
+        """
+        file = await self._writable_file(uid, path)
+        if isinstance(file, errors.T_Error):
+            return file
 
-            await self.log(f"Allocated additional {len(created_chunks)} chunks to edit file: {file.name}")
+        try:
+            return await self._patch_content(uid, file, offset, data)
+        finally:
+            self.locked_files.discard(file.path_to())
 
-            current_trace.extend(created_chunks)
-            for i, (msg, chunk_content) in enumerate(zip(current_trace, new_content_chunks)):
-                next_id = "END"
-                if i < len(current_trace) - 1:
-                    next_id = fs.MemoryAddress.from_message(current_trace[i + 1]).prepare_mem_addr()
+    async def _patch_content(self, uid: int, file: fs.FS_File, offset: int | None, data: bytes) -> T_OpStatus:
+        """ Patch content at offset (or at the end if offset is None). """
+        index_messages, extents = [], []
+        if file.layout != fs.Layout.CHAIN:
+            index = await self.memory_manager.get_index_trace(file.mem_addr)
+            if isinstance(index, errors.T_Error):
+                await self.log(f"{uid} failed to edit {file.name}: Broken index trace: {index}")
+                return errors.BROKEN_MEMORY
 
-                content = chunk_content + f"@{next_id}"
-                await msg.edit(content=content)
+            index_messages, extents = index
 
-            await self.memory_manager.cache_sizes(file)
-            self.locked_files.discard(file.path_to())
-            await self.log(f"{uid} edited file: {file.name}")
+        # Blank file has no content messages (chain files are not indexed, their size is always known).
+        size = 0 if file.layout != fs.Layout.CHAIN and not extents else file.size
+        offset = size if offset is None else offset
+        if offset < 0 or offset > size:
+            return errors.INVALID_OFFSET
+
+        if not data:
             return True
 
-        # Trim memory chunks.
-        if len(new_content_chunks) < len(current_trace):
-            not_used_chunks = current_trace[len(new_content_chunks):]
-            for msg in not_used_chunks:
-                await self.memory_manager.deallocate_message(msg)
+        seekable = file.layout != fs.Layout.CHAIN and file.codec == compression.RAW
+        if extents and file.layout == fs.Layout.INDEX and file.encoding != encoding.DEFAULT:
+            seekable = False
+
+        if not seekable:
+            content = await self._read_file(file, locked=True)
+            if isinstance(content, errors.T_Error):
+                return content
+
+            content = content[:offset] + data + content[offset + len(data):]
+            return await self._write_content(uid, file, content, len(content), compression.RAW)
+
+        unit_size, units_per_msg = _content_units(file)
+        message_size = unit_size * units_per_msg
+        first = offset // message_size
+        stop = -(-(offset + len(data)) // message_size)
+
+        # Extents holding messages in range [first, stop).
+        covering_start = covering_end = position = 0
+        for i, extent in enumerate(extents):
+            if position + extent.count <= first:
+                covering_start = i + 1
+            if position < stop:
+                covering_end = i + 1
+            position += extent.count
+
+        covering = extents[covering_start:covering_end]
+        skip = first - sum(extent.count for extent in extents[:covering_start])
+
+        messages = await self.memory_manager.fetch_extents(covering)
+        if isinstance(messages, errors.T_Error):
+            await self.log(f"{uid} failed to edit {file.name}: Broken file trace: {messages}")
+            return errors.BROKEN_MEMORY
+
+        covering_runs = []
+        position = 0
+        for extent in covering:
+            covering_runs.append(messages[position:position + extent.count])
+            position += extent.count
+
+        old_messages = messages[skip:skip + stop - first]
+        tail_messages = messages[skip + len(old_messages):]
+
+        if file.layout == fs.Layout.ATTACHMENTS:
+            old_content = await self.memory_manager.read_attachments(old_messages)
+            if isinstance(old_content, errors.T_Error):
+                return old_content
+        else:
+            old_chunks = "".join(_split_mem_content(message.content)[0] for message in old_messages)
+            old_content = await asyncio.to_thread(encoding.decode, file.encoding, old_chunks)
+
+        patch_at = offset - first * message_size
+        content = old_content[:patch_at] + data + old_content[patch_at + len(data):]
+
+        await self._ensure_chunks_registry()
 
-            current_trace = current_trace[:len(new_content_chunks)]
+        if file.layout == fs.Layout.ATTACHMENTS:
+            stored = await self.memory_manager.store_attachments(content, old_messages, [])
+        else:
+            stored = await self._store_text_content(content, old_messages, [])
 
-            for i, (msg, content) in enumerate(zip(current_trace, new_content_chunks)):
-                next = msg.content.split("@")[1]
-                if i == len(current_trace) - 1:
-                    next = "END"
+        if isinstance(stored, errors.T_Error):
+            await self.log(f"{uid} failed to edit {file.name}: Out of memory")
+            return stored
 
-                content += f"@{next}"
-                await msg.edit(content=content)
+        trace, runs = stored
+        segment = messages[:skip] + trace + tail_messages
+        extents = extents[:covering_start] + self.memory_manager.build_extents(segment, covering_runs + runs) + extents[covering_end:]
+        return await self._commit_content(uid, file, index_messages, extents, file.layout, compression.RAW, max(size, offset + len(data)))
 
-            await self.memory_manager.cache_sizes(file)
+    async def write_file_stream(self, uid: int, path: str, content: AsyncIterator[bytes]) -> T_OpStatus:
+        """
+        Write file's content while it's still being received. Content is compressed on the fly and
+        once it reaches attachments tier, it's sent in attachments messages as soon as they are filled.
+        Smaller content is stored as text chunks when it's complete. Old attachments are not reused.
+        """
+        file = await self._writable_file(uid, path)
+        if isinstance(file, errors.T_Error):
+            return file
+
+        try:
+            return await self._write_content_stream(uid, file, content)
+        finally:
             self.locked_files.discard(file.path_to())
-            await self.log(f"{uid} edited file: {file.name}")
-            return True
+
+    async def _write_content_stream(self, uid: int, file: fs.FS_File, content: AsyncIterator[bytes]) -> T_OpStatus:
+        current = await self._current_content(uid, file)
+        if isinstance(current, errors.T_Error):
+            return current
+
+        index_messages, current_trace, current_runs = current
+        old_attachments = []
+        if file.layout == fs.Layout.ATTACHMENTS:
+            old_attachments, current_trace, current_runs = current_trace, [], []
+
+        content = aiter(content)
+        compressor = compression.Compressor()
+        raw_size = 0
+        stored_content = bytearray()
+
+        # Size of stored content decides on layout, so it's buffered until it reaches attachments tier.
+        try:
+            async for data in content:
+                raw_size += len(data)
+                stored_content += await asyncio.to_thread(compressor.compress, data)
+                if len(stored_content) >= limits.ATTACHMENTS_TIER_MIN_SIZE:
+                    break
+            else:
+                stored_content += await asyncio.to_thread(compressor.flush)
+
+        except UploadInterruptedError:
+            await self.log(f"{uid} failed to edit {file.name}: Upload interrupted")
+            return errors.UPLOAD_INTERRUPTED
+
+        async def messages_parts() -> AsyncIterator[list[bytes]]:
+            nonlocal raw_size, stored_content
+            message_size = limits.ATTACHMENT_PART_SIZE * limits.MAX_ATTACHMENTS_PER_MSG
+
+            while True:
+                while len(stored_content) >= message_size:
+                    yield _attachment_parts(bytes(stored_content[:message_size]))
+                    del stored_content[:message_size]
+
+                data = await anext(content, None)
+                if data is None:
+                    break
+
+                raw_size += len(data)
+                stored_content += await asyncio.to_thread(compressor.compress, data)
+
+            stored_content += await asyncio.to_thread(compressor.flush)
+            if stored_content:
+                yield _attachment_parts(bytes(stored_content))
+
+        await self._ensure_chunks_registry()
+
+        layout = fs.Layout.INDEX
+        if len(stored_content) >= limits.ATTACHMENTS_TIER_MIN_SIZE:
+            layout = fs.Layout.ATTACHMENTS
+            stored = await self.memory_manager.store_attachments_stream(messages_parts())
+            if not isinstance(stored, errors.T_Error):
+                await self.memory_manager.store_chunks(current_trace, current_runs, [])
+        else:
+            stored = await self._store_text_content(bytes(stored_content), current_trace, current_runs)
+
+        if isinstance(stored, errors.T_Error):
+            await self.log(f"{uid} failed to edit {file.name}: {stored}")
+            return stored
+
+        await self.memory_manager.release_messages(old_attachments)
+        extents = self.memory_manager.build_extents(*stored)
+        return await self._commit_content(uid, file, index_messages, extents, layout, compressor.codec, raw_size)
 
     async def rename(self, uid: int, path: str, new_name: str) -> T_OpStatus:
         if not fs.is_object_name_valid(new_name):
@@ -900,6 +3060,9 @@ class DriveGuild:
             return errors.INVALID_PATH
         
         target = cwd.move_to(path)
+        if target is None:
+            return errors.INVALID_PATH
+
         parent = target.parent_dir
         if parent is None:
             return errors.CANNOT_RENAME
@@ -907,10 +3070,13 @@ class DriveGuild:
         if parent.has_object(new_name):
             return errors.NAME_IN_USE
 
+        if self._is_locked(target):
+            await self.log(f"{uid} failed to rename object: {target.path_to()} (File is locked)")
+            return errors.FILE_LOCKED
+
         old_path = target.path_to()
-        target.name = new_name
-        base = target.base_dir()
-        
+        if not await self.journal_struct(journal.rename(old_path, new_name)):
+            return errors.NAME_IN_USE
+
         await self.log(f"{uid} Renamed object: {old_path} -> {new_name}")
-        await self.set_struct(base)
         return True
@@ -0,0 +1,91 @@
+"""
+Module: dedup.py
+
+Description:
+    Content-addressed chunks registry.
+
+    Maps hash of chunk's payload to the memory address of the message
+    storing it and the amount of index references pointing at this message,
+    so identical chunks are stored only once per guild. Chunk messages not
+    present in the registry are owned by a single file.
+
+    Registry is saved as JSON file per guild in `data/dedup/`.
+"""
+from modules.filesystem.fs import MemoryAddress
+from modules.paths import Path
+
+import hashlib
+
+
+DEDUP_PATH = Path("./data/dedup/")
+
+
+def chunk_hash(payload: str | bytes) -> str:
+    """ Returns hash identifying chunk's payload. """
+    if isinstance(payload, str):
+        payload = payload.encode()
+    return hashlib.sha256(payload).hexdigest()[:32]
+
+
+class ChunksRegistry:
+    def __init__(self, guild_id: int) -> None:
+        self.path = DEDUP_PATH + f"{guild_id}.json"
+        self.entries: dict[str, list[int]] = {}  # hash: [channel_id, message_id, refs]
+        self.loaded = self.path.exists()
+
+        if self.loaded:
+            self.entries = self.path.get_json_content()
+
+    def get(self, hash: str) -> MemoryAddress | None:
+        entry = self.entries.get(hash)
+        if entry is None:
+            return None
+        return MemoryAddress(entry[0], entry[1])
+
+    def refs(self, hash: str) -> int:
+        entry = self.entries.get(hash)
+        return entry[2] if entry is not None else 0
+
+    def is_tracked(self, hash: str, addr: MemoryAddress) -> bool:
+        """ Check if message at given address is the registered holder of this hash. """
+        entry = self.entries.get(hash)
+        return entry is not None and entry[0] == addr.channel_id and entry[1] == addr.message_id
+
+    def register(self, hash: str, addr: MemoryAddress, refs: int = 1) -> None:
+        self.entries[hash] = [addr.channel_id, addr.message_id, refs]
+
+    def incref(self, hash: str, n: int = 1) -> None:
+        self.entries[hash][2] += n
+
+    def decref(self, hash: str) -> int:
+        """ Remove single reference. Entry is forgotten if there are no references left. Returns references left. """
+        entry = self.entries[hash]
+        entry[2] -= 1
+
+        if entry[2] <= 0:
+            del self.entries[hash]
+            return 0
+
+        return entry[2]
+
+    def forget(self, hash: str) -> None:
+        self.entries.pop(hash, None)
+
+    def rebuild(self, refs: dict[tuple[int, int], int], hashes: dict[tuple[int, int], str]) -> None:
+        """
+        Recreate registry from references counted per message (channel_id, message_id).
+        If the same payload is stored in multiple messages, the most referenced one is registered.
+        """
+        self.entries = {}
+
+        for key, hash in hashes.items():
+            current = self.entries.get(hash)
+            if current is None or refs[key] > current[2]:
+                self.entries[hash] = [key[0], key[1], refs[key]]
+
+        self.loaded = True
+        self.save()
+
+    def save(self) -> None:
+        DEDUP_PATH.touch()
+        self.path.save_json_content(self.entries)
@@ -0,0 +1,342 @@
+"""
+Module: disk_cache.py
+
+Description:
+    Persistent cache of memory messages kept in `data/chunks/<guild_id>/`.
+
+    Second level of the chunks cache: messages evicted from memory or
+    cached before restart are read from local disk instead of Discord.
+    Entries are appended to segment files as records holding message's
+    address, last edit timestamp, id of the message following it in the
+    channel (if known) and it's content.
+
+    Every disk operation (replaying segments on first use, reading,
+    writing and copying records) runs in the cache's io thread, in order,
+    so reads always see records queued before them and event loop never
+    waits for the disk. Lookups miss until the index is loaded. Entries
+    keep digest of their content, so up to date copies are recognized
+    without reading them and damaged records are never served.
+
+    Memory messages are edited only by the bot and every change passes
+    through the cache, so entries restored after restart are served. Each
+    run of them is checked in background by the caller (see `verified`).
+    Changed (edited or deleted) message gets a tombstone record.
+
+    Size is capped: least recently used entries are evicted. Disk space is
+    reclaimed by removing the oldest segment once live entries stored in
+    it are copied to the active one.
+"""
+from modules.paths import Path
+from modules.logs import Log
+from modules import limits
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from dataclasses import dataclass
+import hashlib
+import asyncio
+import struct
+import os
+
+
+DISK_CACHE_PATH = Path("./data/chunks/")
+SEGMENT_SUFFIX = ".seg"
+
+_PUT = 1
+_TOMBSTONE = 2
+_HEADER = struct.Struct("<BQQdQI")  # kind, channel_id, message_id, edited_ts, following_id, length
+
+
+def _digest(content: bytes) -> bytes:
+    return hashlib.blake2b(content, digest_size=16).digest()
+
+
+@dataclass
+class _Entry:
+    segment: int
+    offset: int  # Offset of record's content.
+    length: int
+    edited: float
+    following_id: int | None
+    digest: bytes
+    verified: bool = True  # False for entries restored after restart (until confirmed with Discord).
+
+    def size(self) -> int:
+        return _HEADER.size + self.length
+
+
+class DiskChunksCache:
+    def __init__(self, guild_id: int, budget: int = limits.DISK_CHUNKS_CACHE_SIZE_B) -> None:
+        self.path = DISK_CACHE_PATH // str(guild_id)
+        self.budget = budget
+        self.size = 0  # Size of live records.
+        self.disk_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.loaded = False
+        self._loading: asyncio.Task | None = None
+        self._invalidated: set[tuple[int, int]] = set()  # Invalidated while loading.
+        self._entries: OrderedDict[tuple[int, int], _Entry] = OrderedDict()
+        self._evicted: dict[tuple[int, int], int] = {}  # Evicted entries with records left on disk: (ch, msg): segment
+        self._segments: dict[int, int] = {}  # segment: size on disk (including records not written yet)
+        self._active: int | None = None
+        self._io: ThreadPoolExecutor | None = None
+        self._readers = {}  # Used by io thread only.
+        self._writer = None
+        self._writer_segment: int | None = None
+
+    def _segment_path(self, segment: int) -> str:
+        return str(self.path + f"{segment:08}{SEGMENT_SUFFIX}")
+
+    def _run_io(self, fn, *args) -> asyncio.Future:
+        """ Run disk operation in cache's io thread (operations are executed in order). """
+        if self._io is None:
+            self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="disk-chunks-cache")
+        return asyncio.get_running_loop().run_in_executor(self._io, fn, *args)
+
+    def _ensure_loaded(self) -> bool:
+        """ Start loading the index in background. Returns True if it's loaded. """
+        if not self.loaded and self._loading is None:
+            self._loading = asyncio.get_running_loop().create_task(self._load())
+        return self.loaded
+
+    async def _load(self) -> None:
+        try:
+            entries, segments = await self._run_io(self._scan)
+        except OSError as error:
+            Log.error(f"Failed to load disk chunks cache at: {self.path} ({error}), it stays disabled")
+            return
+
+        self._entries = entries
+        self._segments = segments
+        self.size = sum(entry.size() for entry in entries.values())
+        self.disk_size = sum(segments.values())
+        self._active = max(segments) if segments else None
+        self.loaded = True
+
+        for key in self._invalidated:
+            self.invalidate(*key)
+        self._invalidated.clear()
+
+        self._evict()
+        Log.info(f"Loaded {len(self._entries)} entries of disk chunks cache at: {self.path}")
+
+    def _scan(self) -> tuple[OrderedDict[tuple[int, int], _Entry], dict[int, int]]:
+        """ Rebuild index by replaying all segments (in io thread). """
+        entries = OrderedDict()
+        segments = {}
+        if not self.path.exists():
+            return entries, segments
+
+        numbers = sorted(
+            int(name.removesuffix(SEGMENT_SUFFIX))
+            for name in self.path.list_dir(as_str=True)
+            if name.endswith(SEGMENT_SUFFIX) and name.removesuffix(SEGMENT_SUFFIX).isnumeric()
+        )
+
+        for segment in numbers:
+            segments[segment] = self._replay(segment, entries)
+
+        return entries, segments
+
+    def _replay(self, segment: int, entries: OrderedDict[tuple[int, int], _Entry]) -> int:
+        """ Apply segment's records to the index. Truncated record (crash during write) is cut off. """
+        path = self._segment_path(segment)
+        with open(path, "rb") as file:
+            data = file.read()
+
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            kind, channel_id, message_id, edited, following_id, length = _HEADER.unpack_from(data, offset)
+            if kind not in (_PUT, _TOMBSTONE) or offset + _HEADER.size + length > len(data):
+                break
+
+            key = (channel_id, message_id)
+            entries.pop(key, None)
+            if kind == _PUT:
+                content = data[offset + _HEADER.size:offset + _HEADER.size + length]
+                entries[key] = _Entry(segment, offset + _HEADER.size, length, edited, following_id or None, _digest(content), verified=False)
+
+            offset += _HEADER.size + length
+
+        if offset != len(data):
+            Log.warn(f"Truncating damaged disk chunks cache segment: {path} ({len(data) - offset} bytes)")
+            os.truncate(path, offset)
+
+        return offset
+
+    def _drop(self, key: tuple[int, int]) -> _Entry | None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size()
+        return entry
+
+    def _allocate(self, length: int) -> tuple[int, int]:
+        """ Reserve space for a record in the active segment. Returns (segment, record's offset). """
+        if self._active is None or self._segments[self._active] >= limits.DISK_CACHE_SEGMENT_SIZE:
+            self._active = (self._active or 0) + 1
+            self._segments[self._active] = 0
+
+        segment = self._active
+        offset = self._segments[segment]
+        self._segments[segment] += _HEADER.size + length
+        self.disk_size += _HEADER.size + length
+        return segment, offset
+
+    def _append(self, kind: int, channel_id: int, message_id: int, edited: float, following_id: int | None, content: bytes) -> _Entry:
+        """ Add record to the active segment (it's written by io thread). """
+        segment, offset = self._allocate(len(content))
+        record = _HEADER.pack(kind, channel_id, message_id, edited, following_id or 0, len(content)) + content
+        self._run_io(self._write, segment, record)
+        return _Entry(segment, offset + _HEADER.size, len(content), edited, following_id, _digest(content))
+
+    def _write(self, segment: int, record: bytes) -> None:
+        """ Append record to segment's file (in io thread). """
+        try:
+            if self._writer_segment != segment:
+                if self._writer is not None:
+                    self._writer.close()
+
+                os.makedirs(str(self.path), exist_ok=True)
+                self._writer = open(self._segment_path(segment), "ab")
+                self._writer_segment = segment
+
+            self._writer.write(record)
+            self._writer.flush()
+
+        except OSError as error:
+            Log.error(f"Failed to write disk chunks cache segment: {self._segment_path(segment)} ({error})")
+
+    def _read(self, entry: _Entry) -> bytes | None:
+        """ Read entry's content (in io thread). Returns None if it's missing or damaged. """
+        try:
+            reader = self._readers.get(entry.segment)
+            if reader is None:
+                reader = self._readers[entry.segment] = open(self._segment_path(entry.segment), "rb")
+            data = os.pread(reader.fileno(), entry.length, entry.offset)
+        except OSError:
+            return None
+
+        if len(data) != entry.length or _digest(data) != entry.digest:
+            return None
+        return data
+
+    def _copy(self, segment: int, key: tuple[int, int], entry: _Entry) -> None:
+        """ Append copy of entry's record to segment (in io thread). Missing content is replaced by a tombstone of the same size. """
+        content = self._read(entry)
+        kind = _PUT
+        if content is None:
+            kind, content = _TOMBSTONE, bytes(entry.length)
+
+        self._write(segment, _HEADER.pack(kind, *key, entry.edited, entry.following_id or 0, entry.length) + content)
+
+    async def get(self, channel_id: int, message_id: int) -> tuple[str, float, int | None, bool] | None:
+        """ Returns (content, edit timestamp, following message's id, verified) of cached message. """
+        key = (channel_id, message_id)
+        entry = self._entries.get(key) if self._ensure_loaded() else None
+        content = await self._run_io(self._read, entry) if entry is not None else None
+        if content is None:
+            if entry is not None and self._entries.get(key) is entry:
+                self._drop(key)
+            self.misses += 1
+            return None
+
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        self.hits += 1
+        return content.decode(), entry.edited, entry.following_id, entry.verified
+
+    def following_id(self, channel_id: int, message_id: int) -> int | None:
+        entry = self._entries.get((channel_id, message_id)) if self._ensure_loaded() else None
+        return entry.following_id if entry is not None else None
+
+    def put(self, channel_id: int, message_id: int, content: str, edited: float, following_id: int | None = None) -> None:
+        """ Cache message's content. Up to date entry is kept without writing (it's only marked as verified). """
+        if not self._ensure_loaded():
+            return
+
+        key = (channel_id, message_id)
+        content = content.encode()
+        current = self._entries.get(key)
+        if current is not None:
+            following_id = following_id or current.following_id
+            if current.edited >= edited and current.following_id == following_id and current.digest == _digest(content):
+                current.verified = True
+                self._entries.move_to_end(key)
+                return
+
+        self._drop(key)
+        self._evicted.pop(key, None)
+        entry = self._append(_PUT, channel_id, message_id, edited, following_id, content)
+        self._entries[key] = entry
+        self.size += entry.size()
+        self._evict()
+
+    def invalidate(self, channel_id: int, message_id: int, content: str | None = None) -> None:
+        """ Drop cached message (with a tombstone record). Entry is kept if it's content is given and matches. """
+        key = (channel_id, message_id)
+        if not self._ensure_loaded():
+            if not self._loading.done():
+                self._invalidated.add(key)
+            return
+
+        entry = self._entries.get(key)
+        if entry is None:
+            # Evicted record would be loaded again after restart.
+            if self._evicted.pop(key, None) is not None:
+                self._append(_TOMBSTONE, channel_id, message_id, 0.0, None, b"")
+            return
+
+        if content is not None and entry.digest == _digest(content.encode()):
+            return
+
+        self._drop(key)
+        self._append(_TOMBSTONE, channel_id, message_id, 0.0, None, b"")
+
+    def _evict(self) -> None:
+        while self.size > self.budget and self._entries:
+            key = next(iter(self._entries))
+            self._evicted[key] = self._drop(key).segment
+
+        # Removed records stay on disk until their segment is reclaimed.
+        while self.disk_size > self.budget + limits.DISK_CACHE_SEGMENT_SIZE and len(self._segments) > 1:
+            self._reclaim(min(self._segments))
+
+    def _reclaim(self, segment: int) -> None:
+        """ Copy live entries of the oldest segment to the active one and remove it. Records are copied by io thread. """
+        for key, entry in list(self._entries.items()):
+            if entry.segment != segment:
+                continue
+
+            # Copied entry keeps it's LRU position and verification.
+            copy_segment, copy_offset = self._allocate(entry.length)
+            self._run_io(self._copy, copy_segment, key, entry)
+            self._entries[key] = _Entry(copy_segment, copy_offset + _HEADER.size, entry.length, entry.edited, entry.following_id, entry.digest, entry.verified)
+
+        self._evicted = {key: evicted_in for key, evicted_in in self._evicted.items() if evicted_in != segment}
+        self.disk_size -= self._segments.pop(segment)
+        self._run_io(self._remove_segment, segment)
+
+    def _remove_segment(self, segment: int) -> None:
+        """ Remove segment's file (in io thread, after copies of it's entries are written). """
+        reader = self._readers.pop(segment, None)
+        if reader is not None:
+            reader.close()
+
+        try:
+            os.remove(self._segment_path(segment))
+        except OSError as error:
+            Log.error(f"Failed to remove disk chunks cache segment: {self._segment_path(segment)} ({error})")
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "loaded": self.loaded,
+            "entries": len(self._entries),
+            "unverified": sum(not entry.verified for entry in self._entries.values()),
+            "size": self.size,
+            "disk_size": self.disk_size,
+            "segments": len(self._segments),
+            "budget": self.budget,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,66 @@
+"""
+Module: pool.py
+
+Description:
+    Pool of pre-sent placeholder messages.
+
+    Placeholders are sent ahead of time by a background task, so the
+    write path only edits them with content. Placeholders are kept per
+    data channel as runs of messages sent one after another (without any
+    other message in between), so chunks stored in them still form
+    extents readable with a single channel history request.
+"""
+import discord
+
+
+class PlaceholderPool:
+    def __init__(self) -> None:
+        self._runs: dict[int, list[list[discord.Message]]] = {}  # channel_id: [run, ...]
+
+    def size(self) -> int:
+        return sum(len(run) for runs in self._runs.values() for run in runs)
+
+    def channels(self) -> list[int]:
+        """ Channels with placeholders available, the ones with longest run first. """
+        return sorted(self._runs, key=lambda channel_id: len(self._runs[channel_id][0]), reverse=True)
+
+    def available_run(self, channel_id: int) -> int:
+        """ Amount of placeholders which can be taken from the channel at once. """
+        runs = self._runs.get(channel_id)
+        return len(runs[0]) if runs else 0
+
+    def put(self, channel_id: int, run: list[discord.Message]) -> None:
+        if run:
+            self._runs.setdefault(channel_id, []).append(run)
+
+    def take(self, channel_id: int, count: int) -> list[discord.Message]:
+        """ Take up to `count` placeholders forming a contiguous run. """
+        runs = self._runs.get(channel_id)
+        if not runs:
+            return []
+
+        taken = runs[0][:count]
+        del runs[0][:count]
+
+        if not runs[0]:
+            runs.pop(0)
+        if not runs:
+            del self._runs[channel_id]
+
+        return taken
+
+    def message_ids(self) -> set[int]:
+        return {msg.id for runs in self._runs.values() for run in runs for msg in run}
+
+    def drain(self) -> dict[int, list[discord.Message]]:
+        """ Remove all placeholders from the pool. Returns them per channel. """
+        drained = {channel_id: [msg for run in runs for msg in run] for channel_id, runs in self._runs.items()}
+        self._runs.clear()
+        return drained
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": self.size(),
+            "channels": len(self._runs),
+            "runs": sum(len(runs) for runs in self._runs.values()),
+        }
@@ -0,0 +1,193 @@
+"""
+Module: scheduler.py
+
+Description:
+    Rate limit aware scheduler of Discord requests (per guild).
+
+    Every request is described by a lane (priority) and a route:
+        READ         - fetching memory for reads (highest priority).
+        WRITE        - sending, editing and deleting memory messages.
+        HOUSEKEEPING - cache saves, logs, placeholders refill, etc.
+
+    Route (eg. `edit:CHANNEL_ID`) has it's own token bucket matching Discord's
+    per channel limits, so requests for busy channel wait without blocking
+    other channels. Requests which got their tokens wait for a free slot and
+    slots are always given to the highest priority lane first. Amount of slots
+    adapts to the rate limits: it's halved on 429 responses and slowly grows
+    back while requests succeed.
+
+    discord.py retries 429 responses internally (request never fails with
+    them), so they are detected from warnings logged by it's HTTP client.
+    Scheduler which sent requests to the rate limited channel is notified
+    (all of them for global and non channel rate limits).
+"""
+from modules.logs import Log
+from modules import limits
+
+from collections.abc import Callable, Awaitable
+from collections import Counter
+from typing import TypeVar
+import itertools
+import logging
+import weakref
+import asyncio
+import heapq
+import time
+import re
+import discord
+
+
+READ = 0
+WRITE = 1
+HOUSEKEEPING = 2
+LANES_NAMES = {READ: "read", WRITE: "write", HOUSEKEEPING: "housekeeping"}
+
+T = TypeVar("T")
+
+_CHANNEL_URL = re.compile(r"/channels/(\d+)")
+_schedulers: "weakref.WeakSet[RequestScheduler]" = weakref.WeakSet()
+
+
+class _RateLimitSignal(logging.Handler):
+    """ Notifies schedulers about 429 responses retried by discord.py. """
+    def emit(self, record: logging.LogRecord) -> None:
+        message = record.getMessage()
+        if "rate limited" not in message and "rate limit has been hit" not in message:
+            return
+
+        # Not retried 429 is raised as `discord.RateLimited` and handled by the request itself.
+        if "erroring instead" in message:
+            return
+
+        match = _CHANNEL_URL.search(message)
+        channel_id = match.group(1) if match is not None else None
+        notified = [requests for requests in _schedulers if channel_id is not None and requests.uses_channel(channel_id)]
+        for requests in notified or list(_schedulers):
+            requests._on_rate_limit()
+
+
+logging.getLogger("discord.http").addHandler(_RateLimitSignal(logging.WARNING))
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def take(self) -> None:
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+
+            self.tokens -= 1
+
+
+class RequestScheduler:
+    def __init__(self) -> None:
+        self.limit = limits.SCHEDULER_MAX_CONCURRENCY
+        self.active = 0
+        self.rate_limited = 0
+        self.completed = Counter()
+        self._successes = 0
+        self._queue: list[tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._buckets: dict[str, _TokenBucket] = {}
+        _schedulers.add(self)
+
+    def uses_channel(self, channel_id: str) -> bool:
+        """ Check if any request was scheduled for the channel (routes are named `kind:CHANNEL_ID`). """
+        return any(route.endswith(f":{channel_id}") for route in self._buckets)
+
+    def _bucket(self, route: str) -> _TokenBucket:
+        bucket = self._buckets.get(route)
+        if bucket is None:
+            rate, burst = limits.ROUTES_RATE_LIMITS.get(route.split(":")[0], limits.DEFAULT_ROUTE_RATE_LIMIT)
+            bucket = self._buckets[route] = _TokenBucket(rate, burst)
+        return bucket
+
+    async def _acquire(self, lane: int) -> None:
+        if self.active < self.limit and not self._queue:
+            self.active += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (lane, next(self._order), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Slot could be given right before cancellation.
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+
+    def _release(self) -> None:
+        self.active -= 1
+        while self._queue and self.active < self.limit:
+            _, _, future = heapq.heappop(self._queue)
+            if future.cancelled():
+                continue
+
+            self.active += 1
+            future.set_result(None)
+
+    def _on_success(self) -> None:
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < limits.SCHEDULER_MAX_CONCURRENCY:
+            self._successes = 0
+            self.limit += 1
+
+    def _on_rate_limit(self) -> None:
+        self.rate_limited += 1
+        self._successes = 0
+        self.limit = max(limits.SCHEDULER_MIN_CONCURRENCY, self.limit // 2)
+        Log.warn(f"Discord rate limit hit, concurrency reduced to {self.limit}")
+
+    async def request(self, lane: int, route: str, request_fn: Callable[[], Awaitable[T]]) -> T:
+        """ Schedule Discord request. `request_fn` creates request's coroutine (it may be called again after 429). """
+        while True:
+            await self._bucket(route).take()
+            await self._acquire(lane)
+
+            try:
+                result = await request_fn()
+
+            except discord.RateLimited as error:
+                self._on_rate_limit()
+                retry_after = error.retry_after
+
+            except discord.HTTPException as error:
+                if error.status != 429:
+                    raise
+
+                self._on_rate_limit()
+                retry_after = limits.RATE_LIMIT_RETRY_AFTER
+
+            else:
+                self._on_success()
+                self.completed[LANES_NAMES[lane]] += 1
+                return result
+
+            finally:
+                self._release()
+
+            await asyncio.sleep(retry_after)
+
+    def stats(self) -> dict:
+        queued = Counter(LANES_NAMES[lane] for lane, _, future in self._queue if not future.done())
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": {name: queued[name] for name in LANES_NAMES.values()},
+            "completed": {name: self.completed[name] for name in LANES_NAMES.values()},
+            "rate_limited": self.rate_limited,
+        }
@@ -20,3 +20,8 @@ MEMORY_ERROR = "Out of memory."
 BROKEN_MEMORY = "Broken memory trace."
 INVALID_MEM_ADDR = "Invalid memory address."
 FILE_LOCKED = "File is locked due to ongoing operation."
+INVALID_OFFSET = "Offset is out of file's bounds."
+UPLOAD_INTERRUPTED = "Upload interrupted."
+FILE_CHANGED = "File was changed during operation."
+NO_CONTIGUOUS_MEMORY = "Not enough contiguous free memory."
+CHUNKS_SHARED = "File's chunks are shared with other files."
@@ -0,0 +1,205 @@
+"""
+Module: compression.py
+
+Description:
+    Compression codecs for stored files' content.
+
+    Codec is chosen per file: content which is already compressed
+    (archives, images, media) is stored raw, otherwise every codec
+    compresses a sample and the best one is used for whole content.
+    Codec's name is saved in file's metadata, so content can be
+    decompressed transparently while reading.
+
+    Text chunks of compressed content are stored in BLOCKS: content is
+    split after lines chosen by their content and every block is
+    compressed on it's own, so an edit changes only blocks around it.
+"""
+from collections.abc import Callable
+import lzma
+import zlib
+import bz2
+
+
+RAW = "raw"
+BLOCKS = "zlib-blocks"  # Independently compressed blocks, one per text chunk.
+SAMPLE_SIZE = 64 * 1024
+MIN_RATIO = 0.9  # Compressed sample must be smaller than 90% of original.
+BLOCK_CUT_WINDOW = 64  # Bytes before a line break hashed to rank it as block's end.
+BLOCK_MAX_RATIO = 16  # Longer ranges are split without trying to compress them.
+
+_CODECS = {
+    "zlib": (lambda data: zlib.compress(data, 9), zlib.decompress),
+    "bz2": (lambda data: bz2.compress(data, 9), bz2.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+_COMPRESSORS = {
+    "zlib": lambda: zlib.compressobj(9),
+    "bz2": lambda: bz2.BZ2Compressor(9),
+    "lzma": lzma.LZMACompressor,
+}
+
+_DECOMPRESSORS = {
+    "zlib": zlib.decompressobj,
+    "bz2": bz2.BZ2Decompressor,
+    "lzma": lzma.LZMADecompressor,
+}
+
+# Signatures of formats which are compressed already.
+_COMPRESSED_SIGNATURES = (
+    b"\x1f\x8b",          # gzip
+    b"PK\x03\x04",        # zip, docx, jar, apk
+    b"\xfd7zXZ\x00",      # xz
+    b"BZh",               # bz2
+    b"(\xb5/\xfd",        # zstd
+    b"7z\xbc\xaf\x27\x1c",  # 7z
+    b"Rar!",              # rar
+    b"\x89PNG",           # png
+    b"\xff\xd8\xff",      # jpeg
+    b"GIF8",              # gif
+    b"OggS",              # ogg
+    b"fLaC",              # flac
+    b"ID3",               # mp3
+)
+
+
+def is_compressed(data: bytes) -> bool:
+    """ Check if data starts with signature of a compressed format. """
+    if data.startswith(_COMPRESSED_SIGNATURES):
+        return True
+
+    # webp / mp4 / mov containers.
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return True
+
+    return data[4:8] == b"ftyp"
+
+
+def choose_codec(data: bytes) -> str:
+    """ Returns name of codec which compresses sample of the data best or RAW if compression is not worth it. """
+    if not data or is_compressed(data):
+        return RAW
+
+    sample = data[:SAMPLE_SIZE]
+    best_codec = RAW
+    best_size = len(sample) * MIN_RATIO
+
+    for name, (compress_fn, _) in _CODECS.items():
+        size = len(compress_fn(sample))
+        if size < best_size:
+            best_codec = name
+            best_size = size
+
+    return best_codec
+
+
+def compress(data: bytes, codec: str | None = None) -> tuple[str, bytes]:
+    """ Compress data with given or automatically chosen codec. Returns (codec, compressed data). """
+    if codec is None:
+        codec = choose_codec(data)
+
+    if codec == RAW:
+        return RAW, data
+
+    compress_fn, _ = _CODECS[codec]
+    compressed = compress_fn(data)
+    if len(compressed) >= len(data):
+        return RAW, data
+
+    return codec, compressed
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == RAW:
+        return data
+
+    _, decompress_fn = _CODECS[codec]
+    return decompress_fn(data)
+
+
+def compress_blocks(data: bytes, max_size: int) -> list[bytes]:
+    """
+    Compress data in independent zlib blocks of up to max_size bytes. Range which doesn't fit is split after the
+    line with the lowest hash (near it's middle), so blocks' ends depend only on content near them and unchanged
+    blocks stay byte identical after an edit. Lines longer than a block are split in half.
+    """
+    cuts = []  # (position, rank) of every line break inside the data.
+    position = data.find(b"\n") + 1
+    while 0 < position < len(data):
+        cuts.append((position, zlib.crc32(data[max(0, position - BLOCK_CUT_WINDOW):position])))
+        position = data.find(b"\n", position) + 1
+
+    blocks = []
+    ranges = [(0, len(data), 0, len(cuts))]  # (start, stop, first cut, last cut)
+    while ranges:
+        start, stop, first, last = ranges.pop()
+        if stop - start <= max_size * BLOCK_MAX_RATIO:
+            block = zlib.compress(data[start:stop], 9)
+            if len(block) <= max_size:
+                blocks.append(block)
+                continue
+
+        # Cuts in the middle half of the range are preferred, so blocks are filled better.
+        quarter = (stop - start) // 4
+        candidates = [i for i in range(first, last) if start + quarter <= cuts[i][0] <= stop - quarter] or range(first, last)
+        if candidates:
+            lowest = min(cuts[i][1] for i in candidates)
+            ties = [i for i in candidates if cuts[i][1] == lowest]
+            cut = ties[len(ties) // 2]
+            middle, left_last, right_first = cuts[cut][0], cut, cut + 1
+        else:
+            middle, left_last, right_first = (start + stop) // 2, first, last
+
+        # Right range is pushed first, so blocks are produced in order.
+        ranges.append((middle, stop, right_first, last))
+        ranges.append((start, middle, first, left_last))
+
+    return blocks
+
+
+def decompress_block(block: bytes) -> bytes:
+    return zlib.decompress(block)
+
+
+def decompressor(codec: str) -> Callable[[bytes], bytes]:
+    """ Incremental decompression. Returned function takes consecutive parts of compressed data and returns decompressed parts. """
+    if codec == RAW:
+        return bytes
+
+    return _DECOMPRESSORS[codec]().decompress
+
+
+class Compressor:
+    """ Incremental compression of streamed content. Codec is chosen when the first SAMPLE_SIZE bytes are received. """
+    def __init__(self) -> None:
+        self.codec = None
+        self._sample = bytearray()
+        self._compressor = None
+        self._finished = False
+
+    def _start(self) -> bytes:
+        self.codec = choose_codec(bytes(self._sample))
+        if self.codec != RAW:
+            self._compressor = _COMPRESSORS[self.codec]()
+
+        sample = bytes(self._sample)
+        self._sample.clear()
+        return self._compressor.compress(sample) if self._compressor else sample
+
+    def compress(self, data: bytes) -> bytes:
+        if self.codec is None:
+            self._sample += data
+            if len(self._sample) < SAMPLE_SIZE:
+                return b""
+            return self._start()
+
+        return self._compressor.compress(data) if self._compressor else data
+
+    def flush(self) -> bytes:
+        """ Returns rest of compressed content. Following calls return nothing. """
+        if self._finished:
+            return b""
+
+        self._finished = True
+        data = self._start() if self.codec is None else b""
+        return data + self._compressor.flush() if self._compressor else data
@@ -0,0 +1,132 @@
+"""
+Module: encoding.py
+
+Description:
+    Text encodings of stored chunks' payload.
+
+    Discord limits message's length in characters, not in bytes,
+    so encodings packing more bits into a single character store
+    more data per message:
+        b64  - 6 bits per character (base64).
+        b85  - 6.4 bits per character (base85).
+        b32k - 15 bits per character (base32768 style). Uses CJK and
+               Hangul code points which are stable under Unicode
+               normalization and never contain the `@` separator.
+
+    Content is split only at group boundaries (see `chunk_chars`),
+    so every chunk can be decoded on it's own.
+"""
+from dataclasses import dataclass
+from collections.abc import Callable
+import base64
+
+
+B64 = "b64"
+B85 = "b85"
+B32K = "b32k"
+DEFAULT = B32K
+
+
+def _build_repertoire(ranges: list[tuple[int, int]], size: int) -> str:
+    chars = []
+    for first, last in ranges:
+        chars.extend(chr(code) for code in range(first, last + 1))
+    return "".join(chars[:size])
+
+
+# 32768 characters encoding 15 bits each and 128 characters encoding last 1-7 bits.
+_B32K_CHARS = _build_repertoire([(0x3400, 0x4DBF), (0x4E00, 0x9FA5), (0xAC00, 0xCFFF)], 1 << 15)
+_B32K_TAIL = _build_repertoire([(0xD000, 0xD07F)], 1 << 7)
+_B32K_VALUES = {char: value for value, char in enumerate(_B32K_CHARS)}
+_B32K_TAIL_VALUES = {char: value for value, char in enumerate(_B32K_TAIL)}
+
+
+def _b32k_encode(data: bytes) -> str:
+    out = []
+    full_blocks = len(data) - len(data) % 15
+
+    # 15 bytes = 120 bits = 8 characters.
+    for i in range(0, full_blocks, 15):
+        block = int.from_bytes(data[i:i + 15], "big")
+        for shift in range(105, -1, -15):
+            out.append(_B32K_CHARS[(block >> shift) & 0x7FFF])
+
+    acc = 0
+    bits = 0
+    for byte in data[full_blocks:]:
+        acc = (acc << 8) | byte
+        bits += 8
+        while bits >= 15:
+            bits -= 15
+            out.append(_B32K_CHARS[(acc >> bits) & 0x7FFF])
+        acc &= (1 << bits) - 1
+
+    if 0 < bits <= 7:
+        out.append(_B32K_TAIL[acc << (7 - bits)])
+    elif bits > 7:
+        out.append(_B32K_CHARS[acc << (15 - bits)])
+
+    return "".join(out)
+
+
+def _b32k_decode(text: str) -> bytes:
+    out = bytearray()
+    body_len = len(text)
+    if text and text[-1] in _B32K_TAIL_VALUES:
+        body_len -= 1
+    full_blocks = body_len - body_len % 8
+
+    for i in range(0, full_blocks, 8):
+        block = 0
+        for char in text[i:i + 8]:
+            block = (block << 15) | _B32K_VALUES[char]
+        out += block.to_bytes(15, "big")
+
+    acc = 0
+    bits = 0
+    for char in text[full_blocks:]:
+        if char in _B32K_TAIL_VALUES:
+            acc = (acc << 7) | _B32K_TAIL_VALUES[char]
+            bits += 7
+        else:
+            acc = (acc << 15) | _B32K_VALUES[char]
+            bits += 15
+
+        while bits >= 8:
+            bits -= 8
+            out.append((acc >> bits) & 0xFF)
+        acc &= (1 << bits) - 1
+
+    return bytes(out)
+
+
+@dataclass
+class Encoding:
+    name: str
+    group_chars: int  # Characters encoding `group_bytes` bytes without padding.
+    group_bytes: int
+    encode: Callable[[bytes], str]
+    decode: Callable[[str], bytes]
+
+    def chunk_chars(self, max_chars: int) -> int:
+        """ Longest chunk length (not longer than max_chars) which can be decoded independently. """
+        return max_chars - max_chars % self.group_chars
+
+
+_ENCODINGS = {
+    B64: Encoding(B64, 4, 3, lambda data: base64.b64encode(data).decode(), base64.b64decode),
+    B85: Encoding(B85, 5, 4, lambda data: base64.b85encode(data).decode(), base64.b85decode),
+    B32K: Encoding(B32K, 8, 15, _b32k_encode, _b32k_decode),
+}
+
+
+def get(name: str) -> Encoding:
+    return _ENCODINGS[name]
+
+
+def encode(name: str, data: bytes) -> str:
+    return _ENCODINGS[name].encode(data)
+
+
+def decode(name: str, text: str) -> bytes:
+    return _ENCODINGS[name].decode(text)
@@ -1,3 +1,5 @@
+from modules.filesystem import compression
+from modules.filesystem import encoding
 from modules.paths import sizeof_fmt
 
 from dataclasses import dataclass, field
@@ -28,6 +30,12 @@ class Tokens:
     OUT_DIR = "?"
 
 
+class Layout:
+    CHAIN = "c"  # Every chunk points to the next one.
+    INDEX = "i"  # Head address points to the index chain listing all chunks.
+    ATTACHMENTS = "a"  # Like INDEX, but chunks are messages with content stored in attachments.
+
+
 @dataclass
 class MemoryAddress:
     channel_id: int
@@ -40,6 +48,12 @@ class MemoryAddress:
             message_id=message.id
         )
 
+    @staticmethod
+    def from_str(raw: str) -> "MemoryAddress":
+        """ Parse address in format: channel_id:message_id """
+        channel_id, message_id = raw.split(":")
+        return MemoryAddress(channel_id, message_id)
+
     def __post_init__(self) -> None:
         self.channel_id = int(self.channel_id)
         self.message_id = int(self.message_id)
@@ -48,6 +62,32 @@ class MemoryAddress:
         return f"{self.channel_id}:{self.message_id}"
 
 
+@dataclass
+class MemoryExtent:
+    """ Run of `count` consecutive messages on a single channel starting at `message_id`. """
+    channel_id: int
+    message_id: int
+    count: int = 1
+
+    @staticmethod
+    def from_str(raw: str) -> "MemoryExtent":
+        """ Parse extent in format: channel_id:message_id[:count] """
+        return MemoryExtent(*raw.split(":"))
+
+    def __post_init__(self) -> None:
+        self.channel_id = int(self.channel_id)
+        self.message_id = int(self.message_id)
+        self.count = int(self.count)
+
+    def head(self) -> MemoryAddress:
+        return MemoryAddress(self.channel_id, self.message_id)
+
+    def prepare_mem_addr(self) -> str:
+        if self.count == 1:
+            return f"{self.channel_id}:{self.message_id}"
+        return f"{self.channel_id}:{self.message_id}:{self.count}"
+
+
 @dataclass
 class _FS_Obj:
     name: str
@@ -116,9 +156,19 @@ class _FS_Obj:
 class FS_File(_FS_Obj):
     mem_addr: MemoryAddress
     size: int
+    layout: str = Layout.CHAIN
+    codec: str = compression.RAW
+    encoding: str = encoding.B64
 
     def repr(self) -> str:
-        return f"{Tokens.TYPE_FILE}:{self.name}:{self.mem_addr.prepare_mem_addr()}:{self.size}{Tokens.END_OBJ}"
+        # Optional metadata fields, trailing default values are skipped.
+        meta = [self.layout, self.codec, self.encoding]
+        defaults = [Layout.CHAIN, compression.RAW, encoding.B64]
+        while meta and meta[-1] == defaults[len(meta) - 1]:
+            meta.pop()
+
+        meta = "".join(f":{value}" for value in meta)
+        return f"{Tokens.TYPE_FILE}:{self.name}:{self.mem_addr.prepare_mem_addr()}:{self.size}{meta}{Tokens.END_OBJ}"
 
     def path_to(self, t=[]) -> str:
         t.append(self.name)
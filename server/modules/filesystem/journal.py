@@ -0,0 +1,122 @@
+"""
+Module: journal.py
+
+Description:
+    Journal of structure mutations.
+
+    Every mkdir, file update, remove and rename is recorded as a small entry
+    instead of saving the whole structure. Entry holds it's sequence number,
+    operation, path of the changed object and operation's arguments:
+        SEQ|mkdir|~/dir
+        SEQ|file|~/dir/name|CHANNEL_ID:MESSAGE_ID|SIZE|LAYOUT|CODEC|ENCODING
+        SEQ|rm|~/dir/name
+        SEQ|rename|~/dir/name|NEW_NAME
+
+    Structure is restored by replaying entries (in sequence order) on top of
+    the last checkpoint. Entries with sequence number not greater than the
+    checkpoint's one are already included in it.
+"""
+from modules.filesystem.fs import FS_Dir, FS_File, MemoryAddress
+
+from dataclasses import dataclass
+
+
+SEP = "|"
+MKDIR = "mkdir"
+PUT_FILE = "file"
+REMOVE = "rm"
+RENAME = "rename"
+
+
+@dataclass
+class JournalEntry:
+    op: str
+    path: str
+    args: list[str]
+    seq: int = 0
+
+    def export(self) -> str:
+        return SEP.join([str(self.seq), self.op, self.path, *self.args])
+
+    @staticmethod
+    def from_str(raw: str) -> "JournalEntry | None":
+        parts = raw.split(SEP)
+        if len(parts) < 3 or not parts[0].isnumeric():
+            return None
+        return JournalEntry(parts[1], parts[2], parts[3:], int(parts[0]))
+
+
+def _split_path(path: str) -> tuple[str, str]:
+    """ Split object's path into (parent directory path, name). """
+    parent, _, name = path.rstrip("/").rpartition("/")
+    return parent or "~", name
+
+
+def _child(parent: FS_Dir, name: str) -> FS_Dir | FS_File | None:
+    for obj in [*parent.dirs, *parent.files]:
+        if obj.name == name:
+            return obj
+    return None
+
+
+def mkdir(path: str) -> JournalEntry:
+    return JournalEntry(MKDIR, path.rstrip("/"), [])
+
+
+def put_file(file: FS_File) -> JournalEntry:
+    """ Create file or update it's memory address and metadata. """
+    args = [file.mem_addr.prepare_mem_addr(), str(file.size), file.layout, file.codec, file.encoding]
+    return JournalEntry(PUT_FILE, file.path_to(), args)
+
+
+def remove(path: str) -> JournalEntry:
+    return JournalEntry(REMOVE, path.rstrip("/"), [])
+
+
+def rename(path: str, new_name: str) -> JournalEntry:
+    return JournalEntry(RENAME, path.rstrip("/"), [new_name])
+
+
+def apply(base: FS_Dir, entry: JournalEntry) -> bool:
+    """ Apply entry to the structure. Returns False if it doesn't match the structure (nothing is changed then). """
+    parent_path, name = _split_path(entry.path)
+    parent = base.move_to(parent_path)
+    if not isinstance(parent, FS_Dir) or not name:
+        return False
+
+    target = _child(parent, name)
+
+    if entry.op == MKDIR:
+        if target is not None:
+            return False
+        FS_Dir(name, parent)
+        return True
+
+    if entry.op == PUT_FILE:
+        if len(entry.args) != 5 or isinstance(target, FS_Dir):
+            return False
+
+        addr, size, layout, codec, encoding = entry.args
+        mem_addr = MemoryAddress.from_str(addr)
+
+        if target is None:
+            FS_File(name, parent, mem_addr, int(size), layout, codec, encoding)
+            return True
+
+        target.mem_addr = mem_addr
+        target.size = int(size)
+        target.layout = layout
+        target.codec = codec
+        target.encoding = encoding
+        return True
+
+    if entry.op == REMOVE:
+        return target is not None and target.remove()
+
+    if entry.op == RENAME:
+        if target is None or len(entry.args) != 1 or parent.has_object(entry.args[0]):
+            return False
+        target.name = entry.args[0]
+        return True
+
+    return False
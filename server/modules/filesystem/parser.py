@@ -9,23 +9,44 @@ TYPE_TOKENS = [Tokens.TYPE_DIR, Tokens.TYPE_FILE]
 class Parser:
     def __init__(self, raw: str) -> None:
         self.raw = raw
+        self.position = 0  # Content is read with a cursor, so parsing time is linear in structure's size.
         self.top: FS_Dir | None = None
         self.total_objects = self.raw.count(Tokens.END_OBJ)
 
     def __execute_ptr_cmds(self) -> None:
-        """ Execeute all increment pointer commands from content's start. """
-        while self.raw and self.raw[0] == Tokens.OUT_DIR:
-            self.raw = self.raw[1:]
+        """ Execeute all increment pointer commands from cursor's position. """
+        while self.position < len(self.raw) and self.raw[self.position] == Tokens.OUT_DIR:
+            self.position += 1
 
             if self.top.parent_dir is not None:
                 self.top = self.top.parent_dir
 
-    def __parse_part(self, part: str) -> list[str, int, int, Optional[int]]:
+    def __next_part(self) -> str:
+        end = self.raw.find(Tokens.END_OBJ, self.position)
+        if end == -1:
+            raise ValueError(f"Missing end of object at: {self.position}")
+
+        part = self.raw[self.position:end]
+        self.position = end + len(Tokens.END_OBJ)
+        return part
+
+    def __attach(self, obj: _FS_Obj) -> None:
+        """ Parsed objects are unique in their directory, so they are appended without membership checks. """
+        if self.top is None:
+            return
+
+        obj.parent_dir = self.top
+        if isinstance(obj, FS_File):
+            self.top.files.append(obj)
+        else:
+            self.top.dirs.append(obj)
+
+    def __parse_part(self, part: str) -> list[str, int, int, Optional[int], list[str]]:
         t = part[0]
 
         if t == Tokens.TYPE_FILE:
-            _, name, channel_id, head_id, size = part.split(":")
-            return name, int(channel_id), int(head_id), int(size)
+            _, name, channel_id, head_id, size, *meta = part.split(":")
+            return name, int(channel_id), int(head_id), int(size), meta
 
         if t == Tokens.TYPE_DIR:
             _, name = part.split(":")
@@ -36,24 +57,21 @@ class Parser:
     def __parse_single(self) -> _FS_Obj:
         self.__execute_ptr_cmds()
 
-        type_char = self.raw[0]
+        type_char = self.raw[self.position:self.position + 1]
         if type_char not in TYPE_TOKENS:
             raise ValueError(f"Invalid typechar {type_char}")
 
         if type_char == Tokens.TYPE_FILE:
-            file_data, tail = self.raw.split(Tokens.END_OBJ, 1)
-            self.raw = tail
-
-            name, ch, head, size = self.__parse_part(file_data)
+            name, ch, head, size, meta = self.__parse_part(self.__next_part())
             mem = MemoryAddress(ch, head)
-            return FS_File(name, self.top, mem, size)
+            file_obj = FS_File(name, None, mem, size, *meta)
+            self.__attach(file_obj)
+            return file_obj
 
         if type_char == Tokens.TYPE_DIR:
-            dir_data, tail = self.raw.split(Tokens.END_OBJ, 1)
-            self.raw = tail
-
-            name = self.__parse_part(dir_data)
-            dir_obj = FS_Dir(name, self.top)
+            name = self.__parse_part(self.__next_part())
+            dir_obj = FS_Dir(name, None)
+            self.__attach(dir_obj)
             self.top = dir_obj
             return dir_obj
 
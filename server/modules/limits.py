@@ -5,5 +5,39 @@ MAX_BUCKETS = 30
 MSG_SIZE = 1950  # 50 for header
 TOTAL_CHANNEL_CONTENT_SIZE = MSG_SIZE * MIN_MSG_PER_CHANNEL  # 694980 (* total channel = 1Gb)
 DISCORD_FILE_SIZE_B = 10 * 1000 * 1000  # 10MiB
+MAX_ATTACHMENTS_PER_MSG = 10
+ATTACHMENT_PART_SIZE = DISCORD_FILE_SIZE_B // MAX_ATTACHMENTS_PER_MSG
+ATTACHMENTS_TIER_MIN_SIZE = 512 * 1024  # Files stored content from this size is kept in attachments.
+MAX_PARALLEL_FETCHES = 8  # Concurrent chunk fetches per guild.
+HISTORY_BATCH_SIZE = 100  # Max messages returned by single channel history request.
+WRITE_STRIPES = 4  # Data channels written concurrently by a single write.
+MIN_STRIPE_CHUNKS = 8  # Chunks are not striped into shorter contiguous runs.
+CHUNKS_CACHE_SIZE_B = 32 * 1024 * 1024  # Budget of in-memory chunks cache per guild.
+DISK_CHUNKS_CACHE_SIZE_B = 256 * 1024 * 1024  # Budget of on-disk chunks cache per guild.
+DISK_CACHE_SEGMENT_SIZE = 8 * 1024 * 1024  # Size of on-disk chunks cache segment file.
+CACHE_FLUSH_INTERVAL = 5  # Seconds between saving changed buckets caches.
+CACHE_REBUILD_CONCURRENCY = 8  # Data channels scanned at once while rebuilding bucket cache.
+GUILDS_WARMUP_CONCURRENCY = 16  # Guilds initialized at once at startup.
+PLACEHOLDER_POOL_SIZE = 100  # Placeholder messages sent ahead of time per guild.
+PLACEHOLDER_POOL_WATERMARK = 50  # Pool is refilled when it has less placeholders.
+PLACEHOLDER_POOL_REFILL_RATE = 5  # Placeholders sent per second while refilling.
+GC_INTERVAL = 6 * 60 * 60  # Seconds between garbage collections of orphaned memory messages.
+GC_GRACE_PERIOD = 60 * 60  # Younger messages are never collected (they could belong to ongoing operation).
+GC_THROTTLE_DELAY = 1.0  # Seconds of pause after every data channel's history page scanned by garbage collector.
+BULK_DELETE_MAX_AGE = 13 * 24 * 60 * 60  # Only younger messages can be bulk deleted (Discord allows 14 days).
+DEFRAG_MAX_FILES = 10  # Files relocated by a single defragmentation job.
+DEFRAG_FREE_DELAY = 30  # Seconds old chunks of relocated file are kept for reads in progress.
+DEFRAG_PROGRESS_INTERVAL = 3  # Seconds between defragmentation progress updates in console.
+STRUCT_JOURNAL_CHECKPOINT_ENTRIES = 100  # Journal entries after which structure checkpoint is saved (and entries removed).
+
+SCHEDULER_MAX_CONCURRENCY = 16  # Discord requests running at once per guild.
+SCHEDULER_MIN_CONCURRENCY = 2
+RATE_LIMIT_RETRY_AFTER = 1.0  # Seconds to wait before retrying request which got 429 response.
+ROUTES_RATE_LIMITS = {  # Route: (requests per second, burst) per channel.
+    "send": (1.0, 5),
+    "edit": (1.0, 5),
+    "delete": (1.0, 5),
+}
+DEFAULT_ROUTE_RATE_LIMIT = (50.0, 50)
 
 MAX_ACCESS_TOKENS = 3
\ No newline at end of file
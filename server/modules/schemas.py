@@ -37,10 +37,18 @@ class Write(Path):
     content: str
     
 
+class Patch(Write):
+    offset: int
+    
+
 class DebugIndex(Auth):
     index: int = 0
     
     
+class DebugDefrag(Auth):
+    files: int = 10
+    
+    
 class DebugPath(Auth):
     path: str
     
\ No newline at end of file